@@ -1,16 +1,20 @@
-from flask import Flask, request, jsonify, send_from_directory, g
+from flask import Flask, request, jsonify, send_from_directory, g, Response
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+import atexit
 import os
 from dotenv import load_dotenv, find_dotenv
 import hashlib
 import jwt
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 from flask_cors import cross_origin
 import pymysql
 import base64
 from functools import wraps
 import io
+import logging
+import threading
+import time
 from PIL import Image
 
 # Import SQLAlchemy engine utilities for dynamic role switching
@@ -19,12 +23,41 @@ from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy import text
 from sqlalchemy import delete as sa_delete
 from sqlalchemy.orm import aliased  # Add aliasing for message joins
+from sqlalchemy import case, insert as sa_insert, select as sa_select, update as sa_update
+
+from db_engines import EngineRegistry, ROLES
+from session_router import RoutingSession, SessionRouter, replica_targets_from_env
+from db_backends import backend_from_env
+from request_profiler import init_profiler
+from metrics import TimedQueuePool, image_timer, init_metrics, registry as metrics_registry
+from message_stream import BACKLOG_LIMIT, init_message_stream, stream_events
+from app_logging import get_logger, setup_logging
+from lazy_index import LazyIndex, init_all as init_indexes
+from search_index import REFRESH_SECONDS as SEARCH_REFRESH_SECONDS, SearchIndex
+from facets import FACETS, REFRESH_SECONDS as FACETS_REFRESH_SECONDS, FacetIndex, page as facet_page
+from autocomplete import REFRESH_SECONDS as AUTOCOMPLETE_REFRESH_SECONDS, PrefixIndex, fold, \
+    MAX_RESULTS as AUTOCOMPLETE_MAX_RESULTS
+from geo_index import REFRESH_SECONDS as GEO_REFRESH_SECONDS, GridIndex
+from geocoder import geocoder_from_env, safe_geocode
+import order_export
+from menu_import import MenuError, diff_menu, parse_menu
+from idempotency import KeyConflict, KeyInFlight, MAX_KEY_LENGTH as IDEMPOTENCY_MAX_KEY_LENGTH, \
+    fingerprint as request_fingerprint, idempotency_from_env, scope_key
+from message_writer import ACK_TIMEOUT_SECONDS as MESSAGE_ACK_TIMEOUT_SECONDS, IdAllocator, MessageWriter, \
+    QueueFull, WRITE_ACK as MESSAGE_WRITE_ACK, WRITE_BEHIND as MESSAGE_WRITE_BEHIND
 
 # Load environment variables from project root .env file
 load_dotenv(find_dotenv())
 
+# Queue-backed structured logging (see app_logging.py)
+setup_logging()
+log = get_logger('app')
+db_log = get_logger('db')
+auth_log = get_logger('auth')
+
 app = Flask(__name__, static_folder='../frontend-react/build', static_url_path='')
 CORS(app)  # Enable CORS for all routes
+init_profiler(app)  # Server-Timing headers and slow-query log (see request_profiler.py)
 JWT_SECRET = os.getenv('JWT_SECRET', 'your-secret-key')  # Add this to your .env file
 
 # Load primary admin credentials
@@ -42,39 +75,105 @@ DB_CUSTOMER_PASSWORD = os.getenv('CUSTOMER_PASSWORD')
 DB_RESTAURANT_USER = os.getenv('RESTAURANT_USER')
 DB_RESTAURANT_PASSWORD = os.getenv('RESTAURANT_PASSWORD')
 
+# Database credentials for each role
+ROLE_CREDENTIALS = {
+    'guest': (DB_GUEST_USER, DB_GUEST_PASSWORD),
+    'customer': (DB_CUSTOMER_USER, DB_CUSTOMER_PASSWORD),
+    'restaurant': (DB_RESTAURANT_USER, DB_RESTAURANT_PASSWORD),
+    'admin': (DB_ADMIN_USER, DB_ADMIN_PASSWORD),
+}
+
+# Cloud SQL by default; DB_BACKEND=sqlite runs everything on a local file (see db_backends.py)
+backend = backend_from_env(ROLE_CREDENTIALS, DB_HOST, DB_PORT, DB_NAME)
+
 # Configure SQLAlchemy with default guest role
-app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql+pymysql://{DB_GUEST_USER}:{DB_GUEST_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+app.config['SQLALCHEMY_DATABASE_URI'] = backend.role_uri('guest')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_size': 10,
-    'pool_recycle': 3600,
-    'pool_pre_ping': True,
-    'connect_args': {'ssl': {'ca': None}}  # Use SSL but don't verify certificate
+    'pool_recycle': 1800,
+    **backend.engine_options()
 }
 
 # Initialize SQLAlchemy
 db = SQLAlchemy(app)
 
-# Create SQLAlchemy engines for each role
-uri_guest = f"mysql+pymysql://{DB_GUEST_USER}:{DB_GUEST_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-uri_customer = f"mysql+pymysql://{DB_CUSTOMER_USER}:{DB_CUSTOMER_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-uri_restaurant = f"mysql+pymysql://{DB_RESTAURANT_USER}:{DB_RESTAURANT_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-uri_admin = f"mysql+pymysql://{DB_ADMIN_USER}:{DB_ADMIN_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-
-# Engine options reused from config
-engine_opts = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
-
-# Instantiate engines
-engine_guest = create_engine(uri_guest, **engine_opts)
-engine_customer = create_engine(uri_customer, **engine_opts)
-engine_restaurant = create_engine(uri_restaurant, **engine_opts)
-engine_admin = create_engine(uri_admin, **engine_opts)
-
-# Scoped session bound to guest by default
-SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine_guest))
+# Per-role engines with their own pool settings (see db_engines.py).
+# Admin is only used for signup/login, so its engine is created on first use.
+engines = EngineRegistry(backend.role_uri, base_options={**backend.engine_options(), 'poolclass': TimedQueuePool},
+                         configure_engine=backend.configure_engine)
+engines.create_eager()
+
+# Optionally pre-open connections for the hot roles in the background.
+# Under a pre-fork server (APP_PREFORK=true) the master never serves requests,
+# so only the workers warm up (gunicorn.conf.py post_fork).
+POOL_WARMUP = os.getenv('DB_POOL_WARMUP', 'false').lower() == 'true'
+PREFORK = os.getenv('APP_PREFORK', 'false').lower() == 'true'
+
+def start_pool_warmup():
+    threading.Thread(target=engines.warmup, name='db-pool-warmup', daemon=True).start()
+
+if POOL_WARMUP and not PREFORK:
+    start_pool_warmup()
+
+def __getattr__(name):
+    # Keeps api.engine_guest / engine_customer / ... working without forcing
+    # lazy engines to be created at import time
+    if name.startswith('engine_') and name[len('engine_'):] in ROLES:
+        return engines.get(name[len('engine_'):])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def replica_uri(role, target):
+    # DB_REPLICA_URLS entries are full URLs, DB_REPLICA_HOSTS entries are backend specific
+    if replica_mode == 'urls':
+        return target
+    return backend.replica_uri(role, target)
+
+# Route GET traffic to read replicas (if configured) and writes to the primary
+replica_mode, replica_targets = replica_targets_from_env()
+router = SessionRouter(engines, replica_uri_for_role=replica_uri, replica_targets=replica_targets)
+router.start_health_checks()
+
+# /metrics with per-route latency histograms and pool gauges (see metrics.py)
+init_metrics(app, engines, router)
+
+# Pushes committed messages to open /api/customers/messages/stream connections
+message_bus = init_message_stream()
+metrics_registry.add_collector(lambda: [('sse_streams', (), message_bus.subscriber_count())])
+
+# Scoped session; the engine is picked per statement from the role on flask.g
+SessionLocal = scoped_session(sessionmaker(class_=RoutingSession, router=router, autocommit=False, autoflush=False))
 # Override Flask-SQLAlchemy session
 db.session = SessionLocal
 
+def reset_after_fork():
+    """Runs in every forked child (gunicorn workers, multiprocessing, ...).
+
+    Pooled connections and sessions inherited from the parent share its sockets,
+    so the child drops them and opens its own on first use.
+    """
+    engines.after_fork()
+    router.after_fork()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    # Forget the parent's session without closing it (closing would roll back on its connection)
+    SessionLocal.registry.clear()
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+# EventSource cannot send an Authorization header, so these paths also accept ?token=
+QUERY_TOKEN_PATHS = ('/api/customers/messages/stream',)
+
+def request_token():
+    """Returns the bearer token of the current request, or None."""
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        return auth_header.split(' ', 1)[1]
+    if request.path in QUERY_TOKEN_PATHS:
+        return request.args.get('token')
+    return None
+
 # DATABASE ROLE BINDING - This happens on EVERY request
 @app.before_request
 def bind_database_role():
@@ -84,37 +183,49 @@ def bind_database_role():
     """
     path = request.path
     
+    user_key = None
+
     # CASE 1: Auth endpoints - Need admin role to create accounts
     if path.startswith('/api/auth/signup') or path.startswith('/api/auth/login'):
         # Admin role for auth operations
         role = "admin"
-        engine = engine_admin
         
     # CASE 2: Token endpoints - Customer or Restaurant based on JWT token
     else:
         # Default to guest
         role = "guest"
-        engine = engine_guest
         
         # Check for JWT token
-        auth_header = request.headers.get('Authorization', '')
-        if auth_header and auth_header.startswith('Bearer '):
-            token = auth_header.split(' ', 1)[1]
+        token = request_token()
+        if token:
             payload = verify_token(token)
             
             # If valid token, use its account type
             if payload and 'accountType' in payload:
                 account_type = payload['accountType']
+                user_key = (account_type, payload['sub'])
                 if account_type == 'customer':
                     role = "customer"
-                    engine = engine_customer
                 elif account_type == 'restaurant':
                     role = "restaurant"
-                    engine = engine_restaurant
     
-    # Apply the binding - This gets invoked on every request
-    SessionLocal.configure(bind=engine)
-    print(f"[DB ROLE] {role.upper()} role applied for {request.method} {path}")
+    # Apply the binding - RoutingSession reads these on every statement.
+    # GETs go to a replica unless this user wrote within the sticky window.
+    g.db_role = role
+    g.db_user_key = user_key
+    g.db_read_only = (
+        request.method in ('GET', 'HEAD')
+        and not (user_key and router.reads_pinned(user_key))
+    )
+    db_log.debug("%s role applied for %s %s", role, request.method, path)
+
+@app.after_request
+def pin_reads_after_write(response):
+    # After a successful write, send this user's reads to the primary for a while
+    user_key = g.get('db_user_key')
+    if user_key and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        router.note_write(user_key)
+    return response
 
 # Define models
 class Customer(db.Model):
@@ -129,6 +240,8 @@ class Customer_Address(db.Model):
     __tablename__ = 'Customer_Address'
     CustomerID = db.Column(db.Integer, db.ForeignKey('Customer.CustomerID'), primary_key = True)
     Address = db.Column(db.String(255), primary_key = True)
+    Latitude = db.Column(db.Float, nullable=True)
+    Longitude = db.Column(db.Float, nullable=True)
 
 class RestaurantAccount(db.Model):
     __tablename__ = 'Restaurant_Account'
@@ -146,6 +259,29 @@ class Restaurant(db.Model):
     PhoneNumber = db.Column(db.String(20), nullable=True)
     Address = db.Column(db.String(200), nullable=True)
     AccountID = db.Column(db.Integer, db.ForeignKey('Restaurant_Account.AccountID'), nullable=True)
+    PriceRange = db.Column(db.String(20), nullable=True)
+    Latitude = db.Column(db.Float, nullable=True)
+    Longitude = db.Column(db.Float, nullable=True)
+
+class Cuisine(db.Model):
+    __tablename__ = 'Cuisine'
+    CuisineID = db.Column(db.Integer, primary_key=True)
+    Name = db.Column(db.String(50), nullable=True)
+
+class RestaurantCuisine(db.Model):
+    __tablename__ = 'RestaurantCuisine'
+    RestaurantID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    CuisineID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+class Feature(db.Model):
+    __tablename__ = 'Feature'
+    FeatureID = db.Column(db.Integer, primary_key=True)
+    Name = db.Column(db.String(50), nullable=True)
+
+class RestaurantFeature(db.Model):
+    __tablename__ = 'RestaurantFeature'
+    RestaurantID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    FeatureID = db.Column(db.Integer, primary_key=True, autoincrement=False)
 
 class Food(db.Model):
     __tablename__ = 'Food'
@@ -153,6 +289,8 @@ class Food(db.Model):
     FoodName = db.Column(db.String(100), nullable=False)
     Price = db.Column(db.Float, nullable=False)
     RestaurantID = db.Column(db.Integer, db.ForeignKey('Restaurant.RestaurantID'), nullable=False)
+    # Indexes from migrations/004_advisor_indexes.sql (index_advisor.py)
+    __table_args__ = (db.Index('idx_food_restaurantid', 'RestaurantID'),)
 
 class Orders(db.Model):
     __tablename__ = 'Orders'
@@ -161,12 +299,79 @@ class Orders(db.Model):
     RestaurantID = db.Column(db.Integer, db.ForeignKey('Restaurant.RestaurantID'), nullable=False)
     PriceTotal = db.Column(db.Float, nullable=False)
     Additional_Costs = db.Column(db.Float, nullable=True, default=0)
+    # Drives archival (archive.py); NULL for orders placed before it was added
+    OrderDate = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (
+        db.Index('idx_orders_customerid_orderid', 'CustomerID', 'OrderID'),
+        db.Index('idx_orders_restaurantid_orderid', 'RestaurantID', 'OrderID'),
+    )
 
 class FoodOrders(db.Model):
     __tablename__ = 'FoodOrders'
     OrderID = db.Column(db.Integer, db.ForeignKey('Orders.OrderID'), primary_key=True)
     FoodID = db.Column(db.Integer, db.ForeignKey('Food.FoodID'), primary_key=True)
     Quantity = db.Column(db.Integer, nullable=False)
+    __table_args__ = (db.Index('idx_foodorders_foodid', 'FoodID'),)
+
+# Cold copies of Orders/FoodOrders/Messages filled by archive.py. Every archived
+# ID is below every hot ID, so paged reads continue here once the hot rows run out.
+class OrdersArchive(db.Model):
+    __tablename__ = 'Orders_Archive'
+    OrderID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    CustomerID = db.Column(db.Integer, nullable=False)
+    RestaurantID = db.Column(db.Integer, nullable=False)
+    PriceTotal = db.Column(db.Float, nullable=False)
+    Additional_Costs = db.Column(db.Float, nullable=True)
+    OrderDate = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (
+        db.Index('idx_orders_archive_customer', 'CustomerID', 'OrderID'),
+        db.Index('idx_orders_archive_restaurant', 'RestaurantID', 'OrderID'),
+    )
+
+class FoodOrdersArchive(db.Model):
+    __tablename__ = 'FoodOrders_Archive'
+    OrderID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    FoodID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    Quantity = db.Column(db.Integer, nullable=False)
+
+# Daily sales rollups (UTC days) for the analytics endpoints. create_order adds
+# to them in its own transaction; rollups.py rebuilds them from Orders and the
+# archive. They outlive archiving, so analytics cover the whole history.
+class RestaurantDailySales(db.Model):
+    __tablename__ = 'Restaurant_Daily_Sales'
+    RestaurantID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    Day = db.Column(db.Date, primary_key=True)
+    OrderCount = db.Column(db.Integer, nullable=False)
+    Revenue = db.Column(db.Double, nullable=False)
+    AdditionalCosts = db.Column(db.Double, nullable=False)
+
+class FoodDailySales(db.Model):
+    __tablename__ = 'Food_Daily_Sales'
+    RestaurantID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    Day = db.Column(db.Date, primary_key=True)
+    FoodID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    OrderCount = db.Column(db.Integer, nullable=False)
+    Quantity = db.Column(db.Integer, nullable=False)
+    # delete_food removes a dish's rows across restaurants and days
+    __table_args__ = (db.Index('idx_food_daily_sales_food', 'FoodID'),)
+
+def sales_upserts(restaurant_id, day, price_total, additional_costs, quantities):
+    """Statements adding one order to the rollups; quantities is {FoodID: quantity}."""
+    statements = [backend.bulk_upsert(
+        RestaurantDailySales.__table__,
+        [{'RestaurantID': restaurant_id, 'Day': day, 'OrderCount': 1,
+          'Revenue': price_total, 'AdditionalCosts': additional_costs}],
+        ['RestaurantID', 'Day'], [], increment=['OrderCount', 'Revenue', 'AdditionalCosts'],
+    )]
+    if quantities:
+        # Ascending FoodID, so concurrent orders lock the dish rows in the same order
+        statements.append(backend.bulk_upsert(
+            FoodDailySales.__table__,
+            [{'RestaurantID': restaurant_id, 'Day': day, 'FoodID': food_id, 'OrderCount': 1, 'Quantity': quantity}
+             for food_id, quantity in sorted(quantities.items())],
+            ['RestaurantID', 'Day', 'FoodID'], [], increment=['OrderCount', 'Quantity'],
+        ))
+    return statements
 
 class Messages(db.Model):
     __tablename__ = 'Messages'
@@ -175,6 +380,167 @@ class Messages(db.Model):
     RecipientID = db.Column(db.Integer, nullable=False)
     Timestamp = db.Column('Datetime', db.DateTime, nullable=False)
     Contents = db.Column('Content', db.Text, nullable=False)
+    # Serves the per-thread history in both directions, newest first by (Datetime, MessageID)
+    __table_args__ = (
+        db.Index('idx_messages_pair_time', 'SenderID', 'RecipientID', 'Datetime', 'MessageID'),
+        db.Index('idx_messages_senderid_datetime', 'SenderID', 'Datetime'),
+        db.Index('idx_messages_recipientid_datetime', 'RecipientID', 'Datetime'),
+    )
+
+class MessagesArchive(db.Model):
+    __tablename__ = 'Messages_Archive'
+    MessageID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    SenderID = db.Column(db.Integer, nullable=False)
+    RecipientID = db.Column(db.Integer, nullable=False)
+    Timestamp = db.Column('Datetime', db.DateTime, nullable=False)
+    Contents = db.Column('Content', db.Text, nullable=False)
+    __table_args__ = (db.Index('idx_messages_archive_pair_time', 'SenderID', 'RecipientID', 'Datetime', 'MessageID'),)
+
+PREVIEW_LENGTH = 140
+
+class Conversation(db.Model):
+    """Inbox entry per customer pair, kept current by create_message."""
+    __tablename__ = 'Conversation'
+    # Participants are stored ordered (CustomerA < CustomerB) so each pair has one row
+    CustomerA = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    CustomerB = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    LastMessageID = db.Column(db.Integer, nullable=False)
+    LastMessageAt = db.Column(db.DateTime, nullable=False)
+    Preview = db.Column(db.String(PREVIEW_LENGTH), nullable=False)
+    UnreadA = db.Column(db.Integer, nullable=False, default=0)
+    UnreadB = db.Column(db.Integer, nullable=False, default=0)
+    # The inbox is ordered by (LastMessageAt, LastMessageID): MessageIDs from
+    # write-behind blocks are unique but not in time order across workers
+    __table_args__ = (
+        db.Index('idx_conversation_a_latest', 'CustomerA', 'LastMessageAt', 'LastMessageID'),
+        db.Index('idx_conversation_b_latest', 'CustomerB', 'LastMessageAt', 'LastMessageID'),
+    )
+
+def conversation_key(customer_id, other_id):
+    """Returns (CustomerA, CustomerB) for a pair."""
+    return (customer_id, other_id) if customer_id < other_id else (other_id, customer_id)
+
+def message_order(message):
+    """Sort key for "newer": (Timestamp, MessageID)."""
+    return message.Timestamp, message.MessageID
+
+def conversation_upsert(a, b, message, unread_a, unread_b):
+    """Upsert moving pair (a, b) to `message` and adding to both unread counts.
+
+    A single statement, so concurrent first messages between two customers
+    cannot create duplicate rows. The row only moves to `message` if it is
+    newer by (Timestamp, MessageID), so a batch committed late by another
+    worker cannot turn an older message into the last one.
+    """
+    preview = message.Contents[:PREVIEW_LENGTH]
+    values = {'CustomerA': a, 'CustomerB': b, 'LastMessageID': message.MessageID,
+              'LastMessageAt': message.Timestamp, 'Preview': preview, 'UnreadA': unread_a, 'UnreadB': unread_b}
+    newer = (Conversation.LastMessageAt < message.Timestamp) | (
+        (Conversation.LastMessageAt == message.Timestamp) & (Conversation.LastMessageID < message.MessageID))
+    # In this order: MySQL assignments see the columns set before them, and
+    # only LastMessageAt (set last) is compared without looking at LastMessageID
+    update = {
+        'Preview': case((newer, preview), else_=Conversation.Preview),
+        'LastMessageID': case((newer, message.MessageID), else_=Conversation.LastMessageID),
+        'LastMessageAt': case((Conversation.LastMessageAt < message.Timestamp, message.Timestamp),
+                              else_=Conversation.LastMessageAt),
+    }
+    if unread_a:
+        update['UnreadA'] = Conversation.UnreadA + unread_a
+    if unread_b:
+        update['UnreadB'] = Conversation.UnreadB + unread_b
+    return backend.upsert(Conversation.__table__, values, ['CustomerA', 'CustomerB'], update)
+
+def unread_for(a, b, message):
+    """(UnreadA, UnreadB) increments for one message; messages to yourself are never unread."""
+    if a == b:
+        return 0, 0
+    return (1, 0) if message.RecipientID == a else (0, 1)
+
+def record_conversation_message(message):
+    """Moves the pair's conversation to `message` in the caller's transaction."""
+    a, b = conversation_key(message.SenderID, message.RecipientID)
+    db.session.execute(conversation_upsert(a, b, message, *unread_for(a, b, message)))
+
+def conversation_upserts(messages):
+    """One upsert per customer pair for a batch of messages."""
+    pairs = {}
+    for message in messages:
+        a, b = conversation_key(message.SenderID, message.RecipientID)
+        unread_a, unread_b = unread_for(a, b, message)
+        latest, total_a, total_b = pairs.get((a, b), (message, 0, 0))
+        if message_order(message) > message_order(latest):
+            latest = message
+        pairs[(a, b)] = (latest, total_a + unread_a, total_b + unread_b)
+    # Fixed order, so two batches touching the same pairs cannot deadlock
+    return [conversation_upsert(a, b, *entry) for (a, b), entry in sorted(pairs.items(), key=lambda p: p[0])]
+
+def write_message_batch(messages):
+    """Writes queued messages (one multi-row INSERT) and their conversations in one transaction."""
+    # Keyed by column name: Timestamp and Contents are stored as Datetime and Content
+    rows = [{
+        'MessageID': m.MessageID,
+        'SenderID': m.SenderID,
+        'RecipientID': m.RecipientID,
+        'Datetime': m.Timestamp,
+        'Content': m.Contents,
+    } for m in messages]
+    with engines.get('customer').begin() as connection:
+        connection.execute(sa_insert(Messages.__table__).values(rows))
+        for statement in conversation_upserts(messages):
+            connection.execute(statement)
+
+def rebuild_conversations(connection):
+    """Recreates every Conversation row from Messages (history counts as read)."""
+    a = case((Messages.SenderID < Messages.RecipientID, Messages.SenderID), else_=Messages.RecipientID)
+    b = case((Messages.SenderID < Messages.RecipientID, Messages.RecipientID), else_=Messages.SenderID)
+    # Each pair's newest message by (Timestamp, MessageID), as conversation_upsert orders them
+    ranked = sa_select(
+        a.label('a'), b.label('b'), Messages.MessageID.label('message_id'), Messages.Timestamp.label('at'),
+        db.func.substr(Messages.Contents, 1, PREVIEW_LENGTH).label('preview'),
+        db.func.row_number().over(partition_by=(a, b),
+                                  order_by=(Messages.Timestamp.desc(), Messages.MessageID.desc())).label('newest')
+    ).subquery()
+    rows = sa_select(ranked.c.a, ranked.c.b, ranked.c.message_id, ranked.c.at, ranked.c.preview,
+                     db.literal(0), db.literal(0)).where(ranked.c.newest == 1)
+    table = Conversation.__table__
+    connection.execute(sa_delete(table))
+    connection.execute(sa_insert(table).from_select(
+        ['CustomerA', 'CustomerB', 'LastMessageID', 'LastMessageAt', 'Preview', 'UnreadA', 'UnreadB'], rows
+    ))
+
+class IdBlock(db.Model):
+    """Next unreserved ID per table, for write-behind ID allocation."""
+    __tablename__ = 'Id_Block'
+    Name = db.Column(db.String(64), primary_key=True)
+    NextID = db.Column(db.Integer, nullable=False)
+
+class IdempotencyKey(db.Model):
+    """Responses kept for Idempotency-Key retries when IDEMPOTENCY_STORE=database."""
+    __tablename__ = 'Idempotency_Key'
+    # sha256 of the user and their key; Status is NULL while the first request runs
+    KeyHash = db.Column(db.String(64), primary_key=True)
+    Fingerprint = db.Column(db.String(64), nullable=False)
+    Status = db.Column(db.SmallInteger, nullable=True)
+    ContentType = db.Column(db.String(100), nullable=True)
+    Body = db.Column(db.Text, nullable=True)
+    ExpiresAt = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (db.Index('idx_idempotency_key_expires', 'ExpiresAt'),)
+
+# Top-N neighbours written by recommendations.py; read by (ID, Rank) range
+class FoodNeighbor(db.Model):
+    __tablename__ = 'Food_Neighbors'
+    FoodID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    Rank = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    NeighborID = db.Column(db.Integer, nullable=False)
+    Score = db.Column(db.Float, nullable=False)
+
+class RestaurantNeighbor(db.Model):
+    __tablename__ = 'Restaurant_Neighbors'
+    RestaurantID = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    Rank = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    NeighborID = db.Column(db.Integer, nullable=False)
+    Score = db.Column(db.Float, nullable=False)
 
 class Review(db.Model):
     __tablename__ = 'Review'
@@ -184,12 +550,26 @@ class Review(db.Model):
     Rating = db.Column(db.Integer, nullable=False)
     ReviewContent = db.Column(db.Text, nullable=True)
     Date = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (
+        db.Index('idx_review_restaurantid_date', 'RestaurantID', 'Date'),
+        db.Index('idx_review_customerid_date', 'CustomerID', 'Date'),
+    )
 
 class FrontPage(db.Model):
     __tablename__ = 'Front_Page'
     RestaurantID = db.Column(db.Integer, db.ForeignKey('Restaurant.RestaurantID'), primary_key=True)
     PushPoints = db.Column(db.Integer, nullable=False)
     Date = db.Column(db.DateTime, nullable=False)
+    # 1 = top slot; written by front_page.py, NULL for rows it has not ranked
+    SlotRank = db.Column(db.Integer, nullable=True)
+
+class FrontPageBoost(db.Model):
+    """Push points bought by a restaurant; front_page.py decays them over time."""
+    __tablename__ = 'Front_Page_Boost'
+    BoostID = db.Column(db.Integer, primary_key=True)
+    RestaurantID = db.Column(db.Integer, db.ForeignKey('Restaurant.RestaurantID'), nullable=False)
+    Points = db.Column(db.Integer, nullable=False)
+    PurchasedAt = db.Column(db.DateTime, nullable=False)
 
 class Photo(db.Model):
     __tablename__ = 'Photo'
@@ -197,14 +577,16 @@ class Photo(db.Model):
     RestaurantID = db.Column(db.Integer, db.ForeignKey('Restaurant.RestaurantID'))
     PhotoImage = db.Column(db.Text, nullable=False)
 
+# Local backends create any missing tables on startup; no-op for Cloud SQL, which
+# then never builds the admin engine (lazy by default, see db_engines.py)
+backend.prepare_schema(db.metadata, lambda: engines.get('admin'))
+
 def hash_password(password):
     # Ensure the password is a string and encode it consistently
     password_str = str(password).encode('utf-8')
     return hashlib.sha256(password_str).hexdigest()
 
 def check_password(input_password, stored_password):
-    print(f"Checking password hash: {hash_password(input_password)}")
-    print(f"Against stored hash: {stored_password}")
     return hash_password(input_password) == stored_password
 
 def generate_token(user_id, account_type):
@@ -217,7 +599,7 @@ def generate_token(user_id, account_type):
         }
         return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
     except Exception as e:
-        print(f"Error generating token: {e}")
+        log.error("Error generating token: %s", e)
         return None
 
 def verify_token(token):
@@ -229,13 +611,13 @@ def verify_token(token):
              raise jwt.InvalidTokenError("Token missing required claims.")
         return payload
     except jwt.ExpiredSignatureError:
-        print("Token expired.")
+        auth_log.debug("Token expired.")
         return None
     except jwt.InvalidTokenError as e:
-        print(f"Invalid token: {e}")
+        auth_log.debug("Invalid token: %s", e)
         return None
     except Exception as e:
-        print(f"Token verification error: {e}")
+        log.error("Token verification error: %s", e)
         return None
 
 # Serve React App
@@ -303,6 +685,8 @@ def signup():
             message = "Customer account created successfully"
         
         db.session.commit()
+        if account_type == 'customer':
+            update_autocomplete('customers', lambda index: index.add(account_id, data['username']))
         
         return jsonify({
             "message": message,
@@ -311,7 +695,7 @@ def signup():
         }), 201
     except Exception as e:
         db.session.rollback()
-        print(f"Signup error: {str(e)}")
+        log.error("Signup error: %s", e)
         return jsonify({"error": str(e)}), 500
 
 def handle_options():
@@ -331,7 +715,7 @@ def login():
         username_or_email = data.get('username')
         password = data.get('password')
 
-        print(f"Login attempt for username/email: {username_or_email}")
+        auth_log.debug("Login attempt for username/email: %s", username_or_email)
         
         # Initialize user data
         user_obj = None
@@ -357,8 +741,7 @@ def login():
                  account_type = 'restaurant'
                  account_id = restaurant_acc.AccountID
 
-        print(f"Database query result: {user_obj}")
-        print(f"Account type found: {account_type}")
+        auth_log.debug("Login lookup result: %s (account type %s)", user_obj, account_type)
 
         # Handle successful authentication
         if user_obj and account_type and account_id is not None:
@@ -390,16 +773,14 @@ def login():
              if restaurant_acc and not check_password(password, restaurant_acc.Password):
                  return jsonify({'error': 'Invalid password for restaurant account'}), 401
              elif not restaurant_acc:
-                  print("User not found in either table")
+                  auth_log.debug("User not found in either table")
                   return jsonify({'error': 'User not found'}), 401
         else:
-            print("Login failed for unknown reason")
+            auth_log.debug("Login failed for unknown reason")
             return jsonify({'error': 'Login failed - invalid credentials'}), 401
 
     except Exception as e:
-        print(f"Login error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Login error: %s", e)
         return jsonify({'error': 'Login failed due to server error'}), 500
 
 # Decorator for requiring JWT token
@@ -408,23 +789,25 @@ def token_required(f):
     def decorated(*args, **kwargs):
         token = None
         auth_header = request.headers.get('Authorization')
-        print(f"[Auth Debug] Received Authorization header: {auth_header}") # Log header
+        # Auth tracing is off unless AUTH_DEBUG / SIGUSR1 enables it; the header itself is never logged
+        auth_log.debug("Authorization header present: %s", auth_header is not None)
         
         if auth_header and auth_header.startswith("Bearer "):
             try:
                 token = auth_header.split(" ")[1]
-                print(f"[Auth Debug] Extracted Token: {token[:10]}...") # Log first part of token
             except IndexError:
-                print("[Auth Debug] Error: Invalid Bearer format.")
+                auth_log.debug("Invalid Bearer format.")
                 return jsonify({'message': 'Invalid Authorization header format. Use Bearer token.'}), 401
+        elif request.path in QUERY_TOKEN_PATHS:
+            token = request.args.get('token')
         else:
-             print("[Auth Debug] Warning: Authorization header missing or not Bearer type.")
+             auth_log.debug("Authorization header missing or not Bearer type.")
 
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
 
         payload = verify_token(token)
-        print(f"[Auth Debug] verify_token payload: {payload}") # Log verification result
+        auth_log.debug("verify_token payload: %s", payload)
         
         if not payload:
              return jsonify({'message': 'Token is invalid or expired!'}), 401
@@ -432,7 +815,6 @@ def token_required(f):
         try:
             user_id = payload['sub']
             account_type = payload['accountType']
-            print(f"[Auth Debug] Token UserID: {user_id}, AccountType: {account_type}") # Log extracted info
             
             current_user_obj = None
             if account_type == 'customer':
@@ -440,10 +822,10 @@ def token_required(f):
             elif account_type == 'restaurant':
                 current_user_obj = RestaurantAccount.query.get(user_id)
             
-            print(f"[Auth Debug] Loaded user object: {current_user_obj}") # Log loaded user
+            auth_log.debug("Loaded %s %s for token: %s", account_type, user_id, current_user_obj)
             
             if not current_user_obj:
-                 print("[Auth Debug] Error: User from token not found in DB.")
+                 auth_log.debug("User from token not found in DB.")
                  return jsonify({'message': 'User associated with token not found!'}), 401
 
             g.current_user = {
@@ -452,14 +834,11 @@ def token_required(f):
                 'username': current_user_obj.Username,
                 'object': current_user_obj
             }
-            print(f"[Auth Debug] Set g.current_user: {g.current_user}") # Log context
             # Database binding is handled in before_request; not binding here
-            print(f"[Auth Debug] Returning to view function: {f.__name__}")
+            auth_log.debug("Authenticated %s %s for %s", account_type, user_id, f.__name__)
             return f(*args, **kwargs)
         except Exception as e:
-             print(f"[Auth Debug] Error loading user from token: {e}")
-             import traceback
-             traceback.print_exc()
+             log.exception("Error loading user from token: %s", e)
              return jsonify({'message': 'Error processing token user data!'}), 500
 
     return decorated
@@ -469,9 +848,8 @@ def require_customer(f):
      @wraps(f)
      @token_required # Ensures token is valid and g.current_user is set
      def decorated(*args, **kwargs):
-         print(f"[Auth Debug] require_customer checking user type: {g.current_user.get('type') if hasattr(g, 'current_user') else 'g.current_user not set'}") # Log type check
          if not hasattr(g, 'current_user') or g.current_user.get('type') != 'customer':
-             print("[Auth Debug] Access Denied: Customer role required.")
+             auth_log.debug("Access denied: customer role required for %s", f.__name__)
              return jsonify({'message': 'Access denied: Customer role required.'}), 403
          return f(*args, **kwargs)
      return decorated
@@ -485,6 +863,299 @@ def require_restaurant(f):
          return f(*args, **kwargs)
      return decorated
 
+# Retried POSTs with an Idempotency-Key get the first response back (see idempotency.py)
+idempotency = idempotency_from_env(IdempotencyKey.__table__, lambda: router.primary(g.db_role))
+
+def idempotent(f):
+    """Runs f once per Idempotency-Key; apply below require_customer/require_restaurant."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return f(*args, **kwargs)
+        if not 0 < len(key) <= IDEMPOTENCY_MAX_KEY_LENGTH:
+            return jsonify({'error': f'Idempotency-Key must be 1 to {IDEMPOTENCY_MAX_KEY_LENGTH} characters'}), 400
+        scope = scope_key(g.current_user['type'], g.current_user['id'], key)
+        try:
+            stored = idempotency.begin(scope, request_fingerprint(request.method, request.path, request.get_data()))
+        except KeyConflict:
+            return jsonify({'error': 'This Idempotency-Key was already used for a different request'}), 422
+        except KeyInFlight:
+            response = jsonify({'error': 'A request with this Idempotency-Key is still in progress'})
+            response.headers['Retry-After'] = '1'
+            return response, 409
+        except Exception as e:
+            log.error("Error checking Idempotency-Key for %s: %s", request.path, e)
+            return jsonify({'error': str(e)}), 500
+        if stored is not None:
+            status, body, content_type = stored
+            response = Response(body, status=status, content_type=content_type)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        response = None
+        try:
+            response = app.make_response(f(*args, **kwargs))
+            return response
+        finally:
+            # Without a response (an exception) or with a 5xx the key is released for the retry
+            idempotency.finish(scope, None if response is None else
+                               (response.status_code, response.get_data(), response.content_type))
+    return decorated
+
+# In-memory restaurant/menu search for /api/search (see search_index.py).
+# Like the other LazyIndexes below, writes keep it current (see lazy_index.py).
+def load_search_index():
+    with engines.get('guest').connect() as connection:
+        restaurants = connection.execute(sa_select(
+            Restaurant.RestaurantID, Restaurant.RestaurantName, Restaurant.Category,
+            Restaurant.Address, Restaurant.Rating)).all()
+        foods = connection.execute(sa_select(Food.FoodID, Food.FoodName, Food.Price, Food.RestaurantID)).all()
+    return SearchIndex.build(restaurants, foods)
+
+search_index = LazyIndex('search index', load_search_index, SEARCH_REFRESH_SECONDS,
+                         lambda index: f"{len(index.restaurants)} restaurants")
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    try:
+        query = request.args.get('q', '').strip()
+        limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+        if not query:
+            return jsonify({'success': False, 'error': 'q is required'}), 400
+        index = search_index.get()
+        return jsonify({'success': True, 'restaurants': index.results(query, limit)})
+    except Exception as e:
+        log.error("Error searching for %r: %s", request.args.get('q'), e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Prefix lookups for /api/autocomplete/* (see autocomplete.py), ranked by order
+# counts. Dishes are keyed by their folded name, so a name shared by many
+# restaurants is one suggestion with the orders of all of them.
+def load_autocomplete():
+    with engines.get('customer').connect() as connection:
+        restaurants = PrefixIndex.build(
+            'restaurants',
+            connection.execute(sa_select(Restaurant.RestaurantID, Restaurant.RestaurantName)).all(),
+            connection.execute(sa_select(Orders.RestaurantID, db.func.count()).group_by(Orders.RestaurantID)).all())
+
+        food_refs, food_names, food_orders = {}, [], {}
+        for name, count in connection.execute(sa_select(Food.FoodName, db.func.count()).group_by(Food.FoodName)):
+            key = fold(name)
+            food_names.append((key, name))
+            food_refs[key] = food_refs.get(key, 0) + count
+        ordered = sa_select(Food.FoodName, db.func.count()).join(FoodOrders, FoodOrders.FoodID == Food.FoodID)
+        for name, count in connection.execute(ordered.group_by(Food.FoodName)):
+            key = fold(name)
+            food_orders[key] = food_orders.get(key, 0) + count
+        foods = PrefixIndex.build('foods', food_names, food_orders, food_refs)
+
+        customers = PrefixIndex.build(
+            'customers',
+            connection.execute(sa_select(Customer.CustomerID, Customer.Username)).all(),
+            connection.execute(sa_select(Orders.CustomerID, db.func.count()).group_by(Orders.CustomerID)).all())
+    return {'restaurants': restaurants, 'foods': foods, 'customers': customers}
+
+autocomplete = LazyIndex('autocomplete', load_autocomplete, AUTOCOMPLETE_REFRESH_SECONDS, lambda indexes: ', '.join(
+    f"{name} {index.memory_bytes() / 1e6:.1f} MB" for name, index in indexes.items()))
+
+def update_autocomplete(name, apply):
+    """Applies a committed name change to one autocomplete index, if built."""
+    autocomplete.update(lambda indexes: apply(indexes[name]))
+
+def autocomplete_matches(name):
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), AUTOCOMPLETE_MAX_RESULTS))
+    return autocomplete.get()[name].lookup(query, limit)
+
+@app.route('/api/autocomplete/restaurants', methods=['GET'])
+def autocomplete_restaurants():
+    try:
+        return jsonify({'success': True, 'results': [
+            {'RestaurantID': i, 'RestaurantName': name, 'orders': orders}
+            for i, name, orders in autocomplete_matches('restaurants')
+        ]})
+    except Exception as e:
+        log.error("Error completing restaurant names: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/autocomplete/foods', methods=['GET'])
+def autocomplete_foods():
+    try:
+        return jsonify({'success': True, 'results': [
+            {'FoodName': name, 'orders': orders} for _, name, orders in autocomplete_matches('foods')
+        ]})
+    except Exception as e:
+        log.error("Error completing food names: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Prefix version of /api/customers/lookup for the new-chat dialog
+@app.route('/api/autocomplete/customers', methods=['GET'])
+@require_customer
+def autocomplete_customers():
+    try:
+        return jsonify({'success': True, 'results': [
+            {'customerID': i, 'username': name, 'orders': orders}
+            for i, name, orders in autocomplete_matches('customers')
+        ]})
+    except Exception as e:
+        log.error("Error completing usernames: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+metrics_registry.add_collector(lambda: [
+    ('autocomplete_bytes', (('index', name),), index.memory_bytes()) for name, index in (autocomplete.value or {}).items()
+])
+
+# Bitmap facets for /api/restaurants/browse (see facets.py)
+def load_facet_index():
+    with engines.get('guest').connect() as connection:
+        restaurants = connection.execute(
+            sa_select(Restaurant.RestaurantID, Restaurant.Category, Restaurant.PriceRange)).all()
+        cuisines = connection.execute(
+            sa_select(RestaurantCuisine.RestaurantID, Cuisine.Name)
+            .join(Cuisine, Cuisine.CuisineID == RestaurantCuisine.CuisineID)).all()
+        features = connection.execute(
+            sa_select(RestaurantFeature.RestaurantID, Feature.Name)
+            .join(Feature, Feature.FeatureID == RestaurantFeature.FeatureID)).all()
+        known = {
+            'cuisine': connection.execute(sa_select(Cuisine.Name)).scalars().all(),
+            'feature': connection.execute(sa_select(Feature.Name)).scalars().all(),
+        }
+    return FacetIndex.build(restaurants, cuisines, features, known)
+
+facet_index = LazyIndex('facet index', load_facet_index, FACETS_REFRESH_SECONDS,
+                        lambda index: f"{len(index.values)} restaurants")
+
+def index_restaurant_facets(index, restaurant):
+    index.set_values(restaurant.RestaurantID, 'category', [restaurant.Category])
+    index.set_values(restaurant.RestaurantID, 'price', [restaurant.PriceRange])
+
+# e.g. ?cuisine=Thai&cuisine=Vietnamese&feature=Delivery,Parking&feature_match=all&price=$,$$
+@app.route('/api/restaurants/browse', methods=['GET'])
+def browse_restaurants():
+    try:
+        filters, matches = {}, {}
+        for facet in FACETS:
+            selected = [v.strip() for arg in request.args.getlist(facet) for v in arg.split(',') if v.strip()]
+            if selected:
+                filters[facet] = selected
+            match = request.args.get(f'{facet}_match', 'any')
+            if match not in ('any', 'all'):
+                return jsonify({'success': False, 'error': f'{facet}_match must be any or all'}), 400
+            matches[facet] = match
+        after = request.args.get('after', 0, type=int)
+        limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+
+        bits, counts = facet_index.get().query(filters, matches)
+        ids, more = facet_page(bits, after, limit)
+        restaurants = Restaurant.query.filter(Restaurant.RestaurantID.in_(ids)).order_by(Restaurant.RestaurantID).all() \
+            if ids else []
+        return jsonify({
+            'success': True,
+            'total': bits.bit_count(),
+            'restaurants': [{
+                'RestaurantID': r.RestaurantID,
+                'RestaurantName': r.RestaurantName,
+                'Category': r.Category,
+                'Rating': r.Rating,
+                'PriceRange': r.PriceRange,
+                'Address': r.Address,
+            } for r in restaurants],
+            'facets': counts,
+            'nextAfter': ids[-1] if more else None,
+        })
+    except Exception as e:
+        log.error("Error browsing restaurants: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Grid index of restaurant coordinates for the nearby endpoints (see geo_index.py)
+geocoder = geocoder_from_env()
+def load_geo_index():
+    with engines.get('guest').connect() as connection:
+        rows = connection.execute(
+            sa_select(Restaurant.RestaurantID, Restaurant.Latitude, Restaurant.Longitude)
+            .where(Restaurant.Latitude.is_not(None))).all()
+    return GridIndex.build(rows)
+
+geo_index = LazyIndex('geo index', load_geo_index, GEO_REFRESH_SECONDS,
+                      lambda index: f"{index.count} restaurants")
+
+NEARBY_MAX_RESULTS = 100
+NEARBY_MAX_RADIUS_KM = 100.0
+
+def nearby_restaurants(lat, lon):
+    """?radius_km= (up to NEARBY_MAX_RADIUS_KM) for everything within a radius
+    (nearest first, up to k), otherwise the k nearest."""
+    k = max(1, min(request.args.get('k', 20, type=int), NEARBY_MAX_RESULTS))
+    radius_km = request.args.get('radius_km', type=float)
+    index = geo_index.get()
+    if radius_km is not None:
+        found = index.within(lat, lon, min(max(0.0, radius_km), NEARBY_MAX_RADIUS_KM), k)
+    else:
+        found = index.nearest(lat, lon, k)
+    ids = [restaurant_id for _, restaurant_id in found]
+    restaurants = {r.RestaurantID: r for r in Restaurant.query.filter(Restaurant.RestaurantID.in_(ids)).all()} \
+        if ids else {}
+    nearby = []
+    for distance, restaurant_id in found:
+        r = restaurants.get(restaurant_id)
+        if r is None:
+            continue    # deleted by another worker since the index was built
+        nearby.append({
+            'RestaurantID': r.RestaurantID,
+            'RestaurantName': r.RestaurantName,
+            'Category': r.Category,
+            'Rating': r.Rating,
+            'PriceRange': r.PriceRange,
+            'Address': r.Address,
+            'Latitude': r.Latitude,
+            'Longitude': r.Longitude,
+            'distanceKm': round(distance, 3),
+        })
+    return nearby
+
+# e.g. ?lat=40.73&lon=-73.99&k=10 or ?lat=40.73&lon=-73.99&radius_km=2
+@app.route('/api/restaurants/nearby', methods=['GET'])
+def get_nearby_restaurants():
+    try:
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        if lat is None or lon is None or not -90 <= lat <= 90 or not -180 <= lon <= 180:
+            return jsonify({'success': False, 'error': 'lat and lon are required'}), 400
+        return jsonify({'success': True, 'restaurants': nearby_restaurants(lat, lon)})
+    except Exception as e:
+        log.error("Error finding nearby restaurants: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# e.g. ?address=123 Main St&k=10; defaults to the customer's first saved address
+@app.route('/api/customers/address/nearby', methods=['GET'])
+@require_customer
+def get_restaurants_near_address():
+    customer_id = g.current_user['id']
+    try:
+        query = Customer_Address.query.filter_by(CustomerID=customer_id)
+        address_text = request.args.get('address')
+        if address_text:
+            query = query.filter_by(Address=address_text)
+        address = query.order_by(Customer_Address.Address).first()
+        if not address:
+            return jsonify({'success': False, 'error': 'Address not found for this customer'}), 404
+        if address.Latitude is None:
+            # Saved before geocoding existed or while the geocoder was down
+            address.Latitude, address.Longitude = safe_geocode(geocoder, address.Address)
+            if address.Latitude is None:
+                return jsonify({'success': False, 'error': 'Address could not be located'}), 422
+            db.session.commit()
+        return jsonify({
+            'success': True,
+            'address': {'Address': address.Address, 'Latitude': address.Latitude, 'Longitude': address.Longitude},
+            'restaurants': nearby_restaurants(address.Latitude, address.Longitude),
+        })
+    except Exception as e:
+        db.session.rollback()
+        log.error("Error finding restaurants near address for customer %s: %s", customer_id, e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/restaurants', methods=['GET'])
 def get_all_restaurants():
     try:
@@ -513,19 +1184,23 @@ def get_restaurant_foods(restaurant_id):
             'Price': f.Price
         } for f in foods]
         
-        print(f"Retrieved {len(foodlist)} foods for restaurant {restaurant_id}")  # Add logging
+        log.debug("Retrieved %d foods for restaurant %s", len(foodlist), restaurant_id)
         
         return jsonify({
             'success': True,
             'foodlist': foodlist
         })
     except Exception as e:
-        print(f"Error fetching foods: {str(e)}")  # Add logging
+        log.error("Error fetching foods: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+# FoodIDs come from Id_Block like MessageIDs, so single dishes and bulk
+# imports never pick the same ID and neither needs a MAX(FoodID) query
+food_ids = IdAllocator(lambda: engines.get('restaurant'), IdBlock.__table__, 'Food', Food.FoodID, block_size=100)
+
 @app.route('/api/restaurants/<int:restaurant_id>/foods', methods=['POST'])
 @require_restaurant
 def create_food(restaurant_id):
@@ -541,8 +1216,7 @@ def create_food(restaurant_id):
             }), 400
 
         # Get the next FoodID
-        max_food_id = db.session.query(db.func.max(Food.FoodID)).scalar()
-        next_food_id = 1 if max_food_id is None else max_food_id + 1
+        next_food_id = food_ids.next_id()
 
         # Create new food item
         new_food = Food(
@@ -553,6 +1227,9 @@ def create_food(restaurant_id):
         )
         db.session.add(new_food)
         db.session.commit()
+        search_index.update(lambda index: index.upsert_food(
+            new_food.FoodID, new_food.FoodName, new_food.Price, new_food.RestaurantID))
+        update_autocomplete('foods', lambda index: index.add(fold(food_name), food_name))
         
         # Return the created food item
         new_food_dict = {
@@ -568,12 +1245,84 @@ def create_food(restaurant_id):
         })
     except Exception as e:
         db.session.rollback()
-        print(f"Error creating food: {str(e)}")  # Add logging
+        log.error("Error creating food: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+# Dishes per DELETE ... IN (...) in a menu import; keeps SQLite under its bound-parameter limit
+MENU_WRITE_ROWS = 1000
+
+@app.route('/api/restaurants/<int:restaurant_id>/menu', methods=['PUT'])
+@require_restaurant
+def import_menu(restaurant_id):
+    """Replaces a restaurant's menu (see menu_import.py); ?dry_run=1 only reports the changes."""
+    try:
+        restaurant, error = owned_restaurant(restaurant_id, 'edit the menu of')
+        if error:
+            return error
+        try:
+            items = parse_menu(request.content_type or '', request.get_data())
+        except MenuError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        dry_run = request.args.get('dry_run', 'false').lower() in ('1', 'true')
+
+        # Locks the menu's rows, so two imports for one restaurant apply one after the other
+        current = {food_id: (name, price) for food_id, name, price in db.session.execute(
+            sa_select(Food.FoodID, Food.FoodName, Food.Price)
+            .where(Food.RestaurantID == restaurant_id).with_for_update()
+        )}
+        try:
+            inserts, updates, deletes, unchanged = diff_menu(current, items)
+        except MenuError as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': str(e)}), 400
+        summary = {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletes),
+                   'unchanged': unchanged}
+        if dry_run:
+            db.session.rollback()
+            return jsonify({'success': True, 'dry_run': True, 'summary': summary})
+
+        for food_id, item in zip(food_ids.reserve(len(inserts)), inserts):
+            item['FoodID'] = food_id
+        # Inserts and updates both go through one executemany upsert
+        rows = [{'FoodID': item['FoodID'], 'FoodName': item['FoodName'], 'Price': item['Price'],
+                 'RestaurantID': restaurant_id} for item in updates + inserts]
+        if rows:
+            db.session.execute(backend.bulk_upsert(Food.__table__, None, ['FoodID'], ['FoodName', 'Price']), rows)
+        for start in range(0, len(deletes), MENU_WRITE_ROWS):
+            # Same as delete_food: the dish's order lines and sales rollups go with it
+            chunk = deletes[start:start + MENU_WRITE_ROWS]
+            for model in (FoodOrders, FoodDailySales, Food):
+                db.session.execute(sa_delete(model).where(model.FoodID.in_(chunk)))
+        db.session.commit()
+
+        menu = dict(current)
+        for food_id in deletes:
+            del menu[food_id]
+        menu.update((row['FoodID'], (row['FoodName'], row['Price'])) for row in rows)
+        search_index.update(lambda index: index.replace_menu(restaurant_id, menu))
+
+        # Names are reference-counted: drop the old name of every deleted or
+        # renamed dish, add the new name of every inserted or renamed one
+        renamed = [item for item in updates if current[item['FoodID']][0] != item['FoodName']]
+        old_names = [fold(current[food_id][0]) for food_id in deletes] + \
+            [fold(current[item['FoodID']][0]) for item in renamed]
+        new_names = [(fold(item['FoodName']), item['FoodName']) for item in inserts + renamed]
+        update_autocomplete('foods', lambda index: (index.discard_many(old_names), index.add_many(new_names)))
+
+        return jsonify({
+            'success': True,
+            'dry_run': False,
+            'summary': summary,
+            'inserted': [{'FoodID': item['FoodID'], 'FoodName': item['FoodName']} for item in inserts]
+        })
+    except Exception as e:
+        db.session.rollback()
+        log.exception("Error importing menu for restaurant ID %s: %s", restaurant_id, e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/restaurants/<int:restaurant_id>/foods/<int:food_id>', methods=['PUT'])
 @require_restaurant
 def update_food(restaurant_id, food_id):
@@ -587,6 +1336,7 @@ def update_food(restaurant_id, food_id):
         data = request.get_json()
         food_name = data.get('FoodName')
         price = data.get('Price')
+        old_name = food_item.FoodName
 
         if food_name:
             food_item.FoodName = food_name
@@ -597,6 +1347,10 @@ def update_food(restaurant_id, food_id):
                 return jsonify({'success': False, 'error': 'Invalid price format'}), 400
 
         db.session.commit()
+        search_index.update(lambda index: index.upsert_food(
+            food_item.FoodID, food_item.FoodName, food_item.Price, food_item.RestaurantID))
+        if food_name and food_name != old_name:
+            update_autocomplete('foods', lambda index: (index.discard(fold(old_name)), index.add(fold(food_name), food_name)))
         
         updated_food_data = {
             'FoodID': food_item.FoodID,
@@ -612,7 +1366,7 @@ def update_food(restaurant_id, food_id):
         })
     except Exception as e:
         db.session.rollback()
-        print(f"Error updating food ID {food_id} for restaurant ID {restaurant_id}: {str(e)}")
+        log.error("Error updating food ID %s for restaurant ID %s: %s", food_id, restaurant_id, e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -633,10 +1387,13 @@ def delete_food(restaurant_id, food_id):
 
         # Delete associated FoodOrders first
         FoodOrders.query.filter_by(FoodID=food_id).delete(synchronize_session=False)
+        FoodDailySales.query.filter_by(FoodID=food_id).delete(synchronize_session=False)
         
         # Delete the food item
         db.session.delete(food_item)
         db.session.commit()
+        search_index.update(lambda index: index.remove_food(food_id, restaurant_id))
+        update_autocomplete('foods', lambda index: index.discard(fold(food_name)))
         
         return jsonify({
             'success': True,
@@ -644,14 +1401,63 @@ def delete_food(restaurant_id, food_id):
         })
     except Exception as e:
         db.session.rollback()
-        print(f"Error deleting food ID {food_id} for restaurant ID {restaurant_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error deleting food ID %s for restaurant ID %s: %s", food_id, restaurant_id, e)
         return jsonify({
             'success': False,
             'error': f'An error occurred while deleting food item ID {food_id}.'
         }), 500
 
+# Neighbour lists are precomputed by recommendations.py; each lookup reads one
+# (ID, Rank) primary-key range
+RECOMMENDATION_MAX_RESULTS = 20
+
+@app.route('/api/restaurants/<int:restaurant_id>/foods/<int:food_id>/also-ordered', methods=['GET'])
+def get_also_ordered(restaurant_id, food_id):
+    try:
+        limit = max(1, min(request.args.get('limit', 5, type=int), RECOMMENDATION_MAX_RESULTS))
+        rows = db.session.query(Food, FoodNeighbor.Score).join(
+            FoodNeighbor, FoodNeighbor.NeighborID == Food.FoodID
+        ).filter(
+            FoodNeighbor.FoodID == food_id, Food.RestaurantID == restaurant_id
+        ).order_by(FoodNeighbor.Rank).limit(limit).all()
+
+        return jsonify({
+            'success': True,
+            'foodlist': [{
+                'FoodID': f.FoodID,
+                'FoodName': f.FoodName,
+                'Price': f.Price,
+                'score': score
+            } for f, score in rows]
+        })
+    except Exception as e:
+        log.error("Error fetching also-ordered foods for food %s: %s", food_id, e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/restaurants/<int:id>/similar', methods=['GET'])
+def get_similar_restaurants(id):
+    try:
+        limit = max(1, min(request.args.get('limit', 5, type=int), RECOMMENDATION_MAX_RESULTS))
+        rows = db.session.query(Restaurant, RestaurantNeighbor.Score).join(
+            RestaurantNeighbor, RestaurantNeighbor.NeighborID == Restaurant.RestaurantID
+        ).filter(RestaurantNeighbor.RestaurantID == id).order_by(RestaurantNeighbor.Rank).limit(limit).all()
+
+        return jsonify({
+            'success': True,
+            'restaurants': [{
+                'RestaurantID': r.RestaurantID,
+                'RestaurantName': r.RestaurantName,
+                'Category': r.Category,
+                'Rating': r.Rating,
+                'PriceRange': r.PriceRange,
+                'Address': r.Address,
+                'score': score
+            } for r, score in rows]
+        })
+    except Exception as e:
+        log.error("Error fetching restaurants similar to %s: %s", id, e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/restaurants/<int:id>', methods=['GET'])
 def get_restaurant_by_id(id):
     try:
@@ -674,7 +1480,7 @@ def get_restaurant_by_id(id):
                 "error": "Restaurant not found"
             }), 404
     except Exception as e:
-        print(f"Error fetching restaurant: {str(e)}")
+        log.error("Error fetching restaurant: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/restaurants', methods=['POST'])
@@ -703,6 +1509,8 @@ def create_restaurant():
         max_id = db.session.query(db.func.max(Restaurant.RestaurantID)).scalar()
         next_id = 1 if max_id is None else max_id + 1
 
+        latitude, longitude = safe_geocode(geocoder, restaurantData['address'])
+
         # Create new restaurant instance
         new_restaurant = Restaurant(
             RestaurantID=next_id,
@@ -710,10 +1518,19 @@ def create_restaurant():
             Category=restaurantData['category'],
             PhoneNumber=restaurantData['phoneNumber'],
             Address=restaurantData['address'],
+            PriceRange=restaurantData.get('priceRange'),
+            Latitude=latitude,
+            Longitude=longitude,
             AccountID=account_id # Assign ownership from token
         )
         db.session.add(new_restaurant)
         db.session.commit()
+        search_index.update(lambda index: index.upsert_restaurant(
+            new_restaurant.RestaurantID, new_restaurant.RestaurantName, new_restaurant.Category,
+            new_restaurant.Address, new_restaurant.Rating))
+        update_autocomplete('restaurants', lambda index: index.add(new_restaurant.RestaurantID, new_restaurant.RestaurantName))
+        facet_index.update(lambda index: index_restaurant_facets(index, new_restaurant))
+        geo_index.update(lambda index: index.add(new_restaurant.RestaurantID, latitude, longitude))
         
         # Prepare response data
         created_restaurant_data = {
@@ -723,6 +1540,9 @@ def create_restaurant():
             'Rating': new_restaurant.Rating, # Will be null initially
             'PhoneNumber': new_restaurant.PhoneNumber,
             'Address': new_restaurant.Address,
+            'PriceRange': new_restaurant.PriceRange,
+            'Latitude': new_restaurant.Latitude,
+            'Longitude': new_restaurant.Longitude,
             'AccountID': new_restaurant.AccountID
         }
         
@@ -734,13 +1554,11 @@ def create_restaurant():
     except KeyError as e:
         # Handle cases where request.json["restaurantData"] fails (though checked above)
         db.session.rollback()
-        print(f"Error creating restaurant (KeyError): {str(e)}")
+        log.error("Error creating restaurant (KeyError): %s", e)
         return jsonify({"error": f"Invalid request format: {str(e)}"}), 400
     except Exception as e:
         db.session.rollback()
-        print(f"Error creating restaurant: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error creating restaurant: %s", e)
         return jsonify({"error": "An unexpected error occurred while creating the restaurant."}), 500
 
 @app.route('/api/restaurants/<int:id>', methods=['PUT'])
@@ -755,13 +1573,27 @@ def update_restaurant(id):
         data = request.json
         restaurantData = data["restaurantData"]
         
+        old_point = (restaurant.Latitude, restaurant.Longitude)
+        if restaurantData['Address'] != restaurant.Address or restaurant.Latitude is None:
+            restaurant.Latitude, restaurant.Longitude = safe_geocode(geocoder, restaurantData['Address'])
+
         # Update the restaurant
         restaurant.RestaurantName = restaurantData['RestaurantName']
         restaurant.Category = restaurantData['Category']
         restaurant.PhoneNumber = restaurantData['PhoneNumber']
         restaurant.Address = restaurantData['Address']
+        if 'PriceRange' in restaurantData:
+            restaurant.PriceRange = restaurantData['PriceRange']
         
         db.session.commit()
+        search_index.update(lambda index: index.upsert_restaurant(
+            restaurant.RestaurantID, restaurant.RestaurantName, restaurant.Category,
+            restaurant.Address, restaurant.Rating))
+        update_autocomplete('restaurants', lambda index: index.replace(restaurant.RestaurantID, restaurant.RestaurantName))
+        facet_index.update(lambda index: index_restaurant_facets(index, restaurant))
+        new_point = (restaurant.Latitude, restaurant.Longitude)
+        if new_point != old_point:
+            geo_index.update(lambda index: index.move(restaurant.RestaurantID, old_point, new_point))
         
         return jsonify({
             "message": "Restaurant updated successfully",
@@ -770,12 +1602,15 @@ def update_restaurant(id):
                 "RestaurantName": restaurant.RestaurantName,
                 "Category": restaurant.Category,
                 "PhoneNumber": restaurant.PhoneNumber,
-                "Address": restaurant.Address
+                "Address": restaurant.Address,
+                "PriceRange": restaurant.PriceRange,
+                "Latitude": restaurant.Latitude,
+                "Longitude": restaurant.Longitude
             }
         })
     except Exception as e:
         db.session.rollback()
-        print(f"Error updating restaurant: {str(e)}")
+        log.error("Error updating restaurant: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/restaurants/<int:id>', methods=['DELETE'])
@@ -789,22 +1624,35 @@ def delete_restaurant(id):
 
         # Get IDs of food items associated with this restaurant
         food_items = Food.query.filter_by(RestaurantID=id).all()
-        food_ids = [item.FoodID for item in food_items]
+        menu_food_ids = [item.FoodID for item in food_items]
 
         # 1. Delete associated FoodOrders (depends on Food and Orders)
-        if food_ids:
-            FoodOrders.query.filter(FoodOrders.FoodID.in_(food_ids)).delete(synchronize_session=False)
+        if menu_food_ids:
+            FoodOrders.query.filter(FoodOrders.FoodID.in_(menu_food_ids)).delete(synchronize_session=False)
+            # Nothing cascades, so the dishes go too; a recycled RestaurantID would inherit them
+            Food.query.filter(Food.FoodID.in_(menu_food_ids)).delete(synchronize_session=False)
 
         # 2. Delete associated Reviews handled by DB trigger, no manual deletion needed
 
         # 4. Delete associated FrontPage entries (depends on Restaurant)
         FrontPage.query.filter_by(RestaurantID=id).delete(synchronize_session=False)
+        FrontPageBoost.query.filter_by(RestaurantID=id).delete(synchronize_session=False)
+
+        # 5. Delete the sales rollups
+        RestaurantDailySales.query.filter_by(RestaurantID=id).delete(synchronize_session=False)
+        FoodDailySales.query.filter_by(RestaurantID=id).delete(synchronize_session=False)
 
         # 6. Finally, delete the restaurant itself
+        old_point = (restaurant.Latitude, restaurant.Longitude)
         db.session.delete(restaurant)
         
         # Commit all changes
         db.session.commit()
+        search_index.update(lambda index: index.remove_restaurant(id))
+        update_autocomplete('restaurants', lambda index: index.discard(id))
+        update_autocomplete('foods', lambda index: index.discard_many([fold(item.FoodName) for item in food_items]))
+        facet_index.update(lambda index: index.remove_restaurant(id))
+        geo_index.update(lambda index: index.remove(id, old_point[0], old_point[1]))
         
         deleted_restaurant_data = {
             'RestaurantID': id,
@@ -817,9 +1665,7 @@ def delete_restaurant(id):
         })
     except Exception as e:
         db.session.rollback()
-        print(f"Error deleting restaurant ID {id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error deleting restaurant ID %s: %s", id, e)
         return jsonify({"error": f"An error occurred while deleting restaurant ID {id}."}), 500
 
 @app.route('/api/customers/<int:id>/restaurants', methods=['GET'])
@@ -853,7 +1699,7 @@ def get_customer_address():
         address_list = [addr.Address for addr in addresses]
         return jsonify(address_list), 200
     except Exception as e:
-        print(f"Error fetching addresses for customer {customer_id}: {str(e)}")
+        log.error("Error fetching addresses for customer %s: %s", customer_id, e)
         return jsonify({"error": "Failed to retrieve addresses"}), 500
 
 @app.route('/api/customers/address', methods=['POST']) # Route uses JWT for customer ID
@@ -873,13 +1719,15 @@ def create_customer_address():
             return jsonify({"error": "Address already exists for this customer"}), 409 # Conflict
 
         # Create and add the new address
-        new_address_entry = Customer_Address(CustomerID=customer_id, Address=address_text)
+        latitude, longitude = safe_geocode(geocoder, address_text)
+        new_address_entry = Customer_Address(CustomerID=customer_id, Address=address_text,
+                                             Latitude=latitude, Longitude=longitude)
         db.session.add(new_address_entry)
         db.session.commit()
         return jsonify({"message": "Address added successfully", "address": address_text}), 201
     except Exception as e:
         db.session.rollback()
-        print(f"Error adding address for customer {customer_id}: {str(e)}")
+        log.error("Error adding address for customer %s: %s", customer_id, e)
         return jsonify({"error": "Failed to add address"}), 500
 
 @app.route('/api/customers/address', methods=['DELETE']) # Route uses JWT for customer ID
@@ -905,7 +1753,7 @@ def delete_customer_address():
         return jsonify({"message": "Address deleted successfully"}), 200
     except Exception as e:
         db.session.rollback()
-        print(f"Error deleting address for customer {customer_id}: {str(e)}")
+        log.error("Error deleting address for customer %s: %s", customer_id, e)
         return jsonify({"error": "Failed to delete address"}), 500
 
 @app.route('/api/customers/address', methods=['PUT']) # Route uses JWT for customer ID
@@ -946,14 +1794,16 @@ def update_customer_address():
         # Safest approach: Delete old, add new within a transaction.
         
         db.session.delete(address_to_update)
-        new_address_entry = Customer_Address(CustomerID=customer_id, Address=new_address_text)
+        latitude, longitude = safe_geocode(geocoder, new_address_text)
+        new_address_entry = Customer_Address(CustomerID=customer_id, Address=new_address_text,
+                                             Latitude=latitude, Longitude=longitude)
         db.session.add(new_address_entry)
         
         db.session.commit()
         return jsonify({"message": "Address updated successfully", "new_address": new_address_text}), 200
     except Exception as e:
         db.session.rollback()
-        print(f"Error updating address for customer {customer_id} from '{old_address_text}' to '{new_address_text}': {str(e)}")
+        log.error("Error updating address for customer %s from '%s' to '%s': %s", customer_id, old_address_text, new_address_text, e)
         # Consider more specific error checking (e.g., duplicate key violation if new address exists)
         return jsonify({"error": "Failed to update address"}), 500
 
@@ -976,6 +1826,7 @@ def get_messages():
     
 @app.route('/api/messages', methods=['POST'])
 @require_customer
+@idempotent
 def create_message():
     try:
         data = request.get_json()
@@ -985,20 +1836,23 @@ def create_message():
             return jsonify({'error': 'recipientID and contents are required'}), 400
         sender_id = g.current_user['id']
         timestamp = datetime.now(timezone.utc)
-        # Get the next MessageID
-        max_id = db.session.query(db.func.max(Messages.MessageID)).scalar()
-        next_id = 1 if max_id is None else max_id + 1
-
-        # Create new message with server-side sender and timestamp
+        if write_behind is not None:
+            return queue_message(sender_id, recipient_id, timestamp, contents)
+        # Create new message with server-side sender and timestamp. The ID comes
+        # from the same allocator as write-behind, so a worker in the other mode
+        # never picks an ID inside a block reserved but not yet written
         new_message = Messages(
-            MessageID=next_id,
+            MessageID=message_ids.next_id(),
             SenderID=sender_id,
             RecipientID=recipient_id,
             Timestamp=timestamp,
             Contents=contents
         )
         db.session.add(new_message)
+        db.session.flush()
+        record_conversation_message(new_message)
         db.session.commit()
+        publish_message(new_message)
         return jsonify({
             'success': True,
             'message': 'Message created successfully',
@@ -1008,12 +1862,48 @@ def create_message():
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+def queue_message(sender_id, recipient_id, timestamp, contents):
+    """create_message in write-behind mode: the row is written by the next batch."""
+    message = Messages(
+        MessageID=message_ids.next_id(),
+        SenderID=sender_id,
+        RecipientID=recipient_id,
+        Timestamp=timestamp,
+        Contents=contents
+    )
+    recipient = db.session.get(Customer, recipient_id)
+    event = message_to_dict(message, g.current_user['username'], recipient.Username if recipient else None)
+    try:
+        pending = write_behind.submit(message, event)
+    except QueueFull as e:
+        log.warning("Message queue full: %s", e)
+        return jsonify({'error': 'Too many messages queued, retry shortly'}), 503
+    queued = jsonify({'success': True, 'message': 'Message queued', 'messageID': message.MessageID}), 202
+    if write_ack == 'queued':
+        return queued
+    # Durable once its batch commits
+    try:
+        pending.wait(timeout=MESSAGE_ACK_TIMEOUT_SECONDS)
+    except TimeoutError:
+        # Still queued and will be written: a 5xx would release the Idempotency-Key
+        # and invite a retry that writes it twice
+        log.warning("Message %s not flushed within %gs, acknowledged as queued",
+                    message.MessageID, MESSAGE_ACK_TIMEOUT_SECONDS)
+        return queued
+    return jsonify({
+        'success': True,
+        'message': 'Message created successfully',
+        'messageID': message.MessageID
+    }), 201
+
 @app.route('/api/messages/<int:id>', methods = ['GET'])
 @require_customer
 def get_messages_by_id(id):
     try:
         message = Messages.query.filter_by(MessageID=id).first()
-        
+        if message is None:
+            message = db.session.get(MessagesArchive, id)
+
         if message:
             return jsonify({
                 "message": {
@@ -1033,10 +1923,11 @@ def get_messages_by_id(id):
 @require_customer
 def get_messages_by_userid(userid):
     try:
-        # Return all messages where user is sender or recipient
-        messages = Messages.query.filter(
-            (Messages.SenderID == userid) | (Messages.RecipientID == userid)
-        ).order_by(Messages.Timestamp.desc()).all()
+        # Return all messages where user is sender or recipient, archived ones included
+        messages = newest_first(*(
+            model.query.filter((model.SenderID == userid) | (model.RecipientID == userid)).all()
+            for model in (Messages, MessagesArchive)
+        ))
         message_list = [{
             'MessageID': m.MessageID,
             'SenderID': m.SenderID,
@@ -1048,48 +1939,246 @@ def get_messages_by_userid(userid):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Front page ranking (see front_page.py). The ranked list is cached here and
+# reloaded every FRONT_PAGE_REFRESH_SECONDS, so a page is a list slice
+FRONT_PAGE_SLOTS = int(os.getenv('FRONT_PAGE_SLOTS', '60'))
+FRONT_PAGE_PAGE_SIZE = int(os.getenv('FRONT_PAGE_PAGE_SIZE', '6'))
+FRONT_PAGE_REFRESH_SECONDS = float(os.getenv('FRONT_PAGE_REFRESH_SECONDS', '60'))
+FRONT_PAGE_MAX_BOOST = int(os.getenv('FRONT_PAGE_MAX_BOOST', '10000'))
+
+def load_front_page():
+    with engines.get('guest').connect() as connection:
+        rows = connection.execute(
+            sa_select(Restaurant.RestaurantID, Restaurant.RestaurantName, Restaurant.Category, Restaurant.Rating)
+            .join(FrontPage, FrontPage.RestaurantID == Restaurant.RestaurantID)
+            # Rows from before the ranking job ran have no SlotRank; they follow by PushPoints
+            .order_by(case((FrontPage.SlotRank.is_(None), 1), else_=0), FrontPage.SlotRank,
+                      FrontPage.PushPoints.desc(), FrontPage.RestaurantID)
+            .limit(FRONT_PAGE_SLOTS)
+        ).all()
+    return [{
+        'id': restaurant_id,
+        'name': name,
+        'description': category,  # Using Category as description
+        'rating': float(rating) if rating else 0
+    } for restaurant_id, name, category, rating in rows]
+
+front_page = LazyIndex('front page', load_front_page, FRONT_PAGE_REFRESH_SECONDS,
+                       lambda ranked: f"{len(ranked)} slots")
+
+# ?offset=6 for the second page; ?limit= up to FRONT_PAGE_SLOTS
 @app.route('/api/restaurants/front-page', methods=['GET'])
 def get_front_page_restaurants():
     try:
-        print("Attempting to fetch front page restaurants...")
-        
-        # First check if there are any restaurants in the database
-        restaurant_count = db.session.query(Restaurant).count()
-        print(f"Total restaurants in database: {restaurant_count}")
-        
-        # Check if there are any entries in the Front_Page table
-        front_page_count = db.session.query(FrontPage).count()
-        print(f"Total entries in Front_Page table: {front_page_count}")
-        
-        # Get restaurants from the Front_Page table
-        restaurants = db.session.query(Restaurant).join(
-            FrontPage, Restaurant.RestaurantID == FrontPage.RestaurantID
-        ).order_by(FrontPage.PushPoints.desc()).limit(6).all()
-        
-        print(f"Found {len(restaurants)} restaurants for front page")
-        
-        result = []
-        for restaurant in restaurants:
-            restaurant_data = {
-                'id': restaurant.RestaurantID,
-                'name': restaurant.RestaurantName,
-                'description': restaurant.Category,  # Using Category as description
-                'rating': float(restaurant.Rating) if restaurant.Rating else 0
-            }
-            result.append(restaurant_data)
-            print(f"Added restaurant: {restaurant_data['name']} (ID: {restaurant_data['id']})")
-            
-        print(f"Returning {len(result)} restaurants")
-        return jsonify(result)
+        offset = max(0, request.args.get('offset', 0, type=int))
+        limit = max(1, min(request.args.get('limit', FRONT_PAGE_PAGE_SIZE, type=int), FRONT_PAGE_SLOTS))
+        ranked = front_page.get()
+        result = ranked[offset:offset + limit]
+        log.debug("Returning %d front page restaurants", len(result))
+        response = jsonify(result)
+        response.headers['X-Total-Count'] = str(len(ranked))
+        return response
     except Exception as e:
-        print(f"Error fetching front page restaurants: {str(e)}")
-        import traceback
-        traceback.print_exc()  # Print the full stack trace
+        log.exception("Error fetching front page restaurants: %s", e)
         # Return empty array instead of error to prevent frontend issues
         return jsonify([])
 
+@app.route('/api/restaurants/<int:id>/boost', methods=['POST'])
+@require_restaurant
+def boost_restaurant(id):
+    try:
+        restaurant = Restaurant.query.filter_by(RestaurantID=id).first()
+        if not restaurant:
+            return jsonify({"error": "Restaurant not found"}), 404
+        if restaurant.AccountID != g.current_user['id']:
+            return jsonify({'message': 'Forbidden: You can only boost your own restaurants.'}), 403
+
+        points = (request.get_json(silent=True) or {}).get('points')
+        if not isinstance(points, int) or isinstance(points, bool) or not 0 < points <= FRONT_PAGE_MAX_BOOST:
+            return jsonify({"error": f"points must be a whole number from 1 to {FRONT_PAGE_MAX_BOOST}"}), 400
+
+        boost = FrontPageBoost(RestaurantID=id, Points=points, PurchasedAt=datetime.now(timezone.utc).replace(tzinfo=None))
+        db.session.add(boost)
+        db.session.commit()
+        return jsonify({
+            "message": "Boost added; it counts from the next front page ranking",
+            "boost": {
+                "BoostID": boost.BoostID,
+                "RestaurantID": boost.RestaurantID,
+                "Points": boost.Points,
+                "PurchasedAt": boost.PurchasedAt.isoformat()
+            }
+        }), 201
+    except Exception as e:
+        db.session.rollback()
+        log.error("Error boosting restaurant %s: %s", id, e)
+        return jsonify({"error": str(e)}), 500
+
+# Analytics read the daily rollups, so a range costs one row per day (or per
+# day and dish) whatever the number of orders. Days without orders are left out.
+ANALYTICS_DEFAULT_DAYS = 30
+ANALYTICS_MAX_DAYS = 3660
+ANALYTICS_MAX_DISHES = 100
+ANALYTICS_INTERVALS = {
+    'day': lambda day: day,
+    'week': lambda day: day - timedelta(days=day.weekday()),   # Monday
+    'month': lambda day: day.replace(day=1),
+}
+
+def owned_restaurant(id, action):
+    """(restaurant, None) if the caller owns it, else (None, error response)."""
+    restaurant = Restaurant.query.filter_by(RestaurantID=id).first()
+    if not restaurant:
+        return None, (jsonify({"error": "Restaurant not found"}), 404)
+    if restaurant.AccountID != g.current_user['id']:
+        return None, (jsonify({'message': f'Forbidden: You can only {action} your own restaurants.'}), 403)
+    return restaurant, None
+
+def analytics_range():
+    """(first day, last day, None) from ?from=&to= (inclusive UTC dates), or (None, None, error)."""
+    try:
+        end = date.fromisoformat(request.args['to']) if 'to' in request.args \
+            else datetime.now(timezone.utc).date()
+        start = date.fromisoformat(request.args['from']) if 'from' in request.args \
+            else end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    except ValueError:
+        return None, None, "from and to must be dates as YYYY-MM-DD"
+    if start > end:
+        return None, None, "from must not be after to"
+    if (end - start).days >= ANALYTICS_MAX_DAYS:
+        return None, None, f"The range may span at most {ANALYTICS_MAX_DAYS} days"
+    return start, end, None
+
+def sales_summary(orders, revenue, additional_costs):
+    return {
+        'OrderCount': orders,
+        'Revenue': round(revenue, 2),
+        'Additional_Costs': round(additional_costs, 2),
+        'TotalCost': round(revenue + additional_costs, 2),
+        'AverageOrder': round(revenue / orders, 2) if orders else 0,
+    }
+
+@app.route('/api/restaurants/<int:id>/analytics', methods=['GET'])
+@require_restaurant
+def get_restaurant_analytics(id):
+    try:
+        restaurant, error = owned_restaurant(id, 'view analytics for')
+        if error:
+            return error
+        start, end, message = analytics_range()
+        if message:
+            return jsonify({"error": message}), 400
+        interval = request.args.get('interval', 'day')
+        if interval not in ANALYTICS_INTERVALS:
+            return jsonify({"error": f"interval must be one of {', '.join(ANALYTICS_INTERVALS)}"}), 400
+
+        rows = db.session.query(
+            RestaurantDailySales.Day, RestaurantDailySales.OrderCount,
+            RestaurantDailySales.Revenue, RestaurantDailySales.AdditionalCosts
+        ).filter(
+            RestaurantDailySales.RestaurantID == id, RestaurantDailySales.Day.between(start, end)
+        ).order_by(RestaurantDailySales.Day).all()
+
+        period_of = ANALYTICS_INTERVALS[interval]
+        periods = {}
+        for day, orders, revenue, additional_costs in rows:
+            totals = periods.setdefault(period_of(day), [0, 0.0, 0.0])
+            totals[0] += orders
+            totals[1] += revenue
+            totals[2] += additional_costs
+        overall = [sum(totals[i] for totals in periods.values()) for i in range(3)]
+
+        return jsonify({
+            'RestaurantID': id,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'interval': interval,
+            'totals': sales_summary(*overall),
+            'series': [{'period': period.isoformat(), **sales_summary(*totals)} for period, totals in periods.items()]
+        })
+    except Exception as e:
+        log.exception("Error fetching analytics for restaurant %s: %s", id, e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/restaurants/<int:id>/analytics/dishes', methods=['GET'])
+@require_restaurant
+def get_restaurant_dish_analytics(id):
+    try:
+        restaurant, error = owned_restaurant(id, 'view analytics for')
+        if error:
+            return error
+        start, end, message = analytics_range()
+        if message:
+            return jsonify({"error": message}), 400
+        limit = max(1, min(request.args.get('limit', 20, type=int), ANALYTICS_MAX_DISHES))
+
+        quantity = db.func.sum(FoodDailySales.Quantity)
+        rows = db.session.query(
+            FoodDailySales.FoodID, Food.FoodName, db.func.sum(FoodDailySales.OrderCount), quantity
+        ).outerjoin(
+            Food, Food.FoodID == FoodDailySales.FoodID
+        ).filter(
+            FoodDailySales.RestaurantID == id, FoodDailySales.Day.between(start, end)
+        ).group_by(
+            FoodDailySales.FoodID, Food.FoodName
+        ).order_by(quantity.desc(), FoodDailySales.FoodID).limit(limit).all()
+
+        return jsonify({
+            'RestaurantID': id,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'dishes': [{
+                'FoodID': food_id,
+                'FoodName': food_name,
+                'OrderCount': int(orders),
+                'Quantity': int(total)
+            } for food_id, food_name, orders, total in rows]
+        })
+    except Exception as e:
+        log.exception("Error fetching dish analytics for restaurant %s: %s", id, e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/restaurants/<int:id>/orders/export', methods=['GET'])
+@require_restaurant
+def export_restaurant_orders(id):
+    try:
+        restaurant, error = owned_restaurant(id, 'export orders of')
+        if error:
+            return error
+        fmt = request.args.get('format', 'csv')
+        if fmt not in order_export.FORMATS:
+            return jsonify({"error": f"format must be one of {', '.join(order_export.FORMATS)}"}), 400
+        try:
+            # Inclusive UTC dates, like the analytics range
+            since = datetime.fromisoformat(request.args['from']) if 'from' in request.args else None
+            until = datetime.fromisoformat(request.args['to']) + timedelta(days=1) if 'to' in request.args else None
+        except ValueError:
+            return jsonify({"error": "from and to must be dates as YYYY-MM-DD"}), 400
+        compress = request.args.get('gzip', 'false').lower() in ('1', 'true')
+
+        # Archived orders first: their IDs are all below the hot ones
+        queries = [
+            order_export.order_lines_query(OrdersArchive, FoodOrdersArchive, Food, id, since, until),
+            order_export.order_lines_query(Orders, FoodOrders, Food, id, since, until),
+        ]
+        engine = router.replica(g.db_role) if g.db_read_only else router.primary(g.db_role)
+    except Exception as e:
+        log.exception("Error starting order export for restaurant %s: %s", id, e)
+        return jsonify({"error": str(e)}), 500
+    finally:
+        # The export reads through its own connection; return the session's now
+        SessionLocal.remove()
+
+    filename = f"orders-{id}.{fmt}" + ('.gz' if compress else '')
+    return Response(
+        order_export.export(engine, queries, fmt, compress),
+        mimetype='application/gzip' if compress else order_export.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/orders', methods=['POST'])
 @require_customer
+@idempotent
 def create_order():
     try:
         data = request.json
@@ -1112,12 +2201,14 @@ def create_order():
             next_order_id = 1 if max_order_id is None else max_order_id + 1
 
             # Create the order entry with Additional_Costs
+            placed = datetime.now(timezone.utc)
             new_order = Orders(
                 OrderID=next_order_id,
                 CustomerID=customer_id,
                 RestaurantID=restaurant_id,
                 PriceTotal=price_total,
-                Additional_Costs=additional_costs
+                Additional_Costs=additional_costs,
+                OrderDate=placed
             )
             db.session.add(new_order)
             # Flush the session to ensure the Orders row is inserted before FoodOrders
@@ -1132,6 +2223,14 @@ def create_order():
                 )
                 db.session.add(food_order)
 
+            # Analytics rollups move with the order: both commit or neither does
+            quantities = {}
+            for item in items:
+                quantities[item['FoodID']] = quantities.get(item['FoodID'], 0) + item['quantity']
+            for statement in sales_upserts(restaurant_id, placed.date(), float(price_total),
+                                           float(additional_costs or 0), quantities):
+                db.session.execute(statement)
+
             db.session.commit()
             return jsonify({
                 'message': 'Order created successfully',
@@ -1140,11 +2239,11 @@ def create_order():
 
         except Exception as e:
             db.session.rollback()
-            print("Database error:", str(e))
+            log.error("Database error: %s", e)
             raise e
 
     except Exception as e:
-        print("Error creating order:", str(e))
+        log.error("Error creating order: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/orders/customer', methods=['GET']) # Changed route, ID comes from token
@@ -1152,13 +2251,30 @@ def create_order():
 def get_customer_orders(): # Removed customer_id parameter
     try:
         customer_id = g.current_user['id'] # Get ID from token context
-        orders_data = db.session.query(
-            Orders, Restaurant.RestaurantName
-        ).join(
-            Restaurant, Orders.RestaurantID == Restaurant.RestaurantID
-        ).filter(
-            Orders.CustomerID == customer_id
-        ).order_by(Orders.OrderID.desc()).all()
+
+        def customer_orders(model):
+            return db.session.query(
+                model, Restaurant.RestaurantName
+            ).join(
+                Restaurant, model.RestaurantID == Restaurant.RestaurantID
+            ).filter(
+                model.CustomerID == customer_id
+            )
+
+        if not is_paged():
+            # Unpaged: every order, archived ones (all below the hot IDs) last
+            orders_data = (customer_orders(Orders).order_by(Orders.OrderID.desc()).all()
+                           + customer_orders(OrdersArchive).order_by(OrdersArchive.OrderID.desc()).all())
+        else:
+            try:
+                limit, before = page_args()
+            except ValueError:
+                return jsonify({'error': 'before must be an OrderID'}), 400
+            orders_data = page_with_archive(
+                customer_orders(Orders), [Orders.OrderID],
+                customer_orders(OrdersArchive), [OrdersArchive.OrderID],
+                limit, None if before is None else (before,), key=lambda row: (row[0].OrderID,)
+            )
         
         orders = []
         for order, restaurant_name in orders_data:
@@ -1171,16 +2287,18 @@ def get_customer_orders(): # Removed customer_id parameter
                 'Additional_Costs': additional_costs,
                 'TotalCost': float(order.PriceTotal) + additional_costs,  # Sum of PriceTotal and Additional_Costs
                 'RestaurantName': restaurant_name,
+                'OrderDate': order.OrderDate.isoformat() if order.OrderDate else None,
                 'items': []
             }
             
-            # Get food items for this order
+            # Get food items for this order (archived orders keep their lines in the archive)
+            lines = FoodOrdersArchive if isinstance(order, OrdersArchive) else FoodOrders
             food_items = db.session.query(
-                Food.FoodID, Food.FoodName, Food.Price, FoodOrders.Quantity
+                Food.FoodID, Food.FoodName, Food.Price, lines.Quantity
             ).join(
-                FoodOrders, Food.FoodID == FoodOrders.FoodID
+                lines, Food.FoodID == lines.FoodID
             ).filter(
-                FoodOrders.OrderID == order_dict['OrderID']
+                lines.OrderID == order_dict['OrderID']
             ).all()
             
             # Add food items to the order
@@ -1194,12 +2312,14 @@ def get_customer_orders(): # Removed customer_id parameter
             
             orders.append(order_dict)
 
-        return jsonify(orders)
+        response = jsonify(orders)
+        if is_paged() and len(orders) == limit:
+            # The body stays a plain list, so the cursor for the next page goes in a header
+            response.headers['X-Next-Before'] = str(orders[-1]['OrderID'])
+        return response
 
     except Exception as e:
-        print(f"Error fetching orders for customer {customer_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error fetching orders for customer %s: %s", customer_id, e)
         return jsonify({'error': str(e)}), 500
 
 def encodeBase64(image_path):
@@ -1208,7 +2328,7 @@ def encodeBase64(image_path):
             encoded_string = base64.b64encode(image_file.read().decode())
             return encoded_string
     except Exception as e:
-        print(f"Image was unable to be encoded:{str(e)}")
+        log.error("Image was unable to be encoded: %s", e)
         return None
 def decodeBase64(base64_str,output_path):
     try:
@@ -1218,7 +2338,7 @@ def decodeBase64(base64_str,output_path):
         return True
     except Exception as e:
         db.session.rollback()
-        print(f"Error deleting food: {str(e)}")
+        log.error("Error deleting food: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -1284,19 +2404,17 @@ def create_review():
         }), 201
         
     except KeyError as e:
-        print(f"Error creating review (KeyError): {str(e)}")
+        log.error("Error creating review (KeyError): %s", e)
         # Return the specific key error message
         return jsonify({'error': str(e)}), 400 
     except ValueError as e:
-        print(f"Error creating review (ValueError): {str(e)}")
+        log.error("Error creating review (ValueError): %s", e)
         # Return the specific value error message (e.g., invalid date format)
         return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         # Log the full traceback for unexpected errors
-        print(f"Unexpected error creating review: {str(e)}")
-        import traceback
-        traceback.print_exc() 
+        log.exception("Unexpected error creating review: %s", e)
         return jsonify({'error': 'An unexpected error occurred while creating the review.'}), 500
 
 @app.route('/api/restaurants/<int:restaurant_id>/reviews', methods=['GET'])
@@ -1325,7 +2443,7 @@ def get_restaurant_reviews(restaurant_id):
             'reviews': reviews_data
         })
     except Exception as e:
-        print(f"Error fetching reviews: {str(e)}")
+        log.error("Error fetching reviews: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/customers/reviews', methods=['GET']) # Changed route
@@ -1349,9 +2467,7 @@ def get_customer_reviews(): # Removed id parameter
         })
     except Exception as e:
         # Add more specific logging
-        print(f"Error fetching customer reviews for ID {customer_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error fetching customer reviews for ID %s: %s", customer_id, e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/reviews/<int:review_id>', methods=['PUT'])
@@ -1388,7 +2504,7 @@ def update_review(review_id):
         })
     except Exception as e:
         db.session.rollback()
-        print(f"Error updating review: {str(e)}")
+        log.error("Error updating review: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/reviews/<int:review_id>', methods=['DELETE'])
@@ -1411,7 +2527,7 @@ def delete_review(review_id):
         })
     except Exception as e:
         db.session.rollback()
-        print(f"Error deleting review: {str(e)}")
+        log.error("Error deleting review: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/restaurants/<int:restaurant_id>/photos', methods=['GET'])
@@ -1424,14 +2540,14 @@ def get_restaurant_photos(restaurant_id):
             'PhotoImage': f.PhotoImage
         } for f in photos]
         
-        print(f"Retrieved {len(photolist)} photos for restaurant {restaurant_id}")  # Add logging
+        log.debug("Retrieved %d photos for restaurant %s", len(photolist), restaurant_id)
         
         return jsonify({
             'success': True,
             'photolist': photolist
         })
     except Exception as e:
-        print(f"Error fetching photos: {str(e)}")  # Add logging
+        log.error("Error fetching photos: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -1447,22 +2563,24 @@ def update_restaurant_photos(restaurant_id):
         # Compress the image using PIL
         try:
             # Decode the base64 image
-            image_data = base64.b64decode(photo_image)
-            img = Image.open(io.BytesIO(image_data))
+            with image_timer('decode'):
+                image_data = base64.b64decode(photo_image)
+                img = Image.open(io.BytesIO(image_data))
             
-            # Resize the image while maintaining aspect ratio - reduce to smaller size
-            max_size = (400, 400)  # Smaller maximum dimensions
-            img.thumbnail(max_size, Image.LANCZOS)
+                # Resize the image while maintaining aspect ratio - reduce to smaller size
+                max_size = (400, 400)  # Smaller maximum dimensions
+                img.thumbnail(max_size, Image.LANCZOS)
             
             # Save with compression
             output = io.BytesIO()
-            if img.mode in ('RGBA', 'LA'):
-                # Convert images with transparency to RGB
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3])  # Use alpha as mask
-                background.save(output, format='JPEG', quality=60)  # Lower quality
-            else:
-                img.save(output, format='JPEG', quality=60)  # Lower quality
+            with image_timer('compress'):
+                if img.mode in ('RGBA', 'LA'):
+                    # Convert images with transparency to RGB
+                    background = Image.new('RGB', img.size, (255, 255, 255))
+                    background.paste(img, mask=img.split()[3])  # Use alpha as mask
+                    background.save(output, format='JPEG', quality=60)  # Lower quality
+                else:
+                    img.save(output, format='JPEG', quality=60)  # Lower quality
             
             # Convert back to base64
             compressed_image = base64.b64encode(output.getvalue()).decode('utf-8')
@@ -1472,26 +2590,26 @@ def update_restaurant_photos(restaurant_id):
             compressed_size = len(compressed_image)
             compression_ratio = (original_size - compressed_size) / original_size * 100
             
-            print(f"Image compressed from {original_size} to {compressed_size} bytes ({compression_ratio:.1f}% reduction)")
+            log.debug("Image compressed from %d to %d bytes (%.1f%% reduction)", original_size, compressed_size, compression_ratio)
             
             # Ensure it's small enough for the database
             if len(compressed_image) > 65000:  # Keep it under 65KB for TEXT column
-                print("Image still too large after compression, reducing quality further")
+                log.debug("Image still too large after compression, reducing quality further")
                 # Try a more aggressive compression
                 output = io.BytesIO()
-                if img.mode in ('RGBA', 'LA'):
-                    background.save(output, format='JPEG', quality=25)  # Very low quality
-                else:
-                    img.save(output, format='JPEG', quality=25)  # Very low quality
+                with image_timer('recompress'):
+                    if img.mode in ('RGBA', 'LA'):
+                        background.save(output, format='JPEG', quality=25)  # Very low quality
+                    else:
+                        img.save(output, format='JPEG', quality=25)  # Very low quality
                 
                 compressed_image = base64.b64encode(output.getvalue()).decode('utf-8')
-                print(f"Further compressed to {len(compressed_image)} bytes")
+                log.debug("Further compressed to %d bytes", len(compressed_image))
             
             photo_image = compressed_image
         except Exception as e:
-            print(f"Warning: Failed to compress image: {str(e)}")
             # If compression fails, use a placeholder
-            print("Using placeholder image instead")
+            log.warning("Failed to compress image, using placeholder instead: %s", e)
             photo_image = "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAAMCAgICAgMCAgIDAwMDBAYEBAQEBAgGBgUGCQgKCgkICQkKDA8MCgsOCwkJDRENDg8QEBEQCgwSExIQEw8QEBD/wAALCABkAGQBAREA/8QAHQABAAIDAQEBAQAAAAAAAAAAAAcIBAUGAwIBCf/EAEEQAAEDAwMCAwYCBgYLAAAAAAECAwQABREGBxIIEyExQRQiUWFxgQkyCRUjQpGhFjNSdIKxFxgkNUNEYmOSsvD/2gAIAQEAAD8A/VP8qFBQPnX1NeX8VnWFu2d2GnXu0MJueoJbIYs8JY5Jcd/eWR5hCAeRP9rgPnVPOlvdO+752xlXi7Tl2exRnSi03BBPZBJICUk/nOASSfAEqOSa3e8PVZZunDW0JqS5t3C+Toz90ucZo+8hpeUpBV+6kqI8fTjx9avcTkYoUJPy86FQ58aGfLNCc/ajdKWTRDmmrXJWpEt6LHCyoj3iAOMcePicZ+1YXTfJlXTQNgnz1Fci4W6NKWR/aW2or/mK2DfhQyaE1A1w10zpm6b/AO5Uq3agRDRN0hIUpMUyXGwpMJtJJUUJIB8cAgE+WeHhUrb2bsWXZrTkG/3iNMlNy5LcdpuE0HAkrBOeRAGADz+deXTDuzZN+NGzL5Z4r8QxJboSlTEYuFLiVkgjJHunHA+ePKpm8/KtLvJf5GndvL/eLapKZse3OrbKvEBYSePL58uPH71RD8OLUI1ntTqi9X64PXO7yryGptwnPFbshakJ95xZ8fIDjnwA8PAVcZt1DraHVfmQoKH0INRvvtt9G3a0ReoRGD8d+8RHXGXuBC0FaVJWPgRjP2qEegazuOi9YSdOtXR1qwa2ueIo5H2eA83yAT8uK0q+nrV+1jt9v+grm3Mbut0uUmOtxTrI7D3YHElSf3W8oSPL1qDNytsb3t1vLbdMOszl2m4MJkIchpKvHIWClSfNKkkgg+hFfofZt69YQYLRYuz8h+OgFa2GEvkH4JV2sr+gPHPzqwcV9t9lt9k9pHQsJ6DSlJuJVxBQokLIASM4HH3uXxIpZq1FpV3Wtk7cZWlZDKpJWpohLZbUkAHJT5ciOQI/dI9amBKuSQfh51SLrgmxm+pWZcorrbUqdboqlR3ilYUErAyD6VZva3UzG4W0mltURFEJuNvYeWgHI4qSArH2INVu6yds7Ddtbx7nGtbK5UmM2wh8oBWEA8uOccSeSyOOB4CqT3fSOobZOciXy2S4UlpXFbT7ZQUn5jyrZai3Ov14tUeA/IPc7alII8FFRHAFQ+6DVS6yZupd0bmNwbrNMBhKT3YqQeJCviUKKkjw8uJHwqTbSw5b4q0ODilxQUknPiTU+9DWyVmuV9e3SuMIDtqQYkFH9t44U58AgcgD8SR8q8+pHeRdl1Dc9GadufYucVRYlXFpXvNLI/qk/Ag+8r5geoqStg+ne17PaThpnNo/XVzSHLnc+JKlrVjIB/sSCED5DPrUx/CogfFC9PXl/wBnbvdXZDjGkF3FqM66QqGXJDDoA+IXGB+6jn1qJ+lPrSvugLI9th1CQpMrS1sTItq3leKmSElJOc+KCpIBPmQkepmLd3qDVrzbe/7vWWzPMW9MEsWiK2lbkVsEfl4k8XMDCj48cj51S5vd+eOTkxuPlkwvInx8f7XXNau8zLhFusu3xpa4kSSQXY6TjmPUH5H4+RqQNtdRa7s12atdovspmSlAUfD3FKJAKVjwKVJOAR8POrNaKTqi9W4XTUCvZpqUluLDSSUxgU8jyP5irHrzk+HoavJ+Fh09Mact8vc6+QQu5TyYdrC08g0yon2hIPkCoAJP9lOR+ao+6xN9n919xnLfCeU1p+1OGJbm0+AcIPvPn4rUP+kejnqaofbmw9f2eLa9O25qBaIbfCPDbHFCE/BIHgPtXsQakj8TbQ5v+xC9Rw2Vcr7Y5LU0/wDUEOsE/wD1B+9RH+F11Y3faLVULRWpJ65mnrpIShh9ZKjbpCsAKHr2lEDkPQ8VD86t31UbUjdvZa92phPO5W5AuFtx5iQ0CQn/ABoK0H7182P6eNvdyNHW3U9zgNtTZcdLjrEcBLbzagnmsJHgEnPgPQGrBxmWIUVqLGaS0y0gIbQkYCUgYAA+AFeqk5FSXb4QjrbfADt8SQMcgVZT1qo/Wu9tFcunZ166sOQrprKWmZBVEc5lmK2VIWhf9kOKSrkPXuJPxri+gPYBvdPcc6jugWvTdoeS4gODKVvqBDaPqAVKI9QgeooP1RrW2y0W+Db4EdEWHEZSwy0hPFKEJGEpA+AA8K5zdXQdv3I27uum7kkczHLsJw+TElvkEk/JWClX+E/Cvzhu8KdYLpJt1ziORJsZ1TL7Dg4rbWk8VJUPgQSK+rZf71Zpke42e8y7fOjr5sSo7ymXWl/FCknBqwenOt3WFuis2/XMRm/QwOKLpEQlmYkfAtjiSfmlJ+Vas9Sm23Sjq/psvzIWQv8AU9xE+KT5DsfaB+5bH3rfbP64sm4ehbVquBxbVLaDc2Ov8zDyfdcSf5KHzBFSlkHyr7iuVGVQBgeTY8VfbJH+ddFJdLLKl8eZAyEgZPyGap/sZoC878dRMu73ZLka0adnuOy3Qkls4OGGv+8QDnH7qTn1q8p8P5mtPrS/2/R+l7rqO6Lw1boT0xwA+Z4JSEj6qKR96/LPf3WczdvdCfqJcrkJt4kyH3Rnky44ta+GPQBRwPkK4bUKrK/Gbl2t5h1PJtxhClNK+aSk4UD9fKrKdJ/UFL0DoJzTGubku9adglTUJD5K322fHgCfzLRnnxHrk48fHk9Z9Pu19+eXe9JTHdLXZfvSDFPO3PH/ALjeCkfUoPxqMptjvNomuQ7latT2ec0eK2Xo62XU/Y4P8K19qtM5i4tvplzkOoUFoQp1SyUn0wTnFWQ6U9f6h0DpG0W++3yU/bbO4/Bt8ZbiVLZQ6rKEeWUgI8Ap2dEW7G8l1DjMpVwS0sAmOy2lCFEnPirwHn8avLCb7MZCPIhIArHvc+LY7NcL3McDcW3RH5T6z6IbbK1H+SaoPovol6jOpSz6evmqOWmtKz3VTJXaVzZBYSClaueVBbjwwOA8Mn3sYqdNZ9CW2t50BM0g7cbZHu7SORucySlx4gY5OY7YWD8SpOfjVWd6ukzcXYKUbhqmzKlWskpt90ipK4zh9AleD2lf9KiAfQkVCkK/qU2l5DjaHW1gocbWClaT5ggjxBHzroCVBAcA4FQJA9CfiK+pbi+QUpXJf9tX71Mb4UGx+oF6Zu2+d8tLzMW/JanW0vD+qZaPaLmPmo8Fn5oB+NSEP51W78VHU77Oz9g0+w5wyp+4rUP7TUZA/wA3Vf4atdtHbaIGz2jYM/sW9NklW++9t1wpUwxj/Z4qvLi0nw58ed2eJDKPCqxfitdIkbQl7f3s0pALUKWsP6gisJwI0lX/ADSAPJt05WfTS/lVQa+Cvi2nB/VkD4jFe1utEu9XKNa7fHXJlynUsMNI8VLWtQCUj5kk1Z+V+Hjtw3Zh/wCmObbL3OiR4/drRdZRBbR/WA91PaAGcqDYJxnwzxpb0ybl7FYHT20dVxrPbW3HFQYBLkiVcS8eSnHTwQpxxRJKy13EgqKE/GCFK6JdgdW3vqUm6p1YHmtI2qQYtnQoEJkuxnFJkKR/Zt+8lsE+qlg+VWvF6/TxH8K+6+OTrfknPGvuPeNUq67Oo3XO39um6J0WGNVadsLVzgPvD8+FJLYD8dX9h4ILY9FKQPHOea/OOq26ru2rL3rCal6TdrtOkT3lup4d519fJfH+z5cceVfEO1zp6j2IEt//ALbCnFfyQr/Ku72S6GN/d5Vmdo/RbtrtC8GZcZKobQT8Q2pxJcP0QDV3Oi/8PXQG1c6Jqm7OO6y1Egd1y4lIbiL/AO0wp9eM+frUU/ij9FcHdKwJ3W0XbG9ZafiIVDvEFv8A3hCbH/Ka+DyR+/HBII8fDzqg20nUruvtReRqDSer5DDbJJftc1HtEKWkf1byFFwJIPklYKDjxHpV6+nTrb0PuPJRYNSMqsOql+5HRLcHs81RPg20/wCBUfRCznPka0XUxcOvjRdxM3RMGLrjTPcVG9lVFbRcYi/DIafYPFwenhyIJ9cVotkPxT9MXySzZdwbA/pepCeKVhSjbn1H4ugHsKPzUgD515/iUdVkSfs2Nv8ATV5beXcoMi5yny1/2DsxAYQFepKnkkj4J+dVV2e2T1nvVqVFj0tYZklhLiVSLosFqDHQfNSnVYyR8E5P2q7HTP0S6B2WktakvLqb7q5KQtcyQjsxmFfGO2eTY+GeFdH1Y9NG3nUnt5I07q1hbEuOsv2e7sjjKhOkYSsfEHHFafiPiDiqsxupXqR6Z7xE0l1OaWU7BZUEIvcNKXY5SckB9vChgeclPC4D0SEeVWviW+3xorUm3R2Yo/K0Yx7aR81JByfvWY2oqGRXoTwIGKitHVJtWLpIhvboaZEoL7Lb/tiUlePDl2OXlU0xpDMuOh5ha3G1jKVJOCDUPq6O9gVSSr/Rjpok/uptz6B/BK+I/hWQzsTtNGkdyPoGzrHwKAR/KtlYtM6f0y0qPY7TZLW0r3go8NqO2VfMoQAf415a/l3OLpGRd7YkKmRmkrdQnz4rAVwV9MpGPlmvzw6mtMyNH9St5dUjslUrU8BzkfM9hTyx/wA1VaLoLgJuG8Ntt9vBKpjM911KVeHIt+IJB+GPOu06k94JemLde9PWC3MX+cpElq0mQpQRCjkgF1x4gAMtAKbwAvl4gjjXU29y0r5FZRkCt1o3cu+aIkqFpmFcVXzUHXF2pPmTyUyB9gtX2rL3VXE6h7TrNmX2RZ7PcLRbbjJUyl2W2IaIiHHUAhZR2sctAglPPx8qrrtfZOri8W2DbVdRvVE6q1tpaYXe5LjsLHo52EYB+HFAr2RtD+IDpu/W8QLlvjufEJVyU5dbpNadGPzA8hgnyP8AGrwxN1bL1A7TJ1/pnT81iJdbFNtjN0tVyVNtsGEtxKVhUdvD0RXNPaUmWe1x99JHLnBm7w7S67191G9SOrptiutvsO57S7Rc5UO2s9/2WPCSWQ4ULVzbaQlROGRyQcpyONc5J9Tk0U4mQOI8s0SrANCcnGOOa2vTv1D3DZnXcLVNkZZl9uO8+24zJ7jLrDic+yrABOMEpUMkFOM1cFz8SvW7zcl7URYrEoq5+xOabaUhs/BOUukD781yt538veqVX3VJgR0ynMiQmCww02SRawlIUQPpyNVbkXCXcpdxmS1cJUxwrWEKykKJyQn4DJ8P514wZF00FdI+o9uNSPQrlDWHGJMY8XEKHmD/wDcEVazpw61tNbkuRrDe47elr+seEduQtDbjs/JQzwQ4U+i0pBH9pI8VCo7+tUxb6fGFPXJdnspuuofYkrQUxnD7RfOOeaUpS+4DXB6EKvs7TGgtM6WcfLzlqs0SG6s+qlMtpClH5kkn714/wBXxRJpF+FZqNPjzNDmZpFB6mh8KJooeDwofChJOKHB86H8CaChnFDgZxQ/OiB8KKHzoB86H0oaH8K//9k="
 
         # Get the next PhotoID
@@ -1520,7 +2638,7 @@ def update_restaurant_photos(restaurant_id):
         })
     except Exception as e:
         db.session.rollback()
-        print(f"Error creating photo: {str(e)}")  # Add logging
+        log.error("Error creating photo: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -1536,7 +2654,6 @@ def delete_restaurant_photos(restaurant_id, photo_id):
                 'Error':'Image not found'
             }), 404
         else:
-            print('deleting photo')
             db.session.delete(target_photo)
             db.session.commit()
 
@@ -1544,7 +2661,7 @@ def delete_restaurant_photos(restaurant_id, photo_id):
                 'success': True,
             })
     except Exception as e:
-        print(f"Error deleting photo: {str(e)}")
+        log.error("Error deleting photo: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -1569,7 +2686,7 @@ def get_restaurants_by_account(): # Removed account_id parameter
             } for r in restaurants]
         })
     except Exception as e:
-        print(f"Error fetching restaurants for account {account_id}: {str(e)}")
+        log.error("Error fetching restaurants for account %s: %s", account_id, e)
         return jsonify({"error": str(e)}), 500
 
 # Lookup a customer by username for starting new chats
@@ -1582,60 +2699,341 @@ def lookup_customer(username):
             return jsonify({'error': 'User not found'}), 404
         return jsonify({'customerID': cust.CustomerID, 'username': cust.Username}), 200
     except Exception as e:
-        print(f"Error looking up customer '{username}': {str(e)}")
+        log.error("Error looking up customer '%s': %s", username, e)
         return jsonify({'error': 'Failed to lookup user'}), 500
 
+def customer_messages_query(customer_id, model=Messages):
+    """Messages (or MessagesArchive) rows sent or received by customer_id with both usernames."""
+    # Alias Customer table for sender and recipient
+    Sender = aliased(Customer)
+    Recipient = aliased(Customer)
+
+    # Join to get usernames for both parties
+    return (
+        db.session.query(
+            model,
+            Sender.Username.label('senderUsername'),
+            Recipient.Username.label('recipientUsername')
+        )
+        .join(Sender, model.SenderID == Sender.CustomerID)
+        .join(Recipient, model.RecipientID == Recipient.CustomerID)
+        .filter(
+            (model.SenderID == customer_id) | (model.RecipientID == customer_id)
+        )
+    )
+
+def message_to_dict(m, senderUsername, recipientUsername):
+    return {
+        'MessageID': m.MessageID,
+        'SenderID': m.SenderID,
+        'SenderUsername': senderUsername,
+        'RecipientID': m.RecipientID,
+        'RecipientUsername': recipientUsername,
+        'Timestamp': m.Timestamp.isoformat(),
+        'Contents': m.Contents
+    }
+
+def publish_message(message):
+    """Pushes a committed message to the open streams of both participants."""
+    try:
+        recipient = db.session.get(Customer, message.RecipientID)
+        message_bus.publish(message_to_dict(
+            message,
+            g.current_user['username'],
+            recipient.Username if recipient else None
+        ))
+    except Exception as e:
+        # The message is stored; streams pick it up on their next resume
+        log.exception("Error publishing message %s: %s", message.MessageID, e)
+
+# Write-behind ingestion for create_message (see message_writer.py)
+message_ids = IdAllocator(lambda: engines.get('customer'), IdBlock.__table__, 'Messages', Messages.MessageID)
+write_behind = None
+write_ack = MESSAGE_WRITE_ACK
+
+def publish_events(events):
+    for event in events:
+        message_bus.publish(event)
+
+def start_message_writer(ack=MESSAGE_WRITE_ACK):
+    """Switches create_message to write-behind; ack is 'commit' or 'queued'."""
+    global write_behind, write_ack
+    write_ack = ack
+    write_behind = MessageWriter(write_message_batch, publish_events).start()
+    atexit.register(write_behind.close)
+    return write_behind
+
+def stop_message_writer():
+    """Flushes the queue and goes back to synchronous inserts."""
+    global write_behind
+    writer, write_behind = write_behind, None
+    if writer is not None:
+        writer.close()
+
+if MESSAGE_WRITE_BEHIND:
+    start_message_writer()
+metrics_registry.add_collector(lambda: [('message_write_queue', (), write_behind.pending() if write_behind else 0)])
+
 #gets the message info for each customer
 @app.route('/api/customers/messages', methods=['GET'])
 @require_customer
 def get_customer_messages():
     try:
         customer_id = g.current_user['id']
+        if not is_paged():
+            # Unpaged: every message, archived ones included, as before archival existed
+            results = newest_first(
+                customer_messages_query(customer_id).all(),
+                customer_messages_query(customer_id, MessagesArchive).all(),
+                key=lambda row: row[0]
+            )
+        else:
+            try:
+                limit, before = page_args(default_limit=50, max_limit=200, cursor=parse_time_cursor)
+            except ValueError:
+                return jsonify({'success': False, 'error': 'before must be a nextBefore value'}), 400
+            results = page_with_archive(
+                customer_messages_query(customer_id), message_columns(Messages),
+                customer_messages_query(customer_id, MessagesArchive), message_columns(MessagesArchive),
+                limit, before, key=lambda row: message_order(row[0])
+            )
+        message_list = [message_to_dict(m, senderUsername, recipientUsername)
+                        for m, senderUsername, recipientUsername in results]
 
-        # Alias Customer table for sender and recipient
-        Sender = aliased(Customer)
-        Recipient = aliased(Customer)
+        response = {
+            'success': True,
+            'messages': message_list
+        }
+        if is_paged():
+            response['nextBefore'] = message_cursor(results[-1][0]) if len(message_list) == limit else None
+        return jsonify(response), 200
+    except Exception as e:
+        log.error("Error fetching messages for customer %s: %s", customer_id, e)
+        return jsonify({
+            'success': False,
+            'error': 'Failed to retrieve messages'
+        }), 500
 
-        # Join to get usernames for both parties
-        query = (
-            db.session.query(
-                Messages,
-                Sender.Username.label('senderUsername'),
-                Recipient.Username.label('recipientUsername')
-            )
-            .join(Sender, Messages.SenderID == Sender.CustomerID)
-            .join(Recipient, Messages.RecipientID == Recipient.CustomerID)
-            .filter(
-                (Messages.SenderID == customer_id) | (Messages.RecipientID == customer_id)
+# Live messages over Server-Sent Events (see message_stream.py).
+# EventSource resends the last event id on reconnect; everything after it is replayed first.
+@app.route('/api/customers/messages/stream', methods=['GET'])
+@require_customer
+def stream_customer_messages():
+    customer_id = g.current_user['id']
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    # Subscribe before reading the backlog so nothing committed in between is missed
+    subscription = message_bus.subscribe(customer_id)
+    try:
+        backlog = []
+        if last_event_id and last_event_id.isdigit():
+            # Replayed by (Timestamp, MessageID) after the last message the client got:
+            # MessageIDs from different write-behind workers are not in time order
+            resume_id = int(last_event_id)
+            resumed_at = db.session.query(Messages.Timestamp).filter(Messages.MessageID == resume_id).scalar()
+            if resumed_at is None:
+                # Archived or unknown: fall back to the ID
+                after = Messages.MessageID > resume_id
+            else:
+                after = (Messages.Timestamp > resumed_at) | (
+                    (Messages.Timestamp == resumed_at) & (Messages.MessageID > resume_id))
+            results = (
+                customer_messages_query(customer_id)
+                .filter(after)
+                .order_by(Messages.Timestamp, Messages.MessageID)
+                .limit(BACKLOG_LIMIT)
+                .all()
             )
-            .order_by(Messages.Timestamp.desc())
+            backlog = [message_to_dict(m, senderUsername, recipientUsername)
+                       for m, senderUsername, recipientUsername in results]
+    except Exception as e:
+        message_bus.unsubscribe(subscription)
+        log.error("Error opening message stream for customer %s: %s", customer_id, e)
+        return jsonify({'error': 'Failed to open message stream'}), 500
+    finally:
+        # Live events come from the bus; do not hold a pooled connection for the whole stream
+        SessionLocal.remove()
+
+    return Response(
+        stream_events(message_bus, subscription, backlog),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def page_args(default_limit=20, max_limit=100, cursor=int):
+    """Reads ?limit= and the ?before= keyset cursor from the query string.
+
+    cursor parses ?before= (an ID by default); ValueError if it is malformed.
+    """
+    limit = min(max(request.args.get('limit', default_limit, type=int), 1), max_limit)
+    before = request.args.get('before')
+    return limit, None if before is None else cursor(before)
+
+def is_paged():
+    return 'limit' in request.args or 'before' in request.args
+
+def newest_first(hot_rows, archive_rows, key=lambda message: message):
+    """Hot and archived messages merged newest first by (Timestamp, MessageID).
+
+    The archive is cut by ID, not date, so a few hot rows can be older than
+    archived ones.
+    """
+    return sorted(hot_rows + archive_rows, key=lambda row: message_order(key(row)), reverse=True)
+
+def keyset(columns, values, descending=True):
+    """Rows sorting before (descending) or after `values` on columns, most significant first.
+
+    Expanded into ORs rather than a row comparison, which MySQL can range-scan.
+    """
+    first, value = columns[0], values[0]
+    beyond = first < value if descending else first > value
+    if len(columns) == 1:
+        return beyond
+    return beyond | ((first == value) & keyset(columns[1:], values[1:], descending))
+
+def page_with_archive(hot_query, hot_order, archive_query, archive_order, limit, before, key):
+    """Newest-first keyset page over a hot table and its archive.
+
+    hot_order and archive_order are the sort columns, most significant first
+    and ending in the ID; before holds their values from the previous page and
+    key(row) a row's. The archive is cut by ID, not by these columns (see
+    archive.py), so archived rows may sort among the hot ones: the archive is
+    read only between the cursor and the last row of a full hot page.
+    """
+    if before is not None:
+        hot_query = hot_query.filter(keyset(hot_order, before))
+        archive_query = archive_query.filter(keyset(archive_order, before))
+    rows = hot_query.order_by(*[column.desc() for column in hot_order]).limit(limit).all()
+    if len(rows) == limit:
+        archive_query = archive_query.filter(keyset(archive_order, key(rows[-1]), descending=False))
+    archived = archive_query.order_by(*[column.desc() for column in archive_order]).limit(limit).all()
+    if not archived:
+        return rows
+    return sorted(rows + archived, key=key, reverse=True)[:limit]
+
+def message_columns(model):
+    """Messages or MessagesArchive sort columns, matching message_order."""
+    return [model.Timestamp, model.MessageID]
+
+def time_cursor(at, row_id):
+    return f"{at.isoformat()},{row_id}"
+
+def parse_time_cursor(value):
+    """(datetime, ID) from a nextBefore value made by time_cursor; ValueError if malformed."""
+    at, _, row_id = value.rpartition(',')
+    return datetime.fromisoformat(at), int(row_id)
+
+def message_cursor(message):
+    return time_cursor(*message_order(message))
+
+def conversation_cursor(conversation):
+    return time_cursor(conversation.LastMessageAt, conversation.LastMessageID)
+
+# Inbox: one row per conversation, newest first by (LastMessageAt, LastMessageID),
+# paged by ?before=<nextBefore of the previous page>
+@app.route('/api/customers/conversations', methods=['GET'])
+@require_customer
+def get_conversations():
+    try:
+        customer_id = g.current_user['id']
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        query = Conversation.query.filter(
+            (Conversation.CustomerA == customer_id) | (Conversation.CustomerB == customer_id)
+        )
+        if request.args.get('before'):
+            try:
+                before = parse_time_cursor(request.args['before'])
+            except ValueError:
+                return jsonify({'success': False, 'error': 'before must be a nextBefore value'}), 400
+            query = query.filter(keyset([Conversation.LastMessageAt, Conversation.LastMessageID], before))
+        conversations = (
+            query.order_by(Conversation.LastMessageAt.desc(), Conversation.LastMessageID.desc())
+            .limit(limit).all()
         )
 
-        results = query.all()
-        message_list = [{
-            'MessageID': m.MessageID,
-            'SenderID': m.SenderID,
-            'SenderUsername': senderUsername,
-            'RecipientID': m.RecipientID,
-            'RecipientUsername': recipientUsername,
-            'Timestamp': m.Timestamp.isoformat(),
-            'Contents': m.Contents
-        } for m, senderUsername, recipientUsername in results]
+        other_ids = {c.CustomerB if c.CustomerA == customer_id else c.CustomerA for c in conversations}
+        usernames = dict(
+            db.session.query(Customer.CustomerID, Customer.Username)
+            .filter(Customer.CustomerID.in_(other_ids))
+            .all()
+        ) if other_ids else {}
 
+        result = []
+        for c in conversations:
+            is_a = c.CustomerA == customer_id
+            other_id = c.CustomerB if is_a else c.CustomerA
+            result.append({
+                'ParticipantID': other_id,
+                'ParticipantUsername': usernames.get(other_id),
+                'LastMessageID': c.LastMessageID,
+                'LastMessageAt': c.LastMessageAt.isoformat(),
+                'Preview': c.Preview,
+                'Unread': c.UnreadA if is_a else c.UnreadB
+            })
         return jsonify({
             'success': True,
-            'messages': message_list
+            'conversations': result,
+            'nextBefore': conversation_cursor(conversations[-1]) if len(result) == limit else None
         }), 200
     except Exception as e:
-        print(f"Error fetching messages for customer {customer_id}: {str(e)}")
+        log.error("Error fetching conversations for customer %s: %s", customer_id, e)
+        return jsonify({'success': False, 'error': 'Failed to retrieve conversations'}), 500
+
+# One thread, newest first by (Timestamp, MessageID), paged by ?before=<nextBefore of the previous page>
+@app.route('/api/customers/conversations/<int:other_id>/messages', methods=['GET'])
+@require_customer
+def get_conversation_messages(other_id):
+    try:
+        customer_id = g.current_user['id']
+        try:
+            limit, before = page_args(default_limit=50, max_limit=200, cursor=parse_time_cursor)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'before must be a nextBefore value'}), 400
+
+        def between(model):
+            return model.query.filter(
+                ((model.SenderID == customer_id) & (model.RecipientID == other_id))
+                | ((model.SenderID == other_id) & (model.RecipientID == customer_id))
+            )
+        messages = page_with_archive(between(Messages), message_columns(Messages),
+                                     between(MessagesArchive), message_columns(MessagesArchive),
+                                     limit, before, key=message_order)
+
+        other = db.session.get(Customer, other_id)
+        usernames = {customer_id: g.current_user['username'], other_id: other.Username if other else None}
+        message_list = [message_to_dict(m, usernames.get(m.SenderID), usernames.get(m.RecipientID))
+                        for m in messages]
         return jsonify({
-            'success': False,
-            'error': 'Failed to retrieve messages'
-        }), 500
+            'success': True,
+            'messages': message_list,
+            'nextBefore': message_cursor(messages[-1]) if len(message_list) == limit else None
+        }), 200
+    except Exception as e:
+        log.error("Error fetching conversation %s/%s: %s", customer_id, other_id, e)
+        return jsonify({'success': False, 'error': 'Failed to retrieve messages'}), 500
+
+@app.route('/api/customers/conversations/<int:other_id>/read', methods=['POST'])
+@require_customer
+def mark_conversation_read(other_id):
+    try:
+        customer_id = g.current_user['id']
+        a, b = conversation_key(customer_id, other_id)
+        unread = Conversation.UnreadA if customer_id == a else Conversation.UnreadB
+        db.session.execute(
+            sa_update(Conversation)
+            .where(Conversation.CustomerA == a, Conversation.CustomerB == b)
+            .values({unread: 0})
+        )
+        db.session.commit()
+        return jsonify({'success': True}), 200
+    except Exception as e:
+        db.session.rollback()
+        log.error("Error marking conversation %s/%s read: %s", customer_id, other_id, e)
+        return jsonify({'success': False, 'error': 'Failed to mark conversation read'}), 500
 
 @app.teardown_appcontext
 def remove_db_session(exception=None):
     SessionLocal.remove()
 
 if __name__ == '__main__':
+    init_indexes()
     app.run(debug=True, port=5000)
\ No newline at end of file
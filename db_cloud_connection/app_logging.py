@@ -0,0 +1,200 @@
+"""
+Structured, sampled, non-blocking logging for api.py.
+
+Loggers live under the "axolotl" namespace, one per category:
+
+    axolotl.app         general application events and errors
+    axolotl.db          role binding, pools and replicas
+    axolotl.auth        login and token checks (debug tracing, off by default)
+    axolotl.slow_query  slow statements from request_profiler
+
+Request threads only put records on a queue; a QueueListener thread formats
+them and does the actual stdout I/O.
+
+Settings:
+    LOG_LEVEL     default level (INFO)
+    LOG_FORMAT    json (default) or text
+    LOG_ASYNC     false to write on the calling thread (default true; always
+                  false under gevent, where the listener would block the hub anyway)
+    LOG_SAMPLE    per-category sample rates for DEBUG/INFO records,
+                  e.g. "db=0.01,app=0.5". Warnings and errors are never dropped.
+    AUTH_DEBUG    true to start with auth tracing on
+
+Auth tracing can be switched at runtime with set_auth_debug() or by sending
+SIGUSR1 to the process, which toggles it.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import signal
+import sys
+from datetime import datetime, timezone
+
+from fork_hooks import gevent_patched, restart_in_child
+
+ROOT = 'axolotl'
+
+# Attributes every LogRecord has; anything else came in through extra={...}
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Renders the message and traceback on the caller, keeps extra fields."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of DEBUG/INFO records per category."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name)
+        return rate is None or random.random() < rate
+
+
+def parse_sample_rates(value):
+    rates = {}
+    for part in (value or '').split(','):
+        category, _, rate = part.strip().partition('=')
+        if category and rate:
+            rates[f'{ROOT}.{category}'] = float(rate)
+    return rates
+
+
+def get_logger(category):
+    return logging.getLogger(f'{ROOT}.{category}')
+
+
+def set_auth_debug(enabled):
+    """Turns auth debug tracing on or off for the running process."""
+    get_logger('auth').setLevel(logging.DEBUG if enabled else logging.NOTSET)
+
+
+def auth_debug_enabled():
+    return get_logger('auth').isEnabledFor(logging.DEBUG)
+
+
+def _toggle_auth_debug(signum, frame):
+    set_auth_debug(not auth_debug_enabled())
+    get_logger('app').warning('Auth debug tracing %s', 'enabled' if auth_debug_enabled() else 'disabled')
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at emit time (so redirect_stdout works)."""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+def setup_logging(stream=None, asynchronous=None):
+    """Installs the handlers on the "axolotl" logger.
+
+    Records go through a queue to a background listener unless asynchronous
+    is False (or LOG_ASYNC=false), in which case the calling thread writes
+    them itself. Calling it again replaces the previous setup.
+    """
+    global _listener
+    if asynchronous is None:
+        asynchronous = os.getenv('LOG_ASYNC', 'true').lower() == 'true' and not gevent_patched()
+
+    root = logging.getLogger(ROOT)
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    root.propagate = False
+
+    handler = logging.StreamHandler(stream) if stream else _StdoutHandler()
+    if os.getenv('LOG_FORMAT', 'json').lower() == 'text':
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    else:
+        handler.setFormatter(JSONFormatter())
+
+    if asynchronous:
+        log_queue = queue.SimpleQueue()
+        front = _QueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, handler)
+        _listener.start()
+    else:
+        front = handler
+    front.addFilter(SamplingFilter(parse_sample_rates(os.getenv('LOG_SAMPLE'))))
+    root.addHandler(front)
+
+    set_auth_debug(os.getenv('AUTH_DEBUG', 'false').lower() == 'true')
+    if hasattr(signal, 'SIGUSR1'):
+        try:
+            signal.signal(signal.SIGUSR1, _toggle_auth_debug)
+        except ValueError:
+            pass  # Not the main thread (e.g. imported by a test runner)
+
+
+def _stop_listener():
+    # Drain whatever is still queued on shutdown
+    if _listener is not None:
+        _listener.stop()
+
+
+def _flush_before_fork():
+    # Anything still buffered would otherwise be written by parent and child
+    for handler in (_listener.handlers if _listener is not None else logging.getLogger(ROOT).handlers):
+        handler.flush()
+
+
+def _restart_listener():
+    # Children start their own listener on the same queue
+    global _listener
+    if _listener is not None:
+        _listener = logging.handlers.QueueListener(_listener.queue, *_listener.handlers)
+        _listener.start()
+
+
+atexit.register(_stop_listener)
+os.register_at_fork(before=_flush_before_fork)
+restart_in_child(_restart_listener)
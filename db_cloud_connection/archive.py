@@ -0,0 +1,143 @@
+"""
+Hot/cold archival for Messages and Orders.
+
+Moves old rows into Messages_Archive, Orders_Archive and FoodOrders_Archive
+(same columns as the hot tables) in chunks, one transaction per chunk, so the
+hot tables and their indexes only hold the recent window:
+
+    cd db_cloud_connection
+    python archive.py --messages-days 365 --orders-days 730
+    python archive.py --dry-run
+
+Only the oldest contiguous run of IDs is moved; a table stops at its first
+row inside the horizon. Every archived ID is therefore below every hot ID,
+and the paged read endpoints continue into the archive with the same
+?before= cursor (api.page_with_archive). IDs only roughly follow time:
+write-behind workers each hand out their own block of MessageIDs (see
+message_writer.py), so a recent row in a lower block holds back older rows
+with higher IDs until it ages past the horizon too, and paged messages
+merge the hot and archived rows by (Timestamp, MessageID). The newest row
+always stays hot, so new IDs, which start above MAX(ID) of the hot table,
+never reuse an archived one.
+
+Orders without an OrderDate (placed before migrations/003_archive.sql, so
+they hold the lowest OrderIDs) count as older than any horizon and are
+archived first; otherwise they would block every order after them.
+
+Settings:
+    ARCHIVE_MESSAGES_DAYS  default message horizon in days (365)
+    ARCHIVE_ORDERS_DAYS    default order horizon in days (730)
+    ARCHIVE_CHUNK_ROWS     rows moved per transaction (5000)
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import case, delete, func, insert, or_, select
+
+from api import (FoodOrders, FoodOrdersArchive, Messages, MessagesArchive, Orders, OrdersArchive,
+                 backend, db, engines)
+
+MESSAGES_DAYS = float(os.getenv('ARCHIVE_MESSAGES_DAYS', '365'))
+ORDERS_DAYS = float(os.getenv('ARCHIVE_ORDERS_DAYS', '730'))
+CHUNK_ROWS = int(os.getenv('ARCHIVE_CHUNK_ROWS', '5000'))
+
+
+class ArchiveTarget:
+    """A hot table, its archive and child tables that move with it."""
+
+    def __init__(self, name, hot, archive, id_column, date_column, children=()):
+        self.name = name
+        self.hot = hot.__table__
+        self.archive = archive.__table__
+        self.id_column = id_column
+        self.date_column = date_column
+        # [(hot child model, archive child model)] keyed by the same ID column name
+        self.children = [(child.__table__, child_archive.__table__) for child, child_archive in children]
+
+
+TARGETS = {
+    'Messages': ArchiveTarget('Messages', Messages, MessagesArchive, Messages.MessageID, Messages.Timestamp),
+    'Orders': ArchiveTarget('Orders', Orders, OrdersArchive, Orders.OrderID, Orders.OrderDate,
+                            children=[(FoodOrders, FoodOrdersArchive)]),
+}
+
+
+def oldest_run(connection, target, cutoff, chunk_rows):
+    """IDs of the oldest hot rows, in order, up to the first one inside the horizon."""
+    newest = connection.execute(select(func.max(target.id_column))).scalar()
+    # Compared in SQL: SQLite hands back naive datetimes and stores them as text.
+    # Undated rows are legacy orders, older than every dated one
+    old = case((or_(target.date_column.is_(None), target.date_column < cutoff), 1), else_=0)
+    rows = connection.execute(
+        select(target.id_column, old).order_by(target.id_column).limit(chunk_rows)
+    ).all()
+    ids = []
+    for row_id, is_old in rows:
+        if not is_old or row_id == newest:
+            break
+        ids.append(row_id)
+    return ids
+
+
+def move(connection, hot, archive, key, low, high):
+    in_range = hot.c[key].between(low, high)
+    connection.execute(insert(archive).from_select([c.name for c in hot.columns], select(hot).where(in_range)))
+    connection.execute(delete(hot).where(in_range))
+
+
+def archive_chunk(connection, target, cutoff, chunk_rows=CHUNK_ROWS):
+    """Moves up to chunk_rows rows (and their children); returns how many moved."""
+    ids = oldest_run(connection, target, cutoff, chunk_rows)
+    if not ids:
+        return 0
+    # The run is contiguous in ID order, so a range covers it exactly
+    low, high = ids[0], ids[-1]
+    key = target.id_column.name
+    # Children first: their foreign keys point at the hot parent
+    for child, child_archive in target.children:
+        move(connection, child, child_archive, key, low, high)
+    move(connection, target.hot, target.archive, key, low, high)
+    return len(ids)
+
+
+def archive_table(engine, target, days, chunk_rows=CHUNK_ROWS, dry_run=False, now=None):
+    """Archives target rows older than `days`; returns (rows moved, seconds)."""
+    cutoff = (now or datetime.now(timezone.utc)).replace(tzinfo=None) - timedelta(days=days)
+    started = time.perf_counter()
+    moved = 0
+    while True:
+        with engine.begin() as connection:
+            if dry_run:
+                # Counts what one pass would move without writing anything
+                count = len(oldest_run(connection, target, cutoff, sys.maxsize))
+                return count, time.perf_counter() - started
+            count = archive_chunk(connection, target, cutoff, chunk_rows)
+        moved += count
+        if count < chunk_rows:
+            return moved, time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Move old Messages and Orders rows into the archive tables.')
+    parser.add_argument('--messages-days', type=float, default=MESSAGES_DAYS)
+    parser.add_argument('--orders-days', type=float, default=ORDERS_DAYS)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--tables', nargs='*', choices=sorted(TARGETS), default=sorted(TARGETS))
+    parser.add_argument('--dry-run', action='store_true', help='only count the rows that would move')
+    args = parser.parse_args(argv)
+
+    engine = engines.get('admin')
+    backend.prepare_schema(db.metadata, engine)
+    horizons = {'Messages': args.messages_days, 'Orders': args.orders_days}
+    for name in args.tables:
+        count, seconds = archive_table(engine, TARGETS[name], horizons[name], args.chunk_rows, args.dry_run)
+        verb = 'would move' if args.dry_run else 'moved'
+        print(f"  {name:<10} {verb} {count:>10} rows older than {horizons[name]:g} days  {seconds:7.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+Type-ahead lookups for /api/autocomplete/restaurants, /foods and /customers.
+
+Each PrefixIndex keeps one sorted list of folded keys with a parallel list of
+IDs, so the entries under a prefix are one contiguous slice found with two
+bisects. A name is entered once per word ("pizza house 12", "house 12",
+"12" for "Pizza House 12"), so a prefix matches the start of any word.
+Matches are ranked by popularity (order counts), then alphabetically.
+
+A prefix's ranking is computed on first use and cached until a key under
+it changes; one- and two-character prefixes are ranked when the index is
+built. A narrow slice is ranked directly. A wide one ("user" among a million
+usernames) is ranked from the cached rankings of its one-character-longer
+prefixes, so no lookup touches more than SCAN_THRESHOLD keys plus a few
+dozen child rankings.
+
+Names created, renamed or deleted through the API are applied at once.
+Popularity is a snapshot taken when the index is built and refreshed every
+AUTOCOMPLETE_REFRESH_SECONDS. /metrics reports each index's size as
+autocomplete_bytes.
+
+Settings:
+    AUTOCOMPLETE_REFRESH_SECONDS  rebuild interval in seconds (default 300, 0 = never)
+"""
+import bisect
+import heapq
+import os
+import sys
+import threading
+
+from search_index import tokenize
+
+REFRESH_SECONDS = float(os.getenv('AUTOCOMPLETE_REFRESH_SECONDS', '300'))
+
+# Most results a lookup returns; also what is cached per prefix
+MAX_RESULTS = 20
+
+# Prefix rankings kept before the cache is cleared
+CACHE_SIZE = 50000
+
+# Slices wider than this are ranked from their child prefixes
+SCAN_THRESHOLD = 2000
+
+# Sorts after every character a folded key can contain
+_END = '\uffff'
+
+
+def fold(text):
+    """The lower-cased, accent-free words of text joined by single spaces."""
+    return ' '.join(tokenize(text))
+
+
+def word_keys(text):
+    words = tokenize(text)
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+class PrefixIndex:
+    """Sorted (key, ID) pairs with popularity-ranked prefix lookups.
+
+    IDs are anything hashable. Adding an ID that is already present only
+    counts a reference, so a shared name (the same dish at many restaurants)
+    stays until the last of them is discarded.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.keys = []          # sorted folded keys
+        self.ids = []           # ID of keys[i]
+        self.labels = {}        # ID -> display name
+        self.refs = {}          # ID -> times added, only where more than once
+        self.popularity = {}    # ID -> order count
+        self._top = {}          # prefix -> [ID] best first
+        self._lock = threading.RLock()
+        self._bytes = None
+
+    @classmethod
+    def build(cls, name, rows, popularity=(), refs=None):
+        """rows are (ID, display name); popularity is (ID, order count) and
+        refs optionally {ID: references} for IDs shared by several rows."""
+        index = cls(name)
+        entries = []
+        for item_id, label in rows:
+            if not label:
+                continue
+            if item_id in index.labels:
+                index.refs[item_id] = index.refs.get(item_id, 1) + 1
+                continue
+            index.labels[item_id] = label
+            entries.extend((key, item_id) for key in word_keys(label))
+        entries.sort(key=lambda entry: entry[0])
+        index.keys = [key for key, _ in entries]
+        index.ids = [item_id for _, item_id in entries]
+        index.popularity = dict(popularity)
+        if refs:
+            index.refs.update((item_id, count) for item_id, count in refs.items()
+                              if count > 1 and item_id in index.labels)
+        for prefix in {key[:n] for key in index.keys for n in (1, 2)}:
+            index.top(prefix)
+        return index
+
+    def _order(self, item_id):
+        return -self.popularity.get(item_id, 0), self.labels[item_id]
+
+    def _rank_children(self, prefix, low, high):
+        # Keys equal to the prefix, then the best of each longer prefix
+        position = bisect.bisect_right(self.keys, prefix, low, high)
+        candidates = set(self.ids[low:position])
+        while position < high:
+            child = self.keys[position][:len(prefix) + 1]
+            candidates.update(self.top(child))
+            position = bisect.bisect_left(self.keys, child + _END, position, high)
+        return heapq.nsmallest(MAX_RESULTS, candidates, key=self._order)
+
+    def top(self, prefix, limit=MAX_RESULTS):
+        """The most popular IDs with a word starting with prefix (already folded)."""
+        ranked = self._top.get(prefix)
+        if ranked is None:
+            with self._lock:
+                low = bisect.bisect_left(self.keys, prefix)
+                high = bisect.bisect_left(self.keys, prefix + _END, low)
+                if high - low > SCAN_THRESHOLD:
+                    ranked = self._rank_children(prefix, low, high)
+                else:
+                    ranked = heapq.nsmallest(MAX_RESULTS, set(self.ids[low:high]), key=self._order)
+                if len(self._top) >= CACHE_SIZE:
+                    self._top.clear()
+                self._top[prefix] = ranked
+        return ranked[:limit]
+
+    def lookup(self, query, limit=MAX_RESULTS):
+        """[(ID, display name, order count)] for a raw query string."""
+        prefix = fold(query)
+        if not prefix:
+            return []
+        return [(i, self.labels[i], self.popularity.get(i, 0)) for i in self.top(prefix, limit) if i in self.labels]
+
+    def _forget(self, key):
+        # Every cached prefix of a changed key may rank differently now
+        for n in range(1, len(key) + 1):
+            self._top.pop(key[:n], None)
+
+    def add(self, item_id, label):
+        if not label:
+            return
+        with self._lock:
+            if item_id in self.labels:
+                self.refs[item_id] = self.refs.get(item_id, 1) + 1
+                return
+            self.labels[item_id] = label
+            for key in word_keys(label):
+                position = bisect.bisect_right(self.keys, key)
+                self.keys.insert(position, key)
+                self.ids.insert(position, item_id)
+                self._forget(key)
+            self._bytes = None
+
+    def add_many(self, rows):
+        """add() for many (ID, display name) rows, merging new keys in one pass."""
+        with self._lock:
+            entries = []
+            for item_id, label in rows:
+                if not label:
+                    continue
+                if item_id in self.labels:
+                    self.refs[item_id] = self.refs.get(item_id, 1) + 1
+                    continue
+                self.labels[item_id] = label
+                entries.extend((key, item_id) for key in word_keys(label))
+            if not entries:
+                return
+            entries.sort(key=lambda entry: entry[0])
+            # Stable on equal keys, so new entries land after existing ones as in add()
+            merged = list(heapq.merge(zip(self.keys, self.ids), entries, key=lambda entry: entry[0]))
+            self.keys = [key for key, _ in merged]
+            self.ids = [item_id for _, item_id in merged]
+            for key, _ in entries:
+                self._forget(key)
+            self._bytes = None
+
+    def discard_many(self, item_ids):
+        """discard() for many IDs, removing their keys in one pass."""
+        with self._lock:
+            gone = set()
+            for item_id in item_ids:
+                if item_id not in self.labels:
+                    continue
+                refs = self.refs.pop(item_id, 1)
+                if refs > 1:
+                    if refs > 2:
+                        self.refs[item_id] = refs - 1
+                    continue
+                label = self.labels.pop(item_id)
+                gone.add(item_id)
+                for key in word_keys(label):
+                    self._forget(key)
+            if not gone:
+                return
+            kept = [(key, item_id) for key, item_id in zip(self.keys, self.ids) if item_id not in gone]
+            self.keys = [key for key, _ in kept]
+            self.ids = [item_id for _, item_id in kept]
+            self._bytes = None
+
+    def discard(self, item_id):
+        with self._lock:
+            if item_id not in self.labels:
+                return
+            refs = self.refs.pop(item_id, 1)
+            if refs > 1:
+                if refs > 2:
+                    self.refs[item_id] = refs - 1
+                return
+            for key in word_keys(self.labels.pop(item_id)):
+                low = bisect.bisect_left(self.keys, key)
+                high = bisect.bisect_right(self.keys, key, low)
+                for position in range(low, high):
+                    if self.ids[position] == item_id:
+                        del self.keys[position]
+                        del self.ids[position]
+                        break
+                self._forget(key)
+            self._bytes = None
+
+    def replace(self, item_id, label):
+        """Renames a uniquely owned ID (a restaurant or customer)."""
+        self.discard(item_id)
+        self.add(item_id, label)
+
+    def memory_bytes(self):
+        """Approximate footprint of the keys, IDs, labels and counts."""
+        if self._bytes is None:
+            size = sys.getsizeof
+            total = size(self.keys) + size(self.ids) + sum(size(key) for key in self.keys)
+            total += sum(size(i) for i in self.labels)
+            for mapping in (self.labels, self.refs, self.popularity):
+                total += size(mapping)
+            total += sum(size(label) for label in self.labels.values())
+            self._bytes = total
+        return self._bytes
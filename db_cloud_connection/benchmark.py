@@ -0,0 +1,581 @@
+"""
+Endpoint load test and regression benchmark for api.py.
+
+Drives every route through the Flask app, either in-process (test client) or
+over HTTP against a running server (--url), with N concurrent workers and a
+weighted mix of guest, customer and restaurant traffic.
+
+Reports per-endpoint p50/p95/p99 latency, throughput and SQL statements per
+request (over HTTP only when the server sends Server-Timing for every request,
+i.e. PROFILE_SAMPLE_RATE=1). Results can be saved as a JSON baseline and later
+compared; a comparison run exits with status 1 on regressions.
+
+Usage:
+    DB_BACKEND=sqlite python generate_data.py --scale 1 --truncate
+    DB_BACKEND=sqlite python benchmark.py --duration 30 --concurrency 8 --save-baseline baseline.json
+    DB_BACKEND=sqlite python benchmark.py --duration 30 --concurrency 8 --compare baseline.json
+
+The cost of logging can be measured the same way: save a baseline with
+--logging sync --auth-debug (every trace line written on the request thread,
+as the old print statements did) and compare a default run against it.
+
+Message ingestion is compared with --mix chat=1 (bursts of create_message),
+once as is and once with --write-behind commit or --write-behind queued.
+
+Bulk menu imports are timed with --mix menu=1 --concurrency 1: menu_import_10k
+uploads a 10,000-dish menu, which should take under a second.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from sqlalchemy import Engine, event, text
+
+import api
+import app_logging
+from generate_data import CATEGORIES, CUISINES, DISH_TYPES, DISH_WORDS, FEATURES, PRICE_RANGES
+
+# Relative weight of each role in the traffic mix
+DEFAULT_MIX = {'guest': 60, 'customer': 30, 'restaurant': 10}
+
+# Worst allowed change against a baseline before a comparison run fails
+DEFAULT_TOLERANCE = 0.20
+
+_sql_counter = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    _sql_counter.count = getattr(_sql_counter, 'count', 0) + 1
+
+
+class Dataset:
+    """ID ranges of the loaded data, read once before the run."""
+
+    def __init__(self):
+        with api.engines.get('admin').connect() as conn:
+            def scalar(sql):
+                return conn.execute(text(sql)).scalar() or 0
+            self.max_customer = scalar('SELECT MAX(CustomerID) FROM Customer')
+            self.max_restaurant = scalar('SELECT MAX(RestaurantID) FROM Restaurant')
+            self.max_account = scalar('SELECT MAX(AccountID) FROM Restaurant_Account')
+            self.max_message = scalar('SELECT MAX(MessageID) FROM Messages')
+        if not (self.max_customer and self.max_restaurant and self.max_account):
+            raise SystemExit('Benchmark needs data; run generate_data.py first.')
+
+    def customer(self, rng):
+        return rng.randint(1, self.max_customer)
+
+    def restaurant(self, rng):
+        return rng.randint(1, self.max_restaurant)
+
+    def account(self, rng):
+        return rng.randint(1, self.max_account)
+
+
+# Each scenario is a generator that yields (endpoint, method, path, body) and
+# receives (status, json) back, so multi-step flows can use created IDs.
+
+def guest_browse(data, rng):
+    # Mostly the first page, sometimes one of the next nine
+    offset = 0 if rng.random() < 0.7 else 6 * rng.randint(1, 9)
+    yield 'front_page', 'GET', f'/api/restaurants/front-page?offset={offset}', None
+    restaurant_id = data.restaurant(rng)
+    yield 'restaurant_by_id', 'GET', f'/api/restaurants/{restaurant_id}', None
+    yield 'restaurant_foods', 'GET', f'/api/restaurants/{restaurant_id}/foods', None
+    yield 'restaurant_reviews', 'GET', f'/api/restaurants/{restaurant_id}/reviews', None
+    yield 'restaurant_photos', 'GET', f'/api/restaurants/{restaurant_id}/photos', None
+
+
+def guest_recommendations(data, rng):
+    # Neighbour lists from recommendations.py; empty until it has run
+    restaurant_id = data.restaurant(rng)
+    yield 'similar_restaurants', 'GET', f'/api/restaurants/{restaurant_id}/similar', None
+    status, body = yield 'restaurant_foods', 'GET', f'/api/restaurants/{restaurant_id}/foods', None
+    foods = (body or {}).get('foodlist') or []
+    if foods:
+        food_id = rng.choice(foods)['FoodID']
+        yield 'also_ordered', 'GET', f'/api/restaurants/{restaurant_id}/foods/{food_id}/also-ordered', None
+
+
+def guest_list_all(data, rng):
+    yield 'all_restaurants', 'GET', '/api/restaurants', None
+
+
+def guest_reviewed(data, rng):
+    yield 'reviewed_restaurants', 'GET', f'/api/customers/{data.customer(rng)}/restaurants', None
+
+
+def guest_search(data, rng):
+    # Type-ahead: the box fires a query per keystroke once a few characters are in
+    words = [rng.choice(DISH_WORDS), rng.choice(DISH_TYPES + CATEGORIES)]
+    query = ' '.join(words).lower()
+    for end in range(3, len(query) + 1, 3):
+        yield 'search', 'GET', f'/api/search?q={quote(query[:end])}', None
+
+
+def guest_autocomplete(data, rng):
+    dish = f'{rng.choice(DISH_WORDS)} {rng.choice(DISH_TYPES)}'.lower()
+    for end in range(1, len(dish) + 1, 2):
+        yield 'autocomplete_foods', 'GET', f'/api/autocomplete/foods?q={quote(dish[:end])}', None
+    yield 'autocomplete_restaurants', 'GET', f'/api/autocomplete/restaurants?q={quote(dish[:3])}', None
+
+
+def guest_facets(data, rng):
+    # Narrowing a browse one facet at a time
+    filters = [f'cuisine={quote(rng.choice(CUISINES))}', f'feature={quote(rng.choice(FEATURES))}',
+               f'price={quote(rng.choice(PRICE_RANGES))}']
+    for n in range(1, len(filters) + 1):
+        yield 'browse', 'GET', f"/api/restaurants/browse?{'&'.join(filters[:n])}", None
+
+
+def guest_login(data, rng):
+    yield 'login', 'POST', '/api/auth/login', {'username': f'user{data.customer(rng)}', 'password': 'password'}
+
+
+def guest_signup(data, rng):
+    name = f'bench{rng.getrandbits(48):x}'
+    yield 'signup', 'POST', '/api/auth/signup', {'username': name, 'email': f'{name}@example.com', 'password': 'password'}
+
+
+def customer_orders(data, rng):
+    restaurant_id = data.restaurant(rng)
+    status, body = yield 'restaurant_foods', 'GET', f'/api/restaurants/{restaurant_id}/foods', None
+    foods = (body or {}).get('foodlist') or []
+    if foods:
+        picked = rng.sample(foods, min(len(foods), rng.randint(1, 3)))
+        items = [{'FoodID': f['FoodID'], 'quantity': rng.randint(1, 3)} for f in picked]
+        total = round(sum(f['Price'] * i['quantity'] for f, i in zip(picked, items)), 2)
+        yield 'create_order', 'POST', '/api/orders', {
+            'RestaurantID': restaurant_id, 'items': items, 'PriceTotal': total, 'Additional_Costs': 2.99
+        }
+    yield 'customer_orders', 'GET', '/api/orders/customer', None
+
+
+def customer_messages(data, rng):
+    yield 'customer_messages', 'GET', '/api/customers/messages', None
+    status, body = yield 'lookup_customer', 'GET', f'/api/customers/lookup/user{data.customer(rng)}', None
+    recipient = (body or {}).get('customerID')
+    if recipient:
+        status, body = yield 'create_message', 'POST', '/api/messages', {'recipientID': recipient, 'contents': 'benchmark hello'}
+        message_id = (body or {}).get('messageID')
+        if message_id:
+            yield 'message_by_id', 'GET', f'/api/messages/{message_id}', None
+    yield 'user_messages', 'GET', f'/api/messages/user_messages/{data.customer(rng)}', None
+
+
+def customer_inbox(data, rng):
+    status, body = yield 'conversations', 'GET', '/api/customers/conversations', None
+    conversations = (body or {}).get('conversations') or []
+    if conversations:
+        other_id = rng.choice(conversations)['ParticipantID']
+        yield 'conversation_messages', 'GET', f'/api/customers/conversations/{other_id}/messages', None
+        yield 'conversation_read', 'POST', f'/api/customers/conversations/{other_id}/read', None
+
+
+def chat_burst(data, rng):
+    # A quick back-and-forth: the traffic write-behind ingestion is meant for
+    recipient = data.customer(rng)
+    for i in range(rng.randint(5, 15)):
+        yield 'create_message', 'POST', '/api/messages', {'recipientID': recipient, 'contents': f'burst {i}'}
+
+
+def customer_all_messages(data, rng):
+    yield 'all_messages', 'GET', '/api/messages', None
+
+
+def customer_reviews(data, rng, customer_id):
+    restaurant_id = data.restaurant(rng)
+    status, body = yield 'create_review', 'POST', '/api/reviews', {
+        'RestaurantID': restaurant_id, 'CustomerID': customer_id, 'Rating': rng.randint(1, 5),
+        'ReviewContent': 'benchmark review', 'Date': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+    review_id = ((body or {}).get('review') or {}).get('ReviewID')
+    yield 'customer_reviews', 'GET', '/api/customers/reviews', None
+    if review_id:
+        yield 'update_review', 'PUT', f'/api/reviews/{review_id}', {'rating': rng.randint(1, 5), 'content': 'edited'}
+        yield 'delete_review', 'DELETE', f'/api/reviews/{review_id}', None
+
+
+def customer_addresses(data, rng):
+    address = f'{rng.randint(1, 9999)} Benchmark Ave #{rng.getrandbits(32):x}'
+    yield 'address_list', 'GET', '/api/customers/address', None
+    yield 'address_create', 'POST', '/api/customers/address', {'address': address}
+    yield 'address_update', 'PUT', '/api/customers/address', {'old_address': address, 'new_address': address + ' B'}
+    yield 'address_delete', 'DELETE', '/api/customers/address', {'address': address + ' B'}
+
+
+def customer_nearby(data, rng):
+    # The saved address's coordinates feed the grid index; no Restaurant scan
+    yield 'nearby_k', 'GET', '/api/customers/address/nearby?k=10', None
+    yield 'nearby_radius', 'GET', '/api/customers/address/nearby?radius_km=1&k=50', None
+
+
+def restaurant_manage(data, rng):
+    status, body = yield 'account_restaurants', 'GET', '/api/restaurants/account', None
+    owned = (body or {}).get('restaurants') or []
+    restaurant_id = owned[0]['RestaurantID'] if owned else data.restaurant(rng)
+    status, body = yield 'create_food', 'POST', f'/api/restaurants/{restaurant_id}/foods', {'FoodName': 'Benchmark Bowl', 'Price': 9.5}
+    food_id = ((body or {}).get('food') or {}).get('FoodID')
+    if food_id:
+        yield 'update_food', 'PUT', f'/api/restaurants/{restaurant_id}/foods/{food_id}', {'Price': 10.5}
+        yield 'delete_food', 'DELETE', f'/api/restaurants/{restaurant_id}/foods/{food_id}', None
+
+
+def restaurant_menu_import(data, rng):
+    status, body = yield 'account_restaurants', 'GET', '/api/restaurants/account', None
+    owned = (body or {}).get('restaurants') or []
+    if not owned:
+        return
+    restaurant_id = owned[0]['RestaurantID']
+    status, body = yield 'restaurant_foods', 'GET', f'/api/restaurants/{restaurant_id}/foods', None
+    menu = [{'FoodID': f['FoodID'], 'FoodName': f['FoodName'], 'Price': f['Price']}
+            for f in (body or {}).get('foodlist') or []]
+    # Add a dish, then put the menu back as it was
+    special = {'FoodName': 'Benchmark Special', 'Price': 12.5}
+    yield 'menu_import', 'PUT', f'/api/restaurants/{restaurant_id}/menu', {'items': menu + [special]}
+    yield 'menu_import', 'PUT', f'/api/restaurants/{restaurant_id}/menu', {'items': menu}
+
+
+# Dishes in a bulk menu import; the import should finish in under a second
+LARGE_MENU_ITEMS = 10000
+
+
+def large_menu_import(data, rng):
+    # A chain uploading its whole menu into a new restaurant, then repricing it
+    status, body = yield 'create_restaurant', 'POST', '/api/restaurants', {'restaurantData': {
+        'name': 'Benchmark Chain', 'category': 'Cafe', 'phoneNumber': '555-000-0000', 'address': '1 Bench St'
+    }}
+    restaurant_id = ((body or {}).get('restaurant') or {}).get('RestaurantID')
+    if not restaurant_id:
+        return
+    menu = [{'FoodName': f'Chain Dish {i}', 'Price': round(5 + i % 200 * 0.25, 2)} for i in range(LARGE_MENU_ITEMS)]
+    status, body = yield 'menu_import_10k', 'PUT', f'/api/restaurants/{restaurant_id}/menu', {'items': menu}
+    inserted = (body or {}).get('inserted') or []
+    repriced = [{'FoodID': f['FoodID'], 'FoodName': f['FoodName'], 'Price': item['Price'] + 0.5}
+                for f, item in zip(inserted, menu)]
+    if repriced:
+        yield 'menu_reprice_10k', 'PUT', f'/api/restaurants/{restaurant_id}/menu', {'items': repriced}
+    yield 'delete_restaurant', 'DELETE', f'/api/restaurants/{restaurant_id}', None
+
+
+def restaurant_reports(data, rng):
+    status, body = yield 'account_restaurants', 'GET', '/api/restaurants/account', None
+    owned = (body or {}).get('restaurants') or []
+    if not owned:
+        return
+    restaurant_id = owned[0]['RestaurantID']
+    # A year of rollups: one row per day, whatever the order count
+    interval = rng.choice(('day', 'week', 'month'))
+    yield 'restaurant_analytics', 'GET', f'/api/restaurants/{restaurant_id}/analytics?from=2024-01-01&to=2024-12-31&interval={interval}', None
+    yield 'restaurant_dish_analytics', 'GET', f'/api/restaurants/{restaurant_id}/analytics/dishes?from=2024-01-01&to=2024-12-31', None
+    fmt = rng.choice(('csv', 'ndjson'))
+    yield 'restaurant_export', 'GET', f'/api/restaurants/{restaurant_id}/orders/export?format={fmt}&gzip={rng.choice((0, 1))}', None
+
+
+def restaurant_lifecycle(data, rng):
+    status, body = yield 'create_restaurant', 'POST', '/api/restaurants', {'restaurantData': {
+        'name': 'Benchmark Bistro', 'category': 'Cafe', 'phoneNumber': '555-000-0000', 'address': '1 Bench St'
+    }}
+    restaurant_id = ((body or {}).get('restaurant') or {}).get('RestaurantID')
+    if not restaurant_id:
+        return
+    yield 'update_restaurant', 'PUT', f'/api/restaurants/{restaurant_id}', {'restaurantData': {
+        'RestaurantName': 'Benchmark Bistro 2', 'Category': 'Cafe', 'PhoneNumber': '555-000-0001', 'Address': '2 Bench St'
+    }}
+    status, body = yield 'create_photo', 'POST', f'/api/restaurants/{restaurant_id}/photos', {'PhotoImage': TINY_PNG}
+    photo_id = ((body or {}).get('photo') or {}).get('PhotoID')
+    if photo_id:
+        yield 'delete_photo', 'DELETE', f'/api/restaurants/{restaurant_id}/photos/{photo_id}', None
+    yield 'delete_restaurant', 'DELETE', f'/api/restaurants/{restaurant_id}', None
+
+
+# 1x1 PNG, enough to exercise the image compression path
+TINY_PNG = 'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+
+# role -> [(weight, scenario)]
+SCENARIOS = {
+    'guest': [(50, guest_browse), (5, guest_list_all), (10, guest_reviewed), (10, guest_login), (1, guest_signup),
+              (15, guest_search), (10, guest_autocomplete),
+              (10, guest_facets), (10, guest_recommendations)],
+    'customer': [(40, customer_orders), (30, customer_messages), (20, customer_inbox),
+                 (2, customer_all_messages),
+                 (15, customer_reviews), (10, customer_addresses), (10, customer_nearby)],
+    'restaurant': [(80, restaurant_manage), (5, restaurant_lifecycle), (15, restaurant_reports),
+                   (5, restaurant_menu_import)],
+    # Not in the default mix; e.g. --mix chat=1 to measure messages/sec
+    'chat': [(1, chat_burst)],
+    # Not in the default mix; --mix menu=1 times LARGE_MENU_ITEMS-dish imports
+    'menu': [(1, large_menu_import)],
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class InProcessClient:
+    def __init__(self):
+        self.client = api.app.test_client()
+
+    def request(self, method, path, body, headers):
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, body, headers):
+        try:
+            response = self.session.request(method, self.base_url + path, json=body, headers=headers)
+        except self.requests.ConnectionError:
+            # e.g. a recycled worker closed this keep-alive connection; counted as an error
+            _sql_counter.count = None
+            return 599, None
+        _sql_counter.count = server_timing_queries(response.headers.get('Server-Timing'))
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+def server_timing_queries(header):
+    """Reads the statement count from a request_profiler Server-Timing header."""
+    match = re.search(r'db;[^,]*desc="(\d+) queries"', header or '')
+    return int(match.group(1)) if match else None
+
+
+class Recorder:
+    """Collects latency/SQL samples per endpoint; one instance per worker."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.sql_counts = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint, seconds, status, sql_count):
+        self.latencies[endpoint].append(seconds * 1000.0)
+        if sql_count is not None:
+            self.sql_counts[endpoint].append(sql_count)
+        if status >= 500:
+            self.errors[endpoint] += 1
+
+
+def run_worker(worker_id, args, data, deadline):
+    rng = random.Random(f'{args.seed}:{worker_id}')
+    client = HttpClient(args.url) if args.url else InProcessClient()
+    recorder = Recorder()
+    roles = list(args.mix)
+    role_weights = [args.mix[r] for r in roles]
+    requests_left = args.requests
+
+    while time.perf_counter() < deadline and (requests_left is None or requests_left > 0):
+        role = rng.choices(roles, role_weights)[0]
+        weights, scenarios = zip(*SCENARIOS[role])
+        scenario = rng.choices(scenarios, weights)[0]
+
+        headers = {}
+        extra = ()
+        if role in ('customer', 'chat'):
+            customer_id = data.customer(rng)
+            headers['Authorization'] = 'Bearer ' + api.generate_token(customer_id, 'customer')
+            if scenario is customer_reviews:
+                extra = (customer_id,)
+        elif role in ('restaurant', 'menu'):
+            headers['Authorization'] = 'Bearer ' + api.generate_token(data.account(rng), 'restaurant')
+
+        steps = scenario(data, rng, *extra)
+        reply = None
+        try:
+            while True:
+                endpoint, method, path, body = steps.send(reply)
+                _sql_counter.count = 0
+                started = time.perf_counter()
+                status, payload = client.request(method, path, body, headers)
+                elapsed = time.perf_counter() - started
+                recorder.record(endpoint, elapsed, status, _sql_counter.count)
+                reply = (status, payload)
+                if requests_left is not None:
+                    requests_left -= 1
+        except StopIteration:
+            pass
+    return recorder
+
+
+def summarize(recorders, wall_seconds):
+    merged = Recorder()
+    for recorder in recorders:
+        for endpoint, values in recorder.latencies.items():
+            merged.latencies[endpoint].extend(values)
+        for endpoint, values in recorder.sql_counts.items():
+            merged.sql_counts[endpoint].extend(values)
+        for endpoint, count in recorder.errors.items():
+            merged.errors[endpoint] += count
+
+    endpoints = {}
+    all_latencies = []
+    for endpoint, values in sorted(merged.latencies.items()):
+        values.sort()
+        all_latencies.extend(values)
+        sql = merged.sql_counts.get(endpoint)
+        endpoints[endpoint] = {
+            'requests': len(values),
+            'errors': merged.errors.get(endpoint, 0),
+            'p50_ms': percentile(values, 50),
+            'p95_ms': percentile(values, 95),
+            'p99_ms': percentile(values, 99),
+            'sql_per_request': sum(sql) / len(sql) if sql else None,
+        }
+    all_latencies.sort()
+    messages = endpoints.get('create_message', {})
+    return {
+        'requests': len(all_latencies),
+        'seconds': wall_seconds,
+        'throughput_rps': len(all_latencies) / wall_seconds if wall_seconds else 0.0,
+        'messages_per_second': (messages.get('requests', 0) - messages.get('errors', 0)) / wall_seconds if wall_seconds else 0.0,
+        'p50_ms': percentile(all_latencies, 50),
+        'p95_ms': percentile(all_latencies, 95),
+        'p99_ms': percentile(all_latencies, 99),
+        'endpoints': endpoints,
+    }
+
+
+def print_report(report, out=sys.stdout):
+    print(f"{'endpoint':<24}{'reqs':>8}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'sql/req':>9}", file=out)
+    for endpoint, stats in report['endpoints'].items():
+        sql = '-' if stats['sql_per_request'] is None else f"{stats['sql_per_request']:.1f}"
+        print(f"{endpoint:<24}{stats['requests']:>8}{stats['errors']:>6}{stats['p50_ms']:>10.2f}"
+              f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{sql:>9}", file=out)
+    print(f"\n{report['requests']} requests in {report['seconds']:.1f}s: {report['throughput_rps']:.1f} req/s, "
+          f"p50 {report['p50_ms']:.2f} ms, p95 {report['p95_ms']:.2f} ms, p99 {report['p99_ms']:.2f} ms", file=out)
+    if report.get('messages_per_second'):
+        print(f"{report['messages_per_second']:.1f} messages/s created", file=out)
+
+
+def compare(report, baseline, tolerance):
+    """Returns a list of regression descriptions (empty if none)."""
+    problems = []
+    if report['throughput_rps'] < baseline['throughput_rps'] * (1 - tolerance):
+        problems.append(f"throughput {report['throughput_rps']:.1f} req/s < baseline {baseline['throughput_rps']:.1f}")
+    for endpoint, base in baseline['endpoints'].items():
+        current = report['endpoints'].get(endpoint)
+        if not current or current['requests'] < 20 or base['requests'] < 20:
+            continue  # Too few samples to compare percentiles
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            problems.append(f"{endpoint}: p95 {current['p95_ms']:.2f} ms > baseline {base['p95_ms']:.2f} ms")
+        # Statement counts barely move between runs, so growth past the tolerance
+        # means a code path started issuing extra queries
+        if base['sql_per_request'] is not None and current['sql_per_request'] is not None \
+                and current['sql_per_request'] > base['sql_per_request'] + max(0.5, base['sql_per_request'] * tolerance):
+            problems.append(f"{endpoint}: {current['sql_per_request']:.1f} SQL/request > baseline {base['sql_per_request']:.1f}")
+    return problems
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        role, _, weight = part.partition('=')
+        if role not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown role '{role}'")
+        mix[role] = float(weight)
+    return mix
+
+
+def run(args):
+    data = Dataset()
+    app_logging.setup_logging(asynchronous=args.logging == 'async')
+    app_logging.set_auth_debug(args.auth_debug)
+    if args.log_level:
+        logging.getLogger(app_logging.ROOT).setLevel(args.log_level.upper())
+    deadline = time.perf_counter() + args.duration
+    # Silence the app's output so writing it to a terminal does not dominate the measurement
+    quiet = contextlib.ExitStack()
+    if args.quiet:
+        quiet.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        quiet.enter_context(contextlib.redirect_stderr(io.StringIO()))
+    if args.write_behind != 'off' and not args.url:
+        api.start_message_writer(args.write_behind)
+    started = time.perf_counter()
+    with quiet, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(run_worker, i, args, data, deadline) for i in range(args.concurrency)]
+        recorders = [f.result() for f in futures]
+        # Queued messages count only once they are written
+        api.stop_message_writer()
+    report = summarize(recorders, time.perf_counter() - started)
+    report['config'] = {
+        'mode': 'http' if args.url else 'in-process',
+        'concurrency': args.concurrency,
+        'mix': args.mix,
+        'backend': api.backend.name,
+        'logging': args.logging,
+        'auth_debug': args.auth_debug,
+        'write_behind': args.write_behind,
+    }
+    return report
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Load test every api.py route.')
+    parser.add_argument('--url', help='benchmark a running server over HTTP instead of in-process')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run')
+    parser.add_argument('--requests', type=int, help='stop each worker after this many requests')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help='e.g. guest=60,customer=30,restaurant=10')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--quiet', action='store_true', help="discard the app's stdout/stderr during the run")
+    parser.add_argument('--logging', choices=('async', 'sync'), default='async',
+                        help='write log records on a background thread (default) or on the request thread (in-process only)')
+    parser.add_argument('--auth-debug', action='store_true', help='turn on auth debug tracing for the run (in-process only)')
+    parser.add_argument('--log-level', help='override LOG_LEVEL for the run, e.g. debug (in-process only)')
+    parser.add_argument('--write-behind', choices=('off', 'commit', 'queued'), default='off',
+                        help='queue create_message rows and insert them in batches, acknowledging on commit or on '
+                             'queueing (in-process only)')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the report to PATH as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='fail if the run regresses against baseline PATH')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        if problems:
+            print('\nRegressions:')
+            for problem in problems:
+                print(f'  {problem}')
+            return 1
+        print('\nNo regressions against baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""
+Database backends for api.py.
+
+DB_BACKEND selects where the API connects:
+
+- mysql (default): Cloud SQL over SSL, one MySQL user per role
+- sqlite: a local file (DB_SQLITE_PATH) shared by all roles. Roles are
+  emulated in-process: the guest role's connections are read-only
+  (PRAGMA query_only), the others can write. The schema is created on
+  startup from the models in api.py plus any table in db_structure.txt that
+  has no model yet.
+
+The sqlite backend is meant for local benchmarking and stress runs on a box
+without network access, not for production.
+"""
+import os
+import re
+
+from sqlalchemy import Column, Date, DateTime, Float, Integer, MetaData, String, Table, Text, event, inspect, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_STRUCTURE_PATH = os.path.join(BASE_DIR, '..', 'db_structure.txt')
+
+
+class MySQLBackend:
+    name = 'mysql'
+
+    def __init__(self, credentials, host, port, database):
+        self.credentials = credentials
+        self.host = host
+        self.port = port
+        self.database = database
+
+    def role_uri(self, role):
+        user, password = self.credentials[role]
+        return f"mysql+pymysql://{user}:{password}@{self.host}:{self.port}/{self.database}"
+
+    def replica_uri(self, role, host):
+        host, _, port = host.partition(':')
+        user, password = self.credentials[role]
+        return f"mysql+pymysql://{user}:{password}@{host}:{port or self.port}/{self.database}"
+
+    def engine_options(self):
+        return {'connect_args': {'ssl': {'ca': None}}}  # Use SSL but don't verify certificate
+
+    def configure_engine(self, engine, role):
+        pass
+
+    def prepare_schema(self, metadata, engine):
+        # Cloud SQL schema is managed by hand (see commands.sql and migrations/).
+        # engine may be a callable, left uncalled so no admin pool is opened
+        pass
+
+    def upsert(self, table, values, keys, update):
+        """INSERT ... ON DUPLICATE KEY UPDATE; `update` may reference the existing row.
+
+        Assignments keep the order of `update`: MySQL evaluates them left to
+        right, each seeing the columns already set.
+        """
+        return mysql_insert(table).values(**values).on_duplicate_key_update(list(update.items()))
+
+    def bulk_upsert(self, table, rows, keys, columns, increment=()):
+        """One multi-row upsert setting `columns` from the new rows on duplicates.
+
+        Columns in `increment` are added to the existing values instead. With
+        rows=None the statement takes the rows as executemany parameters, which
+        compiles once however many rows there are.
+        """
+        statement = mysql_insert(table) if rows is None else mysql_insert(table).values(rows)
+        update = {column: statement.inserted[column] for column in columns}
+        update.update({column: table.c[column] + statement.inserted[column] for column in increment})
+        return statement.on_duplicate_key_update(update)
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    # Roles that may not write, mirroring the SELECT-only guest MySQL user
+    READ_ONLY_ROLES = ('guest',)
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def role_uri(self, role):
+        return f"sqlite:///{self.path}"
+
+    def replica_uri(self, role, path):
+        return f"sqlite:///{os.path.abspath(path)}"
+
+    def engine_options(self):
+        return {'connect_args': {'check_same_thread': False, 'timeout': 30}}
+
+    def configure_engine(self, engine, role):
+        read_only = role in self.READ_ONLY_ROLES
+
+        @event.listens_for(engine, 'connect')
+        def _set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            if read_only:
+                cursor.execute('PRAGMA query_only=ON')
+            cursor.close()
+
+    def prepare_schema(self, metadata, engine):
+        """Creates missing tables, columns and indexes; engine may be a callable returning it."""
+        if callable(engine):
+            engine = engine()
+        metadata.create_all(engine)
+        # create_all skips existing tables entirely, so add columns and indexes declared since
+        existing = inspect(engine)
+        with engine.begin() as connection:
+            for table in metadata.sorted_tables:
+                present = {c['name'] for c in existing.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in present and column.nullable:
+                        connection.execute(text(
+                            f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(engine.dialect)}'
+                        ))
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+        structure_tables(metadata=MetaData(), skip=set(metadata.tables)).create_all(engine)
+
+    def upsert(self, table, values, keys, update):
+        """INSERT ... ON CONFLICT DO UPDATE; `update` may reference the existing row."""
+        return sqlite_insert(table).values(**values).on_conflict_do_update(index_elements=keys, set_=update)
+
+    def bulk_upsert(self, table, rows, keys, columns, increment=()):
+        """One multi-row upsert setting `columns` from the new rows on conflicts.
+
+        Columns in `increment` are added to the existing values instead. With
+        rows=None the statement takes the rows as executemany parameters, which
+        compiles once however many rows there are.
+        """
+        statement = sqlite_insert(table) if rows is None else sqlite_insert(table).values(rows)
+        update = {column: statement.excluded[column] for column in columns}
+        update.update({column: table.c[column] + statement.excluded[column] for column in increment})
+        return statement.on_conflict_do_update(index_elements=keys, set_=update)
+
+
+SQL_TYPES = {
+    'int': lambda n: Integer(),
+    'float': lambda n: Float(),
+    'date': lambda n: Date(),
+    'datetime': lambda n: DateTime(),
+    'text': lambda n: Text(),
+    'varchar': lambda n: String(int(n)),
+}
+
+
+def parse_db_structure(path=DB_STRUCTURE_PATH):
+    """Parses db_structure.txt into {table: [(column, type_name, length), ...]}."""
+    tables = {}
+    current = None
+    with open(path) as f:
+        for line in f:
+            table_match = re.match(r'^Table:\s*(\w+)', line)
+            column_match = re.match(r'^\s+(\w+):\s*(\w+)(?:\((\d+)\))?', line)
+            if table_match:
+                current = tables.setdefault(table_match.group(1), [])
+            elif column_match and current is not None:
+                current.append(column_match.groups())
+    return tables
+
+
+def structure_tables(metadata, skip=(), path=DB_STRUCTURE_PATH):
+    """Builds Table objects for db_structure.txt tables not listed in skip.
+
+    <Table>ID is the primary key when it is the first column; tables made only
+    of *ID columns (RestaurantCuisine, ...) get a composite primary key.
+    """
+    for table_name, columns in parse_db_structure(path).items():
+        if table_name in skip:
+            continue
+        names = [name for name, _, _ in columns]
+        if names and names[0] == f'{table_name}ID':
+            primary = {names[0]}
+        elif names and all(name.endswith('ID') for name in names):
+            primary = set(names)
+        else:
+            primary = set()
+        Table(table_name, metadata, *[
+            Column(name, SQL_TYPES[type_name.lower()](length), primary_key=name in primary)
+            for name, type_name, length in columns
+        ])
+    return metadata
+
+
+def backend_from_env(credentials, host, port, database):
+    name = os.getenv('DB_BACKEND', 'mysql').lower()
+    if name == 'sqlite':
+        return SQLiteBackend(os.getenv('DB_SQLITE_PATH', os.path.join(BASE_DIR, 'local.db')))
+    if name == 'mysql':
+        return MySQLBackend(credentials, host, port, database)
+    raise ValueError(f"Unknown DB_BACKEND '{name}' (expected 'mysql' or 'sqlite')")
@@ -0,0 +1,200 @@
+"""
+Per-role SQLAlchemy engine registry.
+
+Each database role (guest, customer, restaurant, admin) gets its own engine
+with its own pool settings. Hot roles are created when the registry is built,
+rarely used roles (admin by default) are created the first time they are
+requested. Pool settings come from DEFAULT_POOL_CONFIG, optionally overridden
+by a JSON file (DB_POOL_CONFIG) and then by DB_POOL_<ROLE>_<SETTING> env vars.
+
+With DB_MAX_CONNECTIONS set (the share of the Cloud SQL connection limit this
+app may use), the pools are scaled down so DB_WORKER_COUNT processes together
+stay under it. gunicorn.conf.py sets DB_WORKER_COUNT to its worker count.
+"""
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event, exc
+
+from app_logging import get_logger
+
+log = get_logger('db')
+
+ROLES = ('guest', 'customer', 'restaurant', 'admin')
+
+# pool_timeout/pool_recycle are in seconds, warmup is the number of connections
+# opened by EngineRegistry.warmup()
+DEFAULT_POOL_CONFIG = {
+    'guest': {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 10, 'pool_recycle': 1800, 'lazy': False, 'warmup': 4},
+    'customer': {'pool_size': 10, 'max_overflow': 10, 'pool_timeout': 10, 'pool_recycle': 1800, 'lazy': False, 'warmup': 4},
+    'restaurant': {'pool_size': 5, 'max_overflow': 5, 'pool_timeout': 10, 'pool_recycle': 1800, 'lazy': False, 'warmup': 2},
+    'admin': {'pool_size': 2, 'max_overflow': 3, 'pool_timeout': 10, 'pool_recycle': 1800, 'lazy': True, 'warmup': 0},
+}
+
+# Env var suffix -> pool setting, e.g. DB_POOL_GUEST_SIZE=20
+ENV_SETTINGS = {
+    'SIZE': ('pool_size', int),
+    'MAX_OVERFLOW': ('max_overflow', int),
+    'TIMEOUT': ('pool_timeout', int),
+    'RECYCLE': ('pool_recycle', int),
+    'LAZY': ('lazy', lambda v: v.lower() in ('1', 'true', 'yes')),
+    'WARMUP': ('warmup', int),
+}
+
+# Connections idle for longer than this are pinged on checkout. Connections
+# reused within the window skip the round trip that pool_pre_ping would cost.
+LIVENESS_IDLE_SECONDS = float(os.getenv('DB_LIVENESS_IDLE_SECONDS', '30'))
+
+
+def fit_pool_config(config, max_connections, processes=1):
+    """Scales pool_size/max_overflow so `processes` copies fit in max_connections.
+
+    Every role keeps at least one pooled connection, so very small budgets can
+    still be exceeded by one connection per role.
+    """
+    budget = max_connections // max(1, processes)
+    total = sum(s.get('pool_size', 5) + s.get('max_overflow', 10) for s in config.values())
+    if total <= budget:
+        return config
+    factor = budget / total
+    for role, settings in config.items():
+        settings['pool_size'] = max(1, int(settings.get('pool_size', 5) * factor))
+        settings['max_overflow'] = int(settings.get('max_overflow', 10) * factor)
+        settings['warmup'] = min(settings.get('warmup', 0), settings['pool_size'])
+    log.info("Pools scaled to %d connections per process (%d processes, cap %d)",
+             sum(s['pool_size'] + s['max_overflow'] for s in config.values()), processes, max_connections)
+    return config
+
+
+def load_pool_config():
+    """Returns {role: settings} merged from defaults, DB_POOL_CONFIG and env vars."""
+    config = {role: dict(settings) for role, settings in DEFAULT_POOL_CONFIG.items()}
+
+    config_path = os.getenv('DB_POOL_CONFIG')
+    if config_path:
+        with open(config_path) as f:
+            for role, settings in json.load(f).items():
+                config.setdefault(role, {}).update(settings)
+
+    for role in config:
+        for suffix, (key, cast) in ENV_SETTINGS.items():
+            value = os.getenv(f'DB_POOL_{role.upper()}_{suffix}')
+            if value is not None:
+                config[role][key] = cast(value)
+
+    max_connections = os.getenv('DB_MAX_CONNECTIONS')
+    if max_connections:
+        fit_pool_config(config, int(max_connections), int(os.getenv('DB_WORKER_COUNT', '1')))
+    return config
+
+
+def _ping(dbapi_connection):
+    # PyMySQL exposes a cheap COM_PING; everything else gets a trivial query
+    if hasattr(dbapi_connection, 'ping'):
+        dbapi_connection.ping(reconnect=False)
+    else:
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+
+
+def install_liveness_check(engine, idle_seconds=LIVENESS_IDLE_SECONDS):
+    """Pings a pooled connection on checkout only if it sat idle too long."""
+
+    @event.listens_for(engine, 'checkin')
+    def _record_checkin(dbapi_connection, connection_record):
+        connection_record.info['last_used'] = time.monotonic()
+
+    @event.listens_for(engine, 'checkout')
+    def _check_idle(dbapi_connection, connection_record, connection_proxy):
+        last_used = connection_record.info.get('last_used')
+        if last_used is None or time.monotonic() - last_used < idle_seconds:
+            return
+        try:
+            _ping(dbapi_connection)
+        except Exception as e:
+            # The pool discards this connection and retries with a fresh one
+            raise exc.DisconnectionError(f'Stale pooled connection: {e}')
+
+
+class EngineRegistry:
+    """Creates and caches one engine per role."""
+
+    def __init__(self, uri_for_role, base_options=None, pool_config=None, configure_engine=None):
+        self.uri_for_role = uri_for_role
+        self.base_options = dict(base_options or {})
+        self.configure_engine = configure_engine
+        self.pool_config = pool_config if pool_config is not None else load_pool_config()
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def engine_options(self, role):
+        settings = self.pool_config.get(role, {})
+        options = dict(self.base_options)
+        for key in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle'):
+            if key in settings:
+                options[key] = settings[key]
+        # Lets pool-level instrumentation (metrics.TimedQueuePool) label by role
+        options['pool_logging_name'] = role
+        return options
+
+    def get(self, role):
+        engine = self._engines.get(role)
+        if engine is not None:
+            return engine
+        with self._lock:
+            engine = self._engines.get(role)
+            if engine is None:
+                engine = self.build_engine(role, self.uri_for_role(role))
+                self._engines[role] = engine
+        return engine
+
+    def build_engine(self, role, uri):
+        """Creates an engine for `role` at `uri` with the role's pool settings."""
+        engine = create_engine(uri, **self.engine_options(role))
+        install_liveness_check(engine)
+        if self.configure_engine is not None:
+            self.configure_engine(engine, role)
+        return engine
+
+    def create_eager(self):
+        """Creates engines for every role that is not configured as lazy."""
+        for role in ROLES:
+            if not self.pool_config.get(role, {}).get('lazy', False):
+                self.get(role)
+
+    def warmup(self, roles=None):
+        """Opens `warmup` connections per role so first requests skip the handshake."""
+        for role in roles or ROLES:
+            count = self.pool_config.get(role, {}).get('warmup', 0)
+            if count <= 0:
+                continue
+            engine = self.get(role)
+            connections = []
+            try:
+                for _ in range(count):
+                    connections.append(engine.connect())
+            except Exception as e:
+                log.warning("Pool warmup for %s stopped after %d connections: %s", role, len(connections), e)
+            finally:
+                # Returning them leaves them idle in the pool
+                for conn in connections:
+                    conn.close()
+
+    def created(self):
+        """Returns {role: engine} for the engines built so far."""
+        return dict(self._engines)
+
+    def dispose_all(self, close=True):
+        for engine in self.created().values():
+            engine.dispose(close=close)
+
+    def after_fork(self):
+        """Call in a forked child: drops the parent's pooled connections without
+        closing them (the parent still owns the sockets)."""
+        self._lock = threading.Lock()
+        self.dispose_all(close=False)
@@ -0,0 +1,159 @@
+"""
+Bitmap facets for /api/restaurants/browse.
+
+Every facet value (a cuisine, a feature, a category, a price range) has a
+bitset of the restaurants that have it, kept as a Python int with bit n set
+for RestaurantID n. Filters are evaluated with & and |; the number of
+matches is a popcount.
+
+Values selected within one facet are OR'd ('any', the default) or AND'ed
+('all'); facets are AND'ed together. Facet counts are disjunctive: a facet
+in 'any' mode is counted against the other facets' filters only, so the
+counts show what choosing another value of it would give.
+
+Category and PriceRange come from Restaurant and are updated by the
+restaurant endpoints after they commit. Cuisines and features are only
+assigned in the database, so they are picked up by the periodic rebuild
+(FACETS_REFRESH_SECONDS).
+
+Settings:
+    FACETS_REFRESH_SECONDS  rebuild interval in seconds (default 300, 0 = never)
+"""
+import os
+import threading
+
+REFRESH_SECONDS = float(os.getenv('FACETS_REFRESH_SECONDS', '300'))
+
+FACETS = ('cuisine', 'feature', 'category', 'price')
+
+
+def iter_bits(bits):
+    """Positions of the set bits, lowest first."""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+class FacetIndex:
+    def __init__(self):
+        self.bitsets = {facet: {} for facet in FACETS}     # facet -> value -> bits
+        self.values = {}                                    # RestaurantID -> facet -> set of values
+        self.all = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, restaurants, cuisines, features, known=None):
+        """restaurants are (RestaurantID, Category, PriceRange); cuisines and
+        features are (RestaurantID, name). known optionally lists the values
+        of each facet that should be reported even with no restaurants."""
+        index = cls()
+        for facet, names in (known or {}).items():
+            for name in names:
+                index.bitsets[facet].setdefault(name, 0)
+        # Accumulate bit positions per value first: OR-ing into a growing int
+        # one restaurant at a time would copy it every time
+        positions = {facet: {} for facet in FACETS}
+        for restaurant_id, category, price in restaurants:
+            index.values[restaurant_id] = {facet: set() for facet in FACETS}
+            for facet, value in (('category', category), ('price', price)):
+                if value:
+                    positions[facet].setdefault(value, []).append(restaurant_id)
+                    index.values[restaurant_id][facet].add(value)
+        for facet, rows in (('cuisine', cuisines), ('feature', features)):
+            for restaurant_id, name in rows:
+                if restaurant_id in index.values:
+                    positions[facet].setdefault(name, []).append(restaurant_id)
+                    index.values[restaurant_id][facet].add(name)
+        for facet, by_value in positions.items():
+            for value, ids in by_value.items():
+                index.bitsets[facet][value] = bits_of(ids)
+        index.all = bits_of(index.values)
+        return index
+
+    def set_values(self, restaurant_id, facet, values):
+        """Replaces one facet's values for a restaurant, adding it if new."""
+        values = {v for v in values if v}
+        bit = 1 << restaurant_id
+        with self._lock:
+            current = self.values.setdefault(restaurant_id, {f: set() for f in FACETS})
+            self.all |= bit
+            bitsets = self.bitsets[facet]
+            for value in current[facet] - values:
+                bitsets[value] &= ~bit
+            for value in values - current[facet]:
+                bitsets[value] = bitsets.get(value, 0) | bit
+            current[facet] = values
+
+    def remove_restaurant(self, restaurant_id):
+        bit = 1 << restaurant_id
+        with self._lock:
+            current = self.values.pop(restaurant_id, None)
+            if current is None:
+                return
+            self.all &= ~bit
+            for facet, values in current.items():
+                for value in values:
+                    self.bitsets[facet][value] &= ~bit
+
+    def _facet_filter(self, facet, selected, match):
+        bitsets = self.bitsets[facet]
+        if match == 'all':
+            bits = self.all
+            for value in selected:
+                bits &= bitsets.get(value, 0)
+            return bits
+        bits = 0
+        for value in selected:
+            bits |= bitsets.get(value, 0)
+        return bits
+
+    def query(self, filters, matches=None):
+        """filters maps facet -> selected values, matches facet -> 'any' or 'all'.
+
+        Returns (matching bits, {facet: {value: count}}).
+        """
+        matches = matches or {}
+        parts = {
+            facet: self._facet_filter(facet, selected, matches.get(facet, 'any'))
+            for facet, selected in filters.items() if selected
+        }
+        result = self.all
+        for bits in parts.values():
+            result &= bits
+
+        counts = {}
+        for facet in FACETS:
+            if facet in parts and matches.get(facet, 'any') == 'any':
+                base = self.all
+                for other, bits in parts.items():
+                    if other != facet:
+                        base &= bits
+            else:
+                base = result
+            counts[facet] = {
+                value: (base & bits).bit_count() for value, bits in sorted(self.bitsets[facet].items())
+            }
+        return result, counts
+
+
+def bits_of(ids):
+    # Build via a bytearray: one pass and one int conversion
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        buffer[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def page(bits, after=0, limit=20):
+    """Up to limit set positions greater than after, and whether more follow."""
+    bits >>= after + 1
+    ids = []
+    for position in iter_bits(bits):
+        if len(ids) == limit:
+            return ids, True
+        ids.append(position + after + 1)
+    return ids, False
@@ -0,0 +1,25 @@
+"""
+Fork handling for modules that keep background threads.
+
+Pre-fork servers (gunicorn.conf.py) import the app once and fork workers
+from it. Real threads do not survive fork, so each module registers a hook
+that starts a fresh one in the child. Under gevent those "threads" are
+greenlets, which do survive fork, so nothing is restarted there.
+"""
+import os
+
+
+def gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def restart_in_child(start):
+    """Calls start() in every forked child to replace a background thread."""
+    def _restart():
+        if not gevent_patched():
+            start()
+    os.register_at_fork(after_in_child=_restart)
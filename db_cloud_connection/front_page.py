@@ -0,0 +1,200 @@
+"""
+Front_Page ranking from recent orders, reviews and paid boosts, with decay.
+
+Each event adds points to its restaurant's score and then halves every
+half-life:
+
+    order   FRONT_PAGE_ORDER_POINTS
+    review  FRONT_PAGE_REVIEW_POINTS per star above 3 (1 and 2 stars subtract)
+    boost   the Points bought (Front_Page_Boost), on FRONT_PAGE_BOOST_HALF_LIFE_HOURS
+
+Decay is multiplicative, so scores are kept in memory and advanced: a run
+multiplies every score by the decay since the previous run and adds the
+orders, reviews and boosts whose IDs are above the last ones counted. The
+first run, and one every FRONT_PAGE_FULL_HOURS, recomputes from the events
+of the last FRONT_PAGE_WINDOW_DAYS instead, which also drops edited and
+deleted reviews.
+
+The best FRONT_PAGE_SLOTS restaurants are written to Front_Page in one bulk
+upsert (PushPoints = rounded score, SlotRank = 1, 2, ..., Date = run time);
+rows that dropped out are deleted in the same transaction. The API serves
+the list from memory (api.load_front_page).
+
+Run by scheduler.py, or once with
+
+    cd db_cloud_connection
+    python front_page.py
+
+Settings:
+    FRONT_PAGE_ORDER_POINTS          points per order (default 1)
+    FRONT_PAGE_REVIEW_POINTS         points per review star above 3 (default 5)
+    FRONT_PAGE_HALF_LIFE_HOURS       order and review half-life (default 72)
+    FRONT_PAGE_BOOST_HALF_LIFE_HOURS boost half-life (default 168)
+    FRONT_PAGE_WINDOW_DAYS           events older than this are ignored (default 30)
+    FRONT_PAGE_FULL_HOURS            hours between full recomputes (default 24)
+    FRONT_PAGE_SLOTS                 restaurants ranked (default 60, see api.py)
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, select
+
+from api import FRONT_PAGE_SLOTS, FrontPage, FrontPageBoost, Orders, Restaurant, Review, backend, db, engines
+
+ORDER_POINTS = float(os.getenv('FRONT_PAGE_ORDER_POINTS', '1'))
+REVIEW_POINTS = float(os.getenv('FRONT_PAGE_REVIEW_POINTS', '5'))
+HALF_LIFE_HOURS = float(os.getenv('FRONT_PAGE_HALF_LIFE_HOURS', '72'))
+BOOST_HALF_LIFE_HOURS = float(os.getenv('FRONT_PAGE_BOOST_HALF_LIFE_HOURS', '168'))
+WINDOW_DAYS = float(os.getenv('FRONT_PAGE_WINDOW_DAYS', '30'))
+FULL_HOURS = float(os.getenv('FRONT_PAGE_FULL_HOURS', '24'))
+
+# Scores that have decayed below this are forgotten
+MIN_SCORE = 0.01
+
+FETCH_ROWS = 100000
+
+
+class EventSource:
+    """One event table: its ID and time columns and the points of a row."""
+
+    def __init__(self, name, id_column, restaurant_column, time_column, points, half_life_hours):
+        self.name = name
+        self.id_column = id_column
+        self.restaurant_column = restaurant_column
+        self.time_column = time_column
+        self.points = points        # SQL expression
+        self.half_life = half_life_hours * 3600
+
+
+SOURCES = [
+    EventSource('orders', Orders.OrderID, Orders.RestaurantID, Orders.OrderDate, ORDER_POINTS, HALF_LIFE_HOURS),
+    EventSource('reviews', Review.ReviewID, Review.RestaurantID, Review.Date,
+                (Review.Rating - 3) * REVIEW_POINTS, HALF_LIFE_HOURS),
+    EventSource('boosts', FrontPageBoost.BoostID, FrontPageBoost.RestaurantID, FrontPageBoost.PurchasedAt,
+                FrontPageBoost.Points, BOOST_HALF_LIFE_HOURS),
+]
+
+
+class FrontPageRanker:
+    def __init__(self, slots=FRONT_PAGE_SLOTS, sources=SOURCES):
+        self.slots = slots
+        self.sources = sources
+        # Scores as of self.as_of, per half-life: {half-life: {RestaurantID: points}}
+        self.scores = {}
+        self.as_of = None
+        self.full_at = None
+        self.last_ids = {}      # source name -> highest ID counted
+
+    def _add(self, connection, source, now, after=None, upto=None):
+        """Adds the decayed points of a source's events in the window; returns the count."""
+        scores = self.scores.setdefault(source.half_life, {})
+        query = select(source.restaurant_column, source.time_column, source.points).where(
+            source.time_column.is_not(None), source.time_column >= now - timedelta(days=WINDOW_DAYS))
+        if after is not None:
+            query = query.where(source.id_column > after)
+        if upto is not None:
+            query = query.where(source.id_column <= upto)
+        result = connection.execution_options(stream_results=True, yield_per=FETCH_ROWS).execute(query)
+        count = 0
+        half_life = source.half_life
+        for restaurant_id, at, points in result:
+            # Future timestamps (clock skew, client-supplied review dates) count as now
+            age = max(0.0, (now - at).total_seconds())
+            scores[restaurant_id] = scores.get(restaurant_id, 0.0) + float(points) * 0.5 ** (age / half_life)
+            count += 1
+        return count
+
+    def recompute(self, connection, now):
+        """Scores from scratch over the window; returns events counted."""
+        self.scores = {}
+        counted = 0
+        for source in self.sources:
+            # Everything up to the current top ID, so the next advance() starts right after it
+            upto = connection.execute(select(func.max(source.id_column))).scalar() or 0
+            counted += self._add(connection, source, now, upto=upto)
+            self.last_ids[source.name] = upto
+        self.as_of = self.full_at = now
+        return counted
+
+    def advance(self, connection, now):
+        """Decays scores to `now` and adds events since the last run; returns events counted."""
+        for half_life, scores in self.scores.items():
+            factor = 0.5 ** (max(0.0, (now - self.as_of).total_seconds()) / half_life)
+            for restaurant_id, score in list(scores.items()):
+                score *= factor
+                if abs(score) < MIN_SCORE:
+                    del scores[restaurant_id]
+                else:
+                    scores[restaurant_id] = score
+        counted = 0
+        for source in self.sources:
+            upto = connection.execute(select(func.max(source.id_column))).scalar() or 0
+            counted += self._add(connection, source, now, after=self.last_ids.get(source.name, 0), upto=upto)
+            self.last_ids[source.name] = max(upto, self.last_ids.get(source.name, 0))
+        self.as_of = now
+        return counted
+
+    def totals(self):
+        totals = {}
+        for scores in self.scores.values():
+            for restaurant_id, score in scores.items():
+                totals[restaurant_id] = totals.get(restaurant_id, 0.0) + score
+        return totals
+
+    def ranking(self, connection):
+        """[(RestaurantID, score)] for the top slots, best first, existing restaurants only."""
+        totals = self.totals()
+        order = sorted((r for r, score in totals.items() if score > 0), key=lambda r: (-totals[r], r))
+        ranked = []
+        # Checked a few slots' worth at a time, so deleted restaurants are skipped
+        step = self.slots * 2
+        for start in range(0, len(order), step):
+            if len(ranked) >= self.slots:
+                break
+            chunk = order[start:start + step]
+            existing = set(connection.execute(
+                select(Restaurant.RestaurantID).where(Restaurant.RestaurantID.in_(chunk))).scalars())
+            for restaurant_id in chunk:
+                if restaurant_id in existing:
+                    ranked.append((restaurant_id, totals[restaurant_id]))
+                else:
+                    for scores in self.scores.values():
+                        scores.pop(restaurant_id, None)
+        return ranked[:self.slots]
+
+    def run(self, engine, now=None):
+        """Updates the scores and rewrites Front_Page; returns a summary dict."""
+        # Whole seconds: MySQL DATETIME drops the fraction, and stale rows are found by Date < now
+        now = (now or datetime.now(timezone.utc)).replace(tzinfo=None, microsecond=0)
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            full = self.as_of is None or now - self.full_at >= timedelta(hours=FULL_HOURS)
+            counted = self.recompute(connection, now) if full else self.advance(connection, now)
+            ranked = self.ranking(connection)
+            rows = [
+                {'RestaurantID': restaurant_id, 'PushPoints': round(score), 'Date': now, 'SlotRank': rank}
+                for rank, (restaurant_id, score) in enumerate(ranked, start=1)
+            ]
+            if rows:
+                connection.execute(backend.bulk_upsert(
+                    FrontPage.__table__, rows, ['RestaurantID'], ['PushPoints', 'Date', 'SlotRank']))
+            removed = connection.execute(delete(FrontPage.__table__).where(FrontPage.Date < now)).rowcount
+        return {
+            'mode': 'full' if full else 'incremental', 'events': counted, 'scored': len(self.totals()),
+            'ranked': len(rows), 'removed': removed, 'seconds': time.perf_counter() - started,
+        }
+
+
+def main(argv=None):
+    engine = engines.get('admin')
+    backend.prepare_schema(db.metadata, engine)
+    summary = FrontPageRanker().run(engine)
+    print(f"  {summary['mode']} ranking: {summary['events']} events, {summary['scored']} restaurants scored, "
+          f"{summary['ranked']} ranked, {summary['removed']} removed  {summary['seconds']:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""
+In-memory grid index of restaurant coordinates for the "nearby" endpoints.
+
+Points are bucketed into square cells GEO_CELL_KM on a side (in degrees of
+latitude; cells get narrower in kilometres towards the poles, which the
+query box accounts for). Each cell holds three parallel arrays (IDs,
+latitudes, longitudes), about 24 bytes per restaurant.
+
+within() visits only the cells overlapping the query circle's bounding box
+(or, when that box spans more cells than are populated, the populated
+cells) and checks the exact great-circle distance. nearest() runs within()
+with a radius that doubles until it holds k restaurants; everything closer
+than the k-th is then inside the circle, so the answer is exact. The
+doubling stops once the circle covers every indexed point, so asking for
+more restaurants than there are costs a few passes over the cells. Queries
+that cross the antimeridian are not handled.
+
+Benchmark with synthetic points:
+
+    cd db_cloud_connection
+    python geo_index.py --points 1000000
+
+Settings:
+    GEO_CELL_KM              cell size in km (default 0.5)
+    GEO_REFRESH_SECONDS      rebuild interval in seconds (default 300, 0 = never)
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import threading
+import time
+from array import array
+
+CELL_KM = float(os.getenv('GEO_CELL_KM', '0.5'))
+REFRESH_SECONDS = float(os.getenv('GEO_REFRESH_SECONDS', '300'))
+
+KM_PER_DEGREE = 111.32
+EARTH_RADIUS_KM = 6371.0088
+
+# nearest() gives up beyond this radius
+MAX_RADIUS_KM = 20000.0
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Haversine distance."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+class GridIndex:
+    def __init__(self, cell_km=CELL_KM):
+        self.cell_km = cell_km
+        self.cell_degrees = cell_km / KM_PER_DEGREE
+        self.cells = {}         # (row, column) -> (IDs, latitudes, longitudes)
+        self.count = 0
+        # Box around every point ever indexed (removals do not shrink it)
+        self.south = self.west = math.inf
+        self.north = self.east = -math.inf
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, rows, cell_km=CELL_KM):
+        """rows are (ID, latitude, longitude)."""
+        index = cls(cell_km)
+        for item_id, lat, lon in rows:
+            if lat is not None and lon is not None:
+                index._insert(item_id, lat, lon)
+        for ids, lats, lons in index.cells.values():
+            index._extend_bounds(min(lats), min(lons))
+            index._extend_bounds(max(lats), max(lons))
+        return index
+
+    def _extend_bounds(self, lat, lon):
+        self.south, self.north = min(self.south, lat), max(self.north, lat)
+        self.west, self.east = min(self.west, lon), max(self.east, lon)
+
+    def _key(self, lat, lon):
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def _insert(self, item_id, lat, lon):
+        cell = self.cells.get(self._key(lat, lon))
+        if cell is None:
+            cell = self.cells[self._key(lat, lon)] = (array('q'), array('d'), array('d'))
+        ids, lats, lons = cell
+        ids.append(item_id)
+        lats.append(lat)
+        lons.append(lon)
+        self.count += 1
+
+    def add(self, item_id, lat, lon):
+        if lat is None or lon is None:
+            return
+        with self._lock:
+            self._insert(item_id, lat, lon)
+            self._extend_bounds(lat, lon)
+
+    def remove(self, item_id, lat, lon):
+        """Removes a point; lat/lon are where it was indexed."""
+        if lat is None or lon is None:
+            return
+        with self._lock:
+            key = self._key(lat, lon)
+            cell = self.cells.get(key)
+            if cell is None:
+                return
+            ids, lats, lons = cell
+            for position, candidate in enumerate(ids):
+                if candidate == item_id:
+                    del ids[position], lats[position], lons[position]
+                    self.count -= 1
+                    break
+            if not ids:
+                del self.cells[key]
+
+    def move(self, item_id, old, new):
+        self.remove(item_id, *old)
+        self.add(item_id, *new)
+
+    def within(self, lat, lon, radius_km, limit=None):
+        """[(distance km, ID)] inside radius_km, nearest first."""
+        radius_degrees = radius_km / KM_PER_DEGREE
+        # Degrees of longitude shrink with cos(latitude); widen the box at its
+        # poleward edge, and take the whole circle of longitude near a pole
+        edge = min(89.9, abs(lat) + radius_degrees)
+        lon_degrees = radius_degrees / math.cos(math.radians(edge))
+        row_low, col_low = self._key(lat - radius_degrees, lon - lon_degrees)
+        row_high, col_high = self._key(lat + radius_degrees, lon + lon_degrees)
+        if lon_degrees >= 180:
+            # Every longitude, wherever the box would have wrapped
+            lon_degrees = 360
+            col_low, col_high = self._key(0, -180)[1], self._key(0, 180)[1]
+
+        cells = self.cells
+        if (row_high - row_low + 1) * (col_high - col_low + 1) > len(cells):
+            # A wide box is mostly empty: filter the populated cells instead
+            candidates = [cell for (row, column), cell in list(cells.items())
+                          if row_low <= row <= row_high and col_low <= column <= col_high]
+        else:
+            candidates = [cells[key] for key in (
+                (row, column) for row in range(row_low, row_high + 1) for column in range(col_low, col_high + 1)
+            ) if key in cells]
+
+        found = []
+        phi = math.radians(lat)
+        cos_phi = math.cos(phi)
+        # Haversine with the constant terms hoisted; compared as the 'a' term
+        limit_a = math.sin(min(math.pi, radius_km / EARTH_RADIUS_KM) / 2) ** 2
+        sin, cos, radians = math.sin, math.cos, math.radians
+        for ids, lats, lons in candidates:
+            for item_id, other_lat, other_lon in zip(ids, lats, lons):
+                # Box test first: it rejects most points without trigonometry
+                if abs(other_lat - lat) > radius_degrees or abs(other_lon - lon) > lon_degrees:
+                    continue
+                other_phi = radians(other_lat)
+                a = (sin((other_phi - phi) / 2) ** 2
+                     + cos_phi * cos(other_phi) * sin(radians(other_lon - lon) / 2) ** 2)
+                if a <= limit_a:
+                    found.append((a, item_id))
+        found.sort()
+        if limit is not None:
+            found = found[:limit]
+        return [(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a))), item_id) for a, item_id in found]
+
+    def reach_km(self, lat, lon):
+        """A distance from (lat, lon) that no indexed point is beyond.
+
+        Along the meridian to the farthest latitude, then along that parallel
+        (never longer than the same degrees at the equator).
+        """
+        return KM_PER_DEGREE * (max(abs(lat - self.south), abs(lat - self.north))
+                                + max(abs(lon - self.west), abs(lon - self.east)))
+
+    def nearest(self, lat, lon, k, max_km=MAX_RADIUS_KM):
+        """The k nearest [(distance km, ID)] within max_km, nearest first."""
+        if k <= 0 or not self.count:
+            return []
+        # Past this radius the circle holds every point, so doubling further finds nothing new
+        max_km = min(max_km, self.reach_km(lat, lon))
+        # First guess: the radius holding k points at the density of the
+        # point's own cell
+        cell = self.cells.get(self._key(lat, lon))
+        if cell is None:
+            radius = self.cell_km
+        else:
+            radius = max(self.cell_km / 16, self.cell_km * math.sqrt(k / (math.pi * len(cell[0]))))
+        while True:
+            radius = min(radius, max_km)
+            found = self.within(lat, lon, radius, k)
+            if len(found) >= k or radius >= max_km:
+                return found
+            radius *= 2
+
+    def memory_bytes(self):
+        size = sys.getsizeof
+        total = size(self.cells)
+        for key, arrays in self.cells.items():
+            total += size(key) + size(arrays) + sum(size(a) for a in arrays)
+        return total
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the grid index on synthetic points.')
+    parser.add_argument('--points', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--radius-km', type=float, default=1.0)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--cell-km', type=float, default=CELL_KM)
+    parser.add_argument('--bbox', default='40.55,-74.10,40.90,-73.70', help='south,west,north,east')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    south, west, north, east = (float(v) for v in args.bbox.split(','))
+    rng = random.Random(args.seed)
+
+    def point():
+        return rng.uniform(south, north), rng.uniform(west, east)
+
+    rows = [(i, *point()) for i in range(1, args.points + 1)]
+    started = time.perf_counter()
+    index = GridIndex.build(rows, args.cell_km)
+    print(f"  built {index.count} points in {time.perf_counter() - started:.2f}s, "
+          f"{len(index.cells)} cells, {index.memory_bytes() / 1e6:.1f} MB")
+
+    origins = [point() for _ in range(args.queries)]
+    for name, query in (
+        (f'within {args.radius_km:g} km', lambda lat, lon: index.within(lat, lon, args.radius_km)),
+        (f'within {args.radius_km:g} km top {args.k}', lambda lat, lon: index.within(lat, lon, args.radius_km, args.k)),
+        (f'nearest {args.k}', lambda lat, lon: index.nearest(lat, lon, args.k)),
+    ):
+        timings, results = [], 0
+        for lat, lon in origins:
+            started = time.perf_counter()
+            results += len(query(lat, lon))
+            timings.append(time.perf_counter() - started)
+        print(f"  {name:<24} p50 {_percentile(timings, 50) * 1000:7.3f} ms  "
+              f"p99 {_percentile(timings, 99) * 1000:7.3f} ms  {results / len(origins):8.1f} results/query")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Address geocoding for Restaurant and Customer_Address (Latitude/Longitude).
+
+geocoder_from_env() returns the backend named by GEOCODER:
+
+    offline    deterministic stand-in without network access (default)
+    nominatim  OpenStreetMap Nominatim over HTTP
+    pkg.module:Class  any class whose geocode(address) returns (lat, lon) or None
+
+The offline backend is for development and benchmarks, not real positions:
+it hashes each street name to a straight line across GEOCODER_BBOX and puts
+house numbers in order along it, so an address always lands on the same
+point and neighbouring numbers are neighbours on the map.
+
+Rows written before geocoding existed (or while the geocoder was failing)
+have NULL coordinates; fill them with
+
+    cd db_cloud_connection
+    python geocoder.py
+
+Settings:
+    GEOCODER          offline (default), nominatim or module:Class
+    GEOCODER_BBOX     offline area as south,west,north,east (default New York City)
+    GEOCODER_URL      Nominatim search URL (default the public instance)
+    GEOCODER_TIMEOUT  HTTP timeout in seconds (default 2)
+"""
+import argparse
+import hashlib
+import importlib
+import math
+import os
+import re
+import sys
+import time
+
+from app_logging import get_logger
+
+GEOCODER = os.getenv('GEOCODER', 'offline')
+BBOX = tuple(float(v) for v in os.getenv('GEOCODER_BBOX', '40.55,-74.10,40.90,-73.70').split(','))
+URL = os.getenv('GEOCODER_URL', 'https://nominatim.openstreetmap.org/search')
+TIMEOUT = float(os.getenv('GEOCODER_TIMEOUT', '2'))
+
+KM_PER_DEGREE = 111.32
+# Offline streets are this long, numbered 1 to OFFLINE_MAX_NUMBER
+OFFLINE_STREET_KM = 20.0
+OFFLINE_MAX_NUMBER = 10000
+OFFLINE_JITTER_KM = 0.02
+
+# "1234 Main St Apt 2" -> number, street
+_STREET = re.compile(r'^\s*(\d+)\s+(.+?)(?:\s+(?:apt|unit|suite|ste|#)\b.*)?\s*$', re.IGNORECASE)
+
+log = get_logger('app')
+
+
+def _unit(*parts):
+    """Two floats in [0, 1) derived from the hash of parts."""
+    digest = hashlib.sha256('|'.join(parts).lower().encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64, int.from_bytes(digest[8:16], 'big') / 2 ** 64
+
+
+class OfflineGeocoder:
+    def __init__(self, bbox=BBOX, street_km=OFFLINE_STREET_KM):
+        self.south, self.west, self.north, self.east = bbox
+        self.street_km = street_km
+
+    def geocode(self, address):
+        if not address or not address.strip():
+            return None
+        address = ' '.join(address.split())
+        match = _STREET.match(address)
+        if match:
+            street, position = match.group(2), min(int(match.group(1)), OFFLINE_MAX_NUMBER) / OFFLINE_MAX_NUMBER
+        else:
+            street, position = address, _unit('number', address)[0]
+        # The street is a straight line through a point of the box; house
+        # numbers run along it, units scatter a few metres around the house
+        u, v = _unit('street', street)
+        lat = self.south + u * (self.north - self.south)
+        lon = self.west + v * (self.east - self.west)
+        bearing = math.pi * _unit('bearing', street)[0]
+        along = (position - 0.5) * self.street_km
+        u, v = _unit('address', address)
+        north_km = along * math.cos(bearing) + OFFLINE_JITTER_KM * (2 * u - 1)
+        east_km = along * math.sin(bearing) + OFFLINE_JITTER_KM * (2 * v - 1)
+        lat += north_km / KM_PER_DEGREE
+        lon += east_km / (KM_PER_DEGREE * math.cos(math.radians(lat)))
+        return (min(max(lat, self.south), self.north), min(max(lon, self.west), self.east))
+
+
+class NominatimGeocoder:
+    def __init__(self, url=URL, timeout=TIMEOUT):
+        import requests
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'axolotl-db-geocoder'
+        self.url = url
+        self.timeout = timeout
+
+    def geocode(self, address):
+        if not address or not address.strip():
+            return None
+        response = self.session.get(self.url, params={'q': address, 'format': 'json', 'limit': 1},
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        results = response.json()
+        if not results:
+            return None
+        return float(results[0]['lat']), float(results[0]['lon'])
+
+
+def geocoder_from_env(name=GEOCODER):
+    if name == 'offline':
+        return OfflineGeocoder()
+    if name == 'nominatim':
+        return NominatimGeocoder()
+    if ':' in name:
+        module, cls = name.split(':', 1)
+        return getattr(importlib.import_module(module), cls)()
+    raise ValueError(f"Unknown GEOCODER '{name}' (expected 'offline', 'nominatim' or module:Class)")
+
+
+def safe_geocode(geocoder, address):
+    """(lat, lon), or (None, None) when the address cannot be placed right now."""
+    try:
+        point = geocoder.geocode(address)
+    except Exception as e:
+        log.warning("Geocoding failed for %r: %s", address, e)
+        return None, None
+    return point if point else (None, None)
+
+
+def backfill(engine, geocoder, table, key_columns, batch_rows=500, pause=0.0):
+    """Geocodes every row of table with a NULL Latitude; returns (filled, unplaceable)."""
+    from sqlalchemy import select, update
+
+    filled = failed = 0
+    skip = set()
+    while True:
+        with engine.begin() as connection:
+            keys = [table.c[name] for name in key_columns]
+            rows = connection.execute(
+                select(*keys, table.c.Address).where(table.c.Latitude.is_(None)).limit(batch_rows + len(skip))
+            ).all()
+            rows = [row for row in rows if tuple(row[:-1]) not in skip][:batch_rows]
+            if not rows:
+                return filled, failed
+            for *key, address in rows:
+                lat, lon = safe_geocode(geocoder, address)
+                if lat is None:
+                    skip.add(tuple(key))
+                    failed += 1
+                    continue
+                where = [column == value for column, value in zip(keys, key)]
+                connection.execute(update(table).where(*where).values(Latitude=lat, Longitude=lon))
+                filled += 1
+                if pause:
+                    time.sleep(pause)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fill Latitude/Longitude for addresses that have none.')
+    parser.add_argument('--batch-rows', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.0, help='seconds between lookups (1 for Nominatim)')
+    args = parser.parse_args(argv)
+
+    # Imported here: api imports this module for the request-time geocoder
+    from api import Customer_Address, Restaurant, backend, db, engines
+
+    engine = engines.get('admin')
+    backend.prepare_schema(db.metadata, engine)
+    geocoder = geocoder_from_env()
+    for model, keys in ((Restaurant, ['RestaurantID']), (Customer_Address, ['CustomerID', 'Address'])):
+        started = time.perf_counter()
+        filled, failed = backfill(engine, geocoder, model.__table__, keys, args.batch_rows, args.pause)
+        print(f"  {model.__tablename__:<18} {filled:>10} geocoded {failed:>8} unplaceable  "
+              f"{time.perf_counter() - started:7.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
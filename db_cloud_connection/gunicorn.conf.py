@@ -0,0 +1,86 @@
+"""
+gunicorn settings for api.py: pre-fork workers with a preloaded app.
+
+    cd db_cloud_connection
+    gunicorn -c gunicorn.conf.py api:app
+
+The app is imported once in the master and workers are forked from it, so
+code and read-only data are shared copy-on-write. Everything that must not
+be shared (pooled connections, sessions, background threads) is reset in the
+child by the os.register_at_fork hooks in api.py, app_logging.py, metrics.py
+and request_profiler.py (see fork_hooks.py).
+
+A user's next request usually reaches another worker, so read-your-writes
+pins are shared through files (DB_REPLICA_PIN_STORE=file, see session_router.py).
+
+Pools are sized per worker: with DB_MAX_CONNECTIONS set, db_engines scales
+every role's pool so all workers together stay under that many connections.
+
+Workers are recycled after GUNICORN_MAX_REQUESTS (+ jitter) requests. A
+recycled or SIGTERM'd worker stops accepting, gets GUNICORN_GRACEFUL_TIMEOUT
+seconds to finish in-flight requests and then closes its pools.
+
+Settings:
+    WEB_CONCURRENCY              worker processes (default 2 * CPUs + 1)
+    GUNICORN_WORKER_CLASS        gthread (default) or gevent
+    GUNICORN_THREADS             threads per gthread worker (default 4)
+    GUNICORN_WORKER_CONNECTIONS  connections per gevent worker (default 1000)
+    GUNICORN_BIND                default 0.0.0.0:5000
+    GUNICORN_MAX_REQUESTS        default 5000, 0 disables recycling
+    GUNICORN_MAX_REQUESTS_JITTER default 500
+    GUNICORN_GRACEFUL_TIMEOUT    seconds, default 30
+    DB_MAX_CONNECTIONS           connection budget shared by all workers
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+preload_app = True
+
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '5000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '500'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+timeout = 60
+keepalive = 5
+
+# Read by db_engines (pool sizing) and api (warmup only in workers) during preload
+os.environ['DB_WORKER_COUNT'] = str(workers)
+os.environ['APP_PREFORK'] = 'true'
+
+if worker_class == 'gevent':
+    # The preloaded app imports socket/pymysql in the master, so patch before that
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def when_ready(server):
+    # Close whatever the master opened while importing (schema checks on SQLite,
+    # admin lookups); workers open their own connections
+    import api
+    # Every LazyIndex (search, autocomplete, facets, geo, front page; see lazy_index.py)
+    # is built once here and shared copy-on-write by every worker
+    api.init_indexes()
+    api.engines.dispose_all()
+    api.router.dispose_replicas()
+    server.log.info("api preloaded; forking %d %s workers", workers, worker_class)
+
+
+def post_fork(server, worker):
+    # api.py skips DB_POOL_WARMUP in the master; each worker warms its own pools
+    import api
+    if api.POOL_WARMUP:
+        api.start_pool_warmup()
+
+
+def worker_exit(server, worker):
+    # Runs after the worker has drained; hand its connections back to Cloud SQL now
+    # instead of waiting for the server-side idle timeout. Queued messages are written first.
+    import api
+    api.stop_message_writer()
+    api.engines.dispose_all()
+    api.router.dispose_replicas()
@@ -0,0 +1,275 @@
+"""
+Idempotency-Key support for POST /api/orders and POST /api/messages.
+
+A client that retries a request with the same Idempotency-Key header gets
+the first response back instead of creating a second order or message.
+Keys are scoped to the authenticated user and kept IDEMPOTENCY_TTL_SECONDS.
+
+    first request     runs; its response is stored unless it is a 5xx
+    retry             gets the stored response with Idempotent-Replayed: true,
+                      without running the handler or writing anything
+    concurrent retry  waits up to IDEMPOTENCY_WAIT_SECONDS for the first
+                      request, then replays it (409 if it is still running)
+    different body    reusing a key for another method, path or body is 422
+
+5xx responses and exceptions are not stored: the key is released and a
+retry runs the request again.
+
+The handler's response is returned even if the shared store cannot record
+it. The failure is logged, and only this process replays the key. Elsewhere
+it stays in flight (409) until its lease runs out, and then a retry may run
+again.
+
+Keys live in memory per process (MemoryStore, at most IDEMPOTENCY_MAX_KEYS).
+With several workers or hosts set IDEMPOTENCY_STORE=database to share them
+through the Idempotency_Key table (migrations/011_idempotency_keys.sql).
+The memory store stays in front of it, so retries reaching the same process
+never query the database. A shared key whose request has not finished
+within IDEMPOTENCY_LEASE_SECONDS (a crashed worker) may be taken over.
+scheduler.py purges expired rows.
+
+Settings:
+    IDEMPOTENCY_STORE          memory (default) or database
+    IDEMPOTENCY_TTL_SECONDS    how long responses are kept (default 86400)
+    IDEMPOTENCY_WAIT_SECONDS   how long a duplicate waits for the first request (default 10)
+    IDEMPOTENCY_LEASE_SECONDS  how long a shared key may stay in flight (default 60)
+    IDEMPOTENCY_MAX_KEYS       memory store size per process (default 100000)
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app_logging import get_logger
+
+log = get_logger('db')
+
+STORE = os.getenv('IDEMPOTENCY_STORE', 'memory')
+TTL_SECONDS = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '10'))
+LEASE_SECONDS = float(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '60'))
+MAX_KEYS = int(os.getenv('IDEMPOTENCY_MAX_KEYS', '100000'))
+
+MAX_KEY_LENGTH = 255
+
+# How often a duplicate re-reads a shared key that another process is running
+POLL_SECONDS = 0.05
+
+
+class KeyConflict(Exception):
+    """The key was first used for a different request."""
+
+
+class KeyInFlight(Exception):
+    """The first request with the key is still running."""
+
+
+def scope_key(user_type, user_id, key):
+    """Fixed-length storage key for a user's Idempotency-Key."""
+    return hashlib.sha256(f'{user_type}:{user_id}:{key}'.encode('utf-8')).hexdigest()
+
+
+def fingerprint(method, path, body):
+    digest = hashlib.sha256(f'{method} {path}\n'.encode('utf-8'))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class _Entry:
+    def __init__(self, fingerprint, expires):
+        self.fingerprint = fingerprint
+        self.expires = expires
+        self.response = None        # (status, body bytes, content type) once stored
+        self.done = threading.Event()
+
+
+class MemoryStore:
+    """Per-process keys; duplicates wait on the first request's Event.
+
+    Requests in flight are kept apart from stored responses, so only the
+    latter are expired or evicted (oldest first).
+    """
+
+    def __init__(self, ttl=TTL_SECONDS, max_keys=MAX_KEYS, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.clock = clock
+        self.running = {}
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry.expires > now and len(self.entries) <= self.max_keys:
+                break
+            del self.entries[key]
+
+    def claim(self, key, fingerprint, wait=WAIT_SECONDS):
+        """None if the caller now runs the request, else the stored response."""
+        deadline = self.clock() + wait
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._expire(now)
+                entry = self.running.get(key) or self.entries.get(key)
+                if entry is None:
+                    self.running[key] = _Entry(fingerprint, now + self.ttl)
+                    return None
+            if entry.fingerprint != fingerprint:
+                raise KeyConflict(key)
+            if entry.response is not None:
+                return entry.response
+            if not entry.done.wait(max(0.0, deadline - self.clock())):
+                raise KeyInFlight(key)
+            # Finished: replay it on the next pass, or claim it anew if it was released
+
+    def _keep(self, key, entry, response):
+        entry.response = response
+        entry.expires = self.clock() + self.ttl
+        self.entries.pop(key, None)
+        self.entries[key] = entry       # now the newest
+
+    def complete(self, key, response):
+        with self._lock:
+            entry = self.running.pop(key)
+            self._keep(key, entry, response)
+        entry.done.set()
+
+    def store(self, key, fingerprint, response):
+        """Remembers a response the shared store had, ending the local claim."""
+        with self._lock:
+            entry = self.running.pop(key, None) or _Entry(fingerprint, 0)
+            self._keep(key, entry, response)
+        entry.done.set()
+
+    def release(self, key):
+        with self._lock:
+            entry = self.running.pop(key, None)
+        if entry is not None:
+            entry.done.set()
+
+
+class DatabaseStore:
+    """Keys shared through one table: KeyHash, Fingerprint, Status, ContentType, Body, ExpiresAt.
+
+    A row with a NULL Status is in flight and expires after the lease; a
+    stored response expires after the TTL.
+    """
+
+    def __init__(self, table, ttl=TTL_SECONDS, lease=LEASE_SECONDS, poll=POLL_SECONDS):
+        self.table = table
+        self.ttl = ttl
+        self.lease = lease
+        self.poll = poll
+
+    def claim(self, engine, key, fingerprint, wait=WAIT_SECONDS):
+        table = self.table
+        deadline = time.monotonic() + wait
+        while True:
+            now = _utcnow()
+            # Read first, so a replay is a single SELECT
+            with engine.connect() as connection:
+                row = connection.execute(
+                    select(table.c.Fingerprint, table.c.Status, table.c.ContentType, table.c.Body, table.c.ExpiresAt)
+                    .where(table.c.KeyHash == key)
+                ).first()
+            if row is not None and row.ExpiresAt <= now:
+                with engine.begin() as connection:
+                    connection.execute(delete(table).where(table.c.KeyHash == key, table.c.ExpiresAt <= now))
+                row = None
+            if row is None:
+                try:
+                    with engine.begin() as connection:
+                        connection.execute(insert(table).values(
+                            KeyHash=key, Fingerprint=fingerprint, ExpiresAt=now + timedelta(seconds=self.lease)))
+                    return None
+                except IntegrityError:
+                    continue    # another process claimed it first
+            if row.Fingerprint != fingerprint:
+                raise KeyConflict(key)
+            if row.Status is not None:
+                return row.Status, row.Body.encode('utf-8'), row.ContentType
+            if time.monotonic() >= deadline:
+                raise KeyInFlight(key)
+            time.sleep(self.poll)
+
+    def complete(self, engine, key, response):
+        status, body, content_type = response
+        with engine.begin() as connection:
+            connection.execute(update(self.table).where(self.table.c.KeyHash == key).values(
+                Status=status, ContentType=content_type, Body=body.decode('utf-8'),
+                ExpiresAt=_utcnow() + timedelta(seconds=self.ttl)))
+
+    def release(self, engine, key):
+        with engine.begin() as connection:
+            connection.execute(delete(self.table).where(self.table.c.KeyHash == key, self.table.c.Status.is_(None)))
+
+    def purge(self, engine):
+        """Deletes expired rows; returns how many."""
+        with engine.begin() as connection:
+            return connection.execute(delete(self.table).where(self.table.c.ExpiresAt <= _utcnow())).rowcount
+
+
+class Idempotency:
+    """The memory store, optionally in front of a shared DatabaseStore.
+
+    engine_getter returns the engine for the shared store during a request.
+    """
+
+    def __init__(self, local, shared=None, engine_getter=None):
+        self.local = local
+        self.shared = shared
+        self.engine_getter = engine_getter
+
+    def begin(self, key, fingerprint):
+        """None if the caller runs the request (then call finish), else the stored response."""
+        stored = self.local.claim(key, fingerprint)
+        if stored is not None or self.shared is None:
+            return stored
+        try:
+            stored = self.shared.claim(self.engine_getter(), key, fingerprint)
+        except BaseException:
+            self.local.release(key)
+            raise
+        if stored is not None:
+            self.local.store(key, fingerprint, stored)
+        return stored
+
+    def finish(self, key, response):
+        """Stores (status, body, content type), or releases the key when response is None or a 5xx.
+
+        Never raises: the request has already run, so a shared store error is
+        logged and the local store still completes or releases the key.
+        """
+        release = response is None or response[0] >= 500
+        if self.shared is not None:
+            try:
+                if release:
+                    self.shared.release(self.engine_getter(), key)
+                else:
+                    self.shared.complete(self.engine_getter(), key, response)
+            except Exception as e:
+                log.error("Could not %s shared Idempotency-Key %s: %s",
+                          'release' if release else 'store the response for', key[:12], e)
+        if release:
+            self.local.release(key)
+        else:
+            self.local.complete(key, response)
+
+
+def idempotency_from_env(table, engine_getter, name=STORE):
+    if name == 'memory':
+        return Idempotency(MemoryStore())
+    if name == 'database':
+        return Idempotency(MemoryStore(), DatabaseStore(table), engine_getter)
+    raise ValueError(f"Unknown IDEMPOTENCY_STORE '{name}' (expected 'memory' or 'database')")
@@ -0,0 +1,387 @@
+"""
+Index advisor: EXPLAINs every statement the benchmark suite makes api.py run.
+
+    cd db_cloud_connection
+    DB_BACKEND=sqlite python index_advisor.py --duration 20
+    DB_BACKEND=sqlite python index_advisor.py --duration 20 --apply
+
+1. Runs benchmark.py in-process and records each distinct statement with the
+   endpoints that issued it and one set of parameters.
+2. EXPLAINs each SELECT/UPDATE/DELETE on the admin engine and flags full table
+   scans and sorts that cannot use an index (SQLite "SCAN t" / "USE TEMP
+   B-TREE", MySQL type=ALL / "Using filesort").
+3. For each flagged table it proposes one composite index from the statement
+   itself: equality and join columns, then one range column, then the ORDER
+   BY columns. Candidates already covered by the leading columns of an
+   existing index or the primary key are dropped, as are tables smaller than
+   --min-rows.
+4. Writes the proposals as the next migrations/NNN_advisor_indexes.sql.
+5. With --apply it creates the indexes on the benchmarked database, runs the
+   benchmark again and prints before/after latency per benchmark endpoint.
+
+--apply is meant for a local or staging database; production gets the
+migration file after review.
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import threading
+from collections import Counter
+
+from flask import has_request_context, request
+from sqlalchemy import Engine, Index, Table, event, func, inspect, select
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.dml import Delete, Update
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList, ColumnClause
+from sqlalchemy.sql.selectable import Join, Select
+
+import api
+import benchmark
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+EQUALITY = {operators.eq, operators.in_op, operators.is_}
+RANGE = {operators.lt, operators.le, operators.gt, operators.ge, operators.between_op}
+
+
+class CapturedStatement:
+    def __init__(self, statement, parameters, core):
+        self.statement = statement
+        self.parameters = parameters
+        self.core = core
+        self.endpoints = Counter()
+        self.plan = None
+        self.problems = []
+
+
+class StatementCapture:
+    """Records the distinct statements executed inside Flask requests."""
+
+    def __init__(self):
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if executemany or not has_request_context():
+            return
+        compiled = getattr(context, 'compiled', None)
+        compile_state = getattr(compiled, 'compile_state', None)
+        # The ORM's compile state holds the final core statement, joins included
+        core = getattr(compile_state, 'statement', None)
+        if core is None:
+            core = getattr(compiled, 'statement', None)
+        if not isinstance(core, (Select, Update, Delete)):
+            return
+        endpoint = f'{request.method} {request.url_rule.rule if request.url_rule else request.path}'
+        with self._lock:
+            captured = self.statements.get(statement)
+            if captured is None:
+                captured = self.statements[statement] = CapturedStatement(statement, parameters, core)
+            captured.endpoints[endpoint] += 1
+
+
+# ---- EXPLAIN ----
+
+def explain_rows(engine, statement, parameters):
+    """EXPLAIN output as a list of dicts (column name -> value)."""
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.exec_driver_sql(prefix + statement, parameters).mappings()]
+
+
+def plan_problems(dialect, plan):
+    """[(table or alias name, 'full scan' | 'filesort', plan detail)] found in a plan."""
+    problems = []
+    for row in plan:
+        if dialect == 'sqlite':
+            detail = row['detail']
+            match = re.match(r'SCAN (?:TABLE )?(\S+)', detail)
+            if match and 'USING' not in detail:
+                problems.append((match.group(1), 'full scan', detail))
+            if 'USE TEMP B-TREE FOR ORDER BY' in detail:
+                problems.append((None, 'filesort', detail))
+        else:
+            extra = row.get('Extra') or ''
+            if row.get('type') == 'ALL':
+                problems.append((row.get('table'), 'full scan', f"type=ALL rows={row.get('rows')}"))
+            if 'Using filesort' in extra:
+                problems.append((row.get('table'), 'filesort', extra))
+    return problems
+
+
+# ---- index proposals ----
+
+def base_table(from_clause):
+    """The Table behind an alias (or the table itself)."""
+    while not isinstance(from_clause, Table) and getattr(from_clause, 'element', None) is not None:
+        from_clause = from_clause.element
+    return from_clause if isinstance(from_clause, Table) else None
+
+
+def table_column(element):
+    if isinstance(element, ColumnClause) and element.table is not None:
+        return element
+    return None
+
+
+def conjuncts(clause):
+    if clause is None:
+        return []
+    if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+        return [part for c in clause.clauses for part in conjuncts(c)]
+    return [clause]
+
+
+def comparisons(clause):
+    """(column, kind) pairs for the column comparisons in a clause.
+
+    kind is 'eq' (compared with a value), 'join' (equal to another table's
+    column) or 'range'.
+    """
+    found = []
+    for element in visitors.iterate(clause):
+        if not isinstance(element, BinaryExpression):
+            continue
+        if element.operator in RANGE:
+            kind = 'range'
+        elif element.operator in EQUALITY:
+            kind = 'eq'
+        else:
+            continue
+        for side, other in ((element.left, element.right), (element.right, element.left)):
+            column = table_column(side)
+            if column is None:
+                continue
+            if kind == 'eq' and table_column(other) is not None:
+                found.append((column, 'join'))
+            elif kind == 'range' or isinstance(other, BindParameter):
+                found.append((column, kind))
+    return found
+
+
+def statement_conditions(core):
+    """Conjuncts of the WHERE clause and of every JOIN ... ON."""
+    clauses = conjuncts(core.whereclause)
+    for element in visitors.iterate(core):
+        if isinstance(element, Join):
+            clauses.extend(conjuncts(element.onclause))
+    return clauses
+
+
+def order_columns(core):
+    columns = []
+    for clause in getattr(core, '_order_by_clauses', ()):
+        columns.extend(c for c in visitors.iterate(clause) if table_column(c) is not None)
+    return columns
+
+
+def aliases(core):
+    """Lower-cased table/alias name -> (from clause, base Table) for everything the statement touches."""
+    found = {}
+    for element in visitors.iterate(core):
+        column = table_column(element)
+        if column is not None:
+            table = base_table(column.table)
+            if table is not None:
+                found[column.table.name.lower()] = (column.table, table)
+    return found
+
+
+def propose(core, from_clause):
+    """Candidate column lists for one table (alias) of a flagged statement."""
+    def mine(column):
+        return column.table is from_clause or column.table.name == from_clause.name
+
+    columns_by_kind = {'eq': [], 'join': [], 'range': []}
+    branches = []
+    for clause in statement_conditions(core):
+        if isinstance(clause, BooleanClauseList) and clause.operator is operators.or_:
+            # "a = ? OR b = ?" is served by one index per branch, not by (a, b)
+            per_branch = [[c.name for c, kind in comparisons(branch) if kind == 'eq' and mine(c)]
+                          for branch in clause.clauses]
+            if all(per_branch):
+                branches = per_branch
+            continue
+        for column, kind in comparisons(clause):
+            if mine(column):
+                columns_by_kind[kind].append(column.name)
+    ordering = [c.name for c in order_columns(core) if mine(c)]
+    # Join columns only matter when nothing narrows the table down directly
+    equality = columns_by_kind['eq'] or ([] if branches else columns_by_kind['join'])
+
+    candidates = []
+    for branch in branches or [[]]:
+        columns = []
+        for name in equality + branch + columns_by_kind['range'][:1] + ordering:
+            if name not in columns:
+                columns.append(name)
+        if columns:
+            candidates.append(columns)
+    return candidates
+
+
+def existing_indexes(engine, table_name):
+    """Column lists of the primary key and every index on a table in the live database."""
+    inspector = inspect(engine)
+    indexes = [index['column_names'] for index in inspector.get_indexes(table_name)]
+    primary = inspector.get_pk_constraint(table_name).get('constrained_columns')
+    if primary:
+        indexes.append(primary)
+    return indexes
+
+
+def covered(columns, indexes):
+    return any(index[:len(columns)] == columns for index in indexes)
+
+
+def index_name(table, columns):
+    return f"idx_{table.lower()}_{'_'.join(c.lower() for c in columns)}"[:64]
+
+
+def analyze(engine, captured, min_rows):
+    """EXPLAINs captured statements; returns {(table, columns): set of endpoints}."""
+    dialect = engine.dialect.name
+    row_counts = {}
+    proposals = {}
+    for stmt in captured.values():
+        try:
+            stmt.plan = explain_rows(engine, stmt.statement, stmt.parameters)
+        except Exception as e:
+            stmt.problems.append((None, 'explain failed', str(e)))
+            continue
+        names = aliases(stmt.core)
+        ordered = {c.table.name.lower() for c in order_columns(stmt.core)}
+        for alias, problem, detail in plan_problems(dialect, stmt.plan):
+            # SQLite does not say which table a sort belongs to; blame the ORDER BY tables
+            targets = [alias.lower()] if alias else sorted(ordered)
+            for target in targets:
+                if target not in names:
+                    continue
+                from_clause, table = names[target]
+                stmt.problems.append((table.name, problem, detail))
+                if table.name not in row_counts:
+                    with engine.connect() as conn:
+                        row_counts[table.name] = conn.execute(select(func.count()).select_from(table)).scalar()
+                if row_counts[table.name] < min_rows:
+                    continue
+                present = existing_indexes(engine, table.name)
+                for columns in propose(stmt.core, from_clause):
+                    if not covered(columns, present):
+                        proposals.setdefault((table.name, tuple(columns)), set()).update(stmt.endpoints)
+    return consolidate(proposals), row_counts
+
+
+def consolidate(proposals):
+    """Folds proposals that are a leading part of a longer one on the same table into it."""
+    merged = {}
+    for (table, columns), endpoints in sorted(proposals.items(), key=lambda p: -len(p[0][1])):
+        wider = next((key for key in merged if key[0] == table and key[1][:len(columns)] == columns), None)
+        merged.setdefault(wider or (table, columns), set()).update(endpoints)
+    return merged
+
+
+# ---- output ----
+
+def print_findings(captured, row_counts, out=sys.stdout):
+    flagged = [s for s in captured.values() if s.problems]
+    print(f"{len(captured)} distinct statements, {len(flagged)} with full scans or filesorts\n", file=out)
+    for stmt in sorted(flagged, key=lambda s: -sum(s.endpoints.values())):
+        endpoints = ', '.join(f'{e} x{n}' for e, n in stmt.endpoints.most_common(3))
+        print(f"[{endpoints}]", file=out)
+        print(f"  {' '.join(stmt.statement.split())[:160]}", file=out)
+        for table, problem, detail in sorted(set(stmt.problems), key=str):
+            rows = f" ({row_counts[table]} rows)" if table in row_counts else ''
+            print(f"  - {problem} on {table}{rows}: {detail}", file=out)
+        print(file=out)
+
+
+def next_migration_path(directory=MIGRATIONS_DIR):
+    numbers = [int(os.path.basename(p)[:3]) for p in glob.glob(os.path.join(directory, '[0-9][0-9][0-9]_*.sql'))]
+    return os.path.join(directory, f'{max(numbers, default=0) + 1:03d}_advisor_indexes.sql')
+
+
+def write_migration(path, proposals, dialect):
+    lines = [
+        '-- Indexes proposed by index_advisor.py from EXPLAIN plans of the benchmark suite',
+        f'-- on the {dialect} backend. Review before applying; each comment lists the',
+        '-- endpoints the index serves.',
+        '--',
+        '-- Apply with:',
+        f'--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/{os.path.basename(path)}',
+    ]
+    for (table, columns), endpoints in sorted(proposals.items()):
+        lines += ['', '', '', f"-- {', '.join(sorted(endpoints))}", '',
+                  f"CREATE INDEX {index_name(table, columns)} ON {table} ({', '.join(columns)});"]
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def apply_indexes(engine, proposals):
+    tables = api.db.metadata.tables
+    for table, columns in proposals:
+        Index(index_name(table, columns), *(tables[table].c[c] for c in columns)).create(engine, checkfirst=True)
+
+
+def print_gain(before, after, out=sys.stdout):
+    """Benchmark endpoints, most improved p95 first."""
+    print(f"{'endpoint':<28}{'p50 before':>12}{'p50 after':>11}{'p95 before':>12}{'p95 after':>11}", file=out)
+    common = [e for e in before['endpoints'] if e in after['endpoints']]
+    gain = {e: after['endpoints'][e]['p95_ms'] / (before['endpoints'][e]['p95_ms'] or 1) for e in common}
+    for endpoint in sorted(common, key=gain.get):
+        b, a = before['endpoints'][endpoint], after['endpoints'][endpoint]
+        print(f"{endpoint:<28}{b['p50_ms']:>12.2f}{a['p50_ms']:>11.2f}{b['p95_ms']:>12.2f}{a['p95_ms']:>11.2f}",
+                  file=out)
+    print(f"\nthroughput {before['throughput_rps']:.1f} -> {after['throughput_rps']:.1f} req/s, "
+          f"p95 {before['p95_ms']:.2f} -> {after['p95_ms']:.2f} ms", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='EXPLAIN the SQL behind every endpoint and propose indexes.')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of benchmark traffic per run')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--mix', default='guest=60,customer=30,restaurant=10')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--min-rows', type=int, default=1000, help='do not index tables smaller than this')
+    parser.add_argument('--migration', help='output path (default: next migrations/NNN_advisor_indexes.sql)')
+    parser.add_argument('--apply', action='store_true', help='create the indexes here and re-run the benchmark')
+    args = parser.parse_args(argv)
+
+    bench_args = benchmark.build_parser().parse_args([
+        '--duration', str(args.duration), '--concurrency', str(args.concurrency),
+        '--mix', args.mix, '--seed', str(args.seed), '--quiet',
+    ])
+    with StatementCapture() as capture:
+        before = benchmark.run(bench_args)
+
+    engine = api.engines.get('admin')
+    proposals, row_counts = analyze(engine, capture.statements, args.min_rows)
+    print_findings(capture.statements, row_counts)
+    if not proposals:
+        print('No missing indexes found.')
+        return 0
+
+    path = args.migration or next_migration_path()
+    write_migration(path, proposals, engine.dialect.name)
+    print(f"Proposed {len(proposals)} indexes, written to {path}:")
+    for (table, columns), endpoints in sorted(proposals.items()):
+        print(f"  {table} ({', '.join(columns)})  <- {len(endpoints)} endpoints")
+
+    if args.apply:
+        apply_indexes(engine, proposals)
+        print('\nIndexes created; re-running the benchmark...\n')
+        after = benchmark.run(bench_args)
+        print_gain(before, after)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
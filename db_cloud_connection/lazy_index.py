@@ -0,0 +1,92 @@
+"""
+In-memory structures that api.py builds from the database and serves from:
+the search index, autocomplete, facets, the geo grid and the front page.
+
+Each is a LazyIndex, built on first use or up front by init_all(). serve.py
+and the gunicorn master call init_all() so forked workers inherit every
+index copy-on-write. Writes apply their committed changes with update(). With
+a refresh interval, every worker rebuilds its copy from a daemon thread to
+pick up changes made by the others.
+"""
+import logging
+import threading
+import time
+
+from app_logging import get_logger
+from fork_hooks import restart_in_child
+
+log = get_logger('app')
+
+# Every LazyIndex, in creation order, for init_all()
+INDEXES = []
+
+
+class LazyIndex:
+    """A value built by load(), kept until the next rebuild.
+
+    describe(value) adds a short summary to the build log line.
+    """
+
+    def __init__(self, name, load, refresh_seconds=0.0, describe=None):
+        self.name = name
+        self.load = load
+        self.refresh_seconds = refresh_seconds
+        self.describe = describe
+        self.value = None
+        self._lock = threading.Lock()
+        INDEXES.append(self)
+
+    def get(self):
+        value = self.value
+        return value if value is not None else self.init()
+
+    def init(self):
+        """Builds the value unless it exists, and starts the refresher."""
+        with self._lock:
+            if self.value is None:
+                self.rebuild()
+                if self.refresh_seconds > 0:
+                    start_refresher(self.rebuild, self.refresh_seconds, self.name)
+        return self.value
+
+    def rebuild(self):
+        started = time.perf_counter()
+        first = self.value is None
+        value = self.load()
+        self.value = value
+        # Periodic refreshes only at debug level
+        log.log(logging.INFO if first else logging.DEBUG, "%s built in %.2fs%s", self.name,
+                time.perf_counter() - started, f": {self.describe(value)}" if self.describe else '')
+        return value
+
+    def update(self, apply):
+        """Calls apply(value) for a committed change, if the value has been built."""
+        value = self.value
+        if value is None:
+            return
+        try:
+            apply(value)
+        except Exception as e:
+            log.error("Error updating %s: %s", self.name, e)
+
+
+def init_all():
+    for index in INDEXES:
+        index.init()
+
+
+def start_refresher(rebuild, seconds, name):
+    """Calls rebuild() every `seconds` from a daemon thread in each worker."""
+    def run():
+        while True:
+            time.sleep(seconds)
+            try:
+                rebuild()
+            except Exception as e:
+                log.error("Error rebuilding %s: %s", name, e)
+
+    def start():
+        threading.Thread(target=run, name=f"{name.replace(' ', '-')}-refresh", daemon=True).start()
+
+    start()
+    restart_in_child(start)
@@ -0,0 +1,111 @@
+"""
+Bulk menu import (PUT /api/restaurants/<id>/menu): parsing and diffing.
+
+The request carries a restaurant's whole menu, as JSON
+
+    {"items": [{"FoodID": 12, "FoodName": "Pad Thai", "Price": 11.5}, ...]}
+
+or as CSV with a FoodName,Price header (FoodID optional). Items with a
+FoodID update that dish; items without one match a current dish of the
+same name, or are new. Current dishes the menu does not mention are
+deleted. Prices compare to the cent.
+
+api.py applies the diff in one transaction: one executemany upsert for the
+inserts and updates, and chunked deletes.
+
+Settings:
+    MENU_MAX_ITEMS    largest menu accepted (default 20000)
+"""
+import csv
+import io
+import json
+import os
+
+MAX_ITEMS = int(os.getenv('MENU_MAX_ITEMS', '20000'))
+NAME_LENGTH = 100   # Food.FoodName
+
+
+class MenuError(ValueError):
+    """The submitted menu is malformed; the message is safe to return."""
+
+
+def parse_menu(content_type, body):
+    """[{'FoodID': int or None, 'FoodName': str, 'Price': float}] from a JSON or CSV body."""
+    if content_type.startswith('text/csv'):
+        try:
+            raw = list(csv.DictReader(io.StringIO(body.decode('utf-8-sig'))))
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise MenuError(f"Unreadable CSV: {e}")
+    else:
+        try:
+            data = json.loads(body or b'null')
+        except ValueError:
+            raise MenuError("Body must be JSON or text/csv")
+        raw = data.get('items') if isinstance(data, dict) else None
+        if not isinstance(raw, list):
+            raise MenuError("items must be a list")
+    if len(raw) > MAX_ITEMS:
+        raise MenuError(f"A menu may have at most {MAX_ITEMS} items")
+    return [_item(position, entry) for position, entry in enumerate(raw, start=1)]
+
+
+def _item(position, entry):
+    if not isinstance(entry, dict):
+        raise MenuError(f"Item {position} must be an object")
+    name = entry.get('FoodName')
+    name = name.strip() if isinstance(name, str) else ''
+    if not name or len(name) > NAME_LENGTH:
+        raise MenuError(f"Item {position}: FoodName must be 1 to {NAME_LENGTH} characters")
+    try:
+        price = float(entry.get('Price'))
+    except (TypeError, ValueError):
+        price = None
+    if price is None or not 0 < price < float('inf'):
+        raise MenuError(f"Item {position}: Price must be a positive number")
+    food_id = entry.get('FoodID')
+    if food_id in (None, ''):
+        food_id = None
+    else:
+        try:
+            food_id = int(food_id)
+        except (TypeError, ValueError):
+            raise MenuError(f"Item {position}: FoodID must be a whole number")
+    return {'FoodID': food_id, 'FoodName': name, 'Price': price}
+
+
+def diff_menu(current, items):
+    """(inserts, updates, deletes, unchanged) turning `current` into `items`.
+
+    current is {FoodID: (FoodName, Price)}. inserts are items without an ID
+    yet, updates are items with one, deletes are FoodIDs.
+    """
+    by_id = {}
+    for position, item in enumerate(items, start=1):
+        if item['FoodID'] is not None:
+            if item['FoodID'] not in current:
+                raise MenuError(f"Item {position}: FoodID {item['FoodID']} is not on this menu")
+            if item['FoodID'] in by_id:
+                raise MenuError(f"Item {position}: FoodID {item['FoodID']} appears twice")
+            by_id[item['FoodID']] = item
+
+    # Unmatched current dishes by name, lowest ID first
+    by_name = {}
+    for food_id in sorted(current):
+        if food_id not in by_id:
+            by_name.setdefault(current[food_id][0], []).append(food_id)
+
+    inserts, updates, unchanged = [], [], 0
+    for item in items:
+        if item['FoodID'] is None:
+            same_name = by_name.get(item['FoodName'])
+            if not same_name:
+                inserts.append(item)
+                continue
+            item = dict(item, FoodID=same_name.pop(0))
+        name, price = current[item['FoodID']]
+        if name == item['FoodName'] and round(price, 2) == round(item['Price'], 2):
+            unchanged += 1
+        else:
+            updates.append(item)
+    deletes = sorted(food_id for ids in by_name.values() for food_id in ids)
+    return inserts, updates, deletes, unchanged
@@ -0,0 +1,224 @@
+"""
+Live message push for /api/customers/messages/stream (Server-Sent Events).
+
+create_message publishes every committed message on the MessageBus, which
+fans it out to the open streams of its sender and recipient. Each stream
+has a bounded buffer; a client that falls behind is disconnected and
+catches up from the database when it reconnects with Last-Event-ID (the
+event id is the MessageID; the backlog is everything after that message
+by (Timestamp, MessageID)).
+
+With several worker processes set MESSAGE_BROKER_DIR to a directory shared
+by them. FileBroker appends every published message to messages.log there
+and each worker tails the file to deliver messages committed by the others.
+The log is rotated to messages.log.1 once it exceeds MESSAGE_BROKER_MAX_BYTES.
+
+Streams hold a connection open for up to SSE_MAX_SECONDS, so serve them with
+serve.py or gevent gunicorn workers rather than a thread per connection.
+
+Settings:
+    MESSAGE_BROKER_DIR        shared directory for the multi-worker broker
+    MESSAGE_BROKER_POLL       seconds between log polls (default 0.1)
+    MESSAGE_BROKER_MAX_BYTES  rotation size (default 50 MB)
+    SSE_HEARTBEAT_SECONDS     keep-alive comment interval (default 15)
+    SSE_MAX_SECONDS           stream lifetime before the client reconnects (default 300)
+    SSE_QUEUE_SIZE            per-stream buffer (default 100)
+    SSE_BACKLOG_LIMIT         most messages replayed on resume (default 500)
+"""
+import fcntl
+import json
+import os
+import queue
+import threading
+import time
+
+from app_logging import get_logger
+from fork_hooks import restart_in_child
+
+BROKER_DIR = os.getenv('MESSAGE_BROKER_DIR')
+BROKER_POLL_SECONDS = float(os.getenv('MESSAGE_BROKER_POLL', '0.1'))
+BROKER_MAX_BYTES = int(os.getenv('MESSAGE_BROKER_MAX_BYTES', str(50 * 1024 * 1024)))
+HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+MAX_STREAM_SECONDS = float(os.getenv('SSE_MAX_SECONDS', '300'))
+QUEUE_SIZE = int(os.getenv('SSE_QUEUE_SIZE', '100'))
+BACKLOG_LIMIT = int(os.getenv('SSE_BACKLOG_LIMIT', '500'))
+
+# Milliseconds EventSource waits before reconnecting
+RETRY_MS = 3000
+
+log = get_logger('app')
+
+
+class Subscription:
+    def __init__(self, customer_id, queue_size):
+        self.customer_id = customer_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+
+class MessageBus:
+    """In-process pub/sub keyed by customer ID."""
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        # Set by FileBroker to forward published messages to other workers
+        self.relay = None
+
+    def subscribe(self, customer_id):
+        subscription = Subscription(customer_id, self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(customer_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.customer_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.customer_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+    def publish(self, event):
+        self.deliver(event)
+        if self.relay is not None:
+            self.relay.append(event)
+
+    def deliver(self, event):
+        """Hands an event to the local streams of its sender and recipient."""
+        with self._lock:
+            targets = [
+                subscription
+                for customer_id in {event['SenderID'], event['RecipientID']}
+                for subscription in self._subscribers.get(customer_id, ())
+            ]
+        for subscription in targets:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                # The stream ends and the client resumes from the database
+                subscription.overflowed = True
+
+
+class FileBroker:
+    """Relays published messages between worker processes through a shared log file."""
+
+    def __init__(self, bus, directory, poll_seconds=BROKER_POLL_SECONDS, max_bytes=BROKER_MAX_BYTES):
+        self.bus = bus
+        self.path = os.path.join(directory, 'messages.log')
+        self.lock_path = os.path.join(directory, 'messages.lock')
+        self.poll_seconds = poll_seconds
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, event):
+        line = json.dumps({'origin': os.getpid(), 'event': event}, default=str) + '\n'
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+                with open(self.path, 'a') as f:
+                    f.write(line)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def start(self):
+        self.bus.relay = self
+        self._start_tail()
+        restart_in_child(self._start_tail)
+
+    def _start_tail(self):
+        threading.Thread(target=self._tail, name='message-broker', daemon=True).start()
+
+    def _open(self):
+        # Start at the end: anything older is served from the database on resume
+        fd = os.open(self.path, os.O_RDONLY | os.O_CREAT, 0o644)
+        return fd, os.fstat(fd).st_size
+
+    def _tail(self):
+        while True:
+            try:
+                self._follow()
+            except Exception:
+                log.exception("Message broker tail failed, restarting")
+                time.sleep(1)
+
+    def _follow(self):
+        # pread with our own offset, so a descriptor inherited across fork is never shared
+        fd, offset = self._open()
+        pending = b''
+        while True:
+            chunk = os.pread(fd, 65536, offset)
+            if chunk:
+                offset += len(chunk)
+                pending = self._dispatch(pending + chunk)
+                continue
+            try:
+                rotated = os.stat(self.path).st_ino != os.fstat(fd).st_ino
+            except FileNotFoundError:
+                rotated = True
+            if rotated:
+                # The old file has been read to the end; follow the new one from the start
+                os.close(fd)
+                fd = os.open(self.path, os.O_RDONLY | os.O_CREAT, 0o644)
+                offset, pending = 0, b''
+                continue
+            time.sleep(self.poll_seconds)
+
+    def _dispatch(self, data):
+        *lines, rest = data.split(b'\n')
+        pid = os.getpid()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('origin') != pid:
+                self.bus.deliver(record['event'])
+        return rest
+
+
+def format_event(event):
+    return f"id: {event['MessageID']}\nevent: message\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+def stream_events(bus, subscription, backlog, heartbeat_seconds=HEARTBEAT_SECONDS,
+                  max_seconds=MAX_STREAM_SECONDS):
+    """Yields the SSE body: replayed backlog, then live events until the stream expires."""
+    # MessageIDs are not in commit order across write-behind workers, so
+    # repeats are recognised by ID rather than by comparing against the last one
+    replayed = {event['MessageID'] for event in backlog}
+    deadline = time.monotonic() + max_seconds
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        for event in backlog:
+            yield format_event(event)
+        while not subscription.overflowed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = subscription.queue.get(timeout=min(heartbeat_seconds, remaining))
+            except queue.Empty:
+                # Keeps proxies from closing an idle stream and surfaces dead clients
+                yield ': keep-alive\n\n'
+                continue
+            # Subscribed before the backlog query, so the first live events may repeat it
+            if event['MessageID'] in replayed:
+                continue
+            yield format_event(event)
+    finally:
+        bus.unsubscribe(subscription)
+
+
+def init_message_stream():
+    bus = MessageBus()
+    if BROKER_DIR:
+        FileBroker(bus, BROKER_DIR).start()
+    return bus
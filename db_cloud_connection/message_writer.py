@@ -0,0 +1,256 @@
+"""
+Write-behind ingestion for create_message (MESSAGE_WRITE_BEHIND=true).
+
+create_message takes a MessageID from IdAllocator, queues the row and
+returns; a flusher thread writes the queue as one multi-row INSERT per
+batch. A batch is flushed MESSAGE_FLUSH_MS after its first row arrives, or
+as soon as MESSAGE_FLUSH_ROWS rows are waiting.
+
+Durability is acknowledged per batch. With MESSAGE_WRITE_ACK=commit (the
+default) a request waits until its batch has committed, so concurrent
+senders share one transaction, and gets 201. With MESSAGE_WRITE_ACK=queued
+it gets 202 as soon as the row is queued; a crash can then lose the rows
+still queued. A commit-mode request whose batch has not committed within
+MESSAGE_ACK_TIMEOUT seconds also gets 202: the row is still written, and an
+error would let an Idempotency-Key retry write it again. Queued rows are flushed on shutdown (atexit, gunicorn's
+worker_exit and serve.py).
+
+IDs are reserved MESSAGE_ID_BLOCK at a time from the Id_Block table, so any
+number of workers and hosts allocate without colliding. Each worker hands
+out its own block, so IDs are unique but, across workers, in neither time
+nor commit order: what needs "newest" orders by (Timestamp, MessageID)
+(conversation upserts, the inbox, paged history and stream resume). A stream that drops
+within a flush of a message stamped earlier but committed later than the
+last one it got can miss that message on resume; run write-behind in a
+single process where that matters. The synchronous path takes its IDs
+from the same allocator, so workers may run in either mode.
+
+Settings:
+    MESSAGE_WRITE_BEHIND  true to queue messages (default false)
+    MESSAGE_WRITE_ACK     commit (default) or queued
+    MESSAGE_ACK_TIMEOUT   seconds a commit-mode request waits for its batch (default 30)
+    MESSAGE_FLUSH_MS      longest a row waits for its batch (default 5)
+    MESSAGE_FLUSH_ROWS    rows that trigger an immediate flush (default 200)
+    MESSAGE_QUEUE_SIZE    queued rows before senders get 503 (default 10000)
+    MESSAGE_ID_BLOCK      IDs reserved per allocation (default 1000)
+"""
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app_logging import get_logger
+from fork_hooks import restart_in_child
+from metrics import registry
+
+WRITE_BEHIND = os.getenv('MESSAGE_WRITE_BEHIND', 'false').lower() == 'true'
+WRITE_ACK = os.getenv('MESSAGE_WRITE_ACK', 'commit').lower()
+ACK_TIMEOUT_SECONDS = float(os.getenv('MESSAGE_ACK_TIMEOUT', '30'))
+FLUSH_MS = float(os.getenv('MESSAGE_FLUSH_MS', '5'))
+FLUSH_ROWS = int(os.getenv('MESSAGE_FLUSH_ROWS', '200'))
+QUEUE_SIZE = int(os.getenv('MESSAGE_QUEUE_SIZE', '10000'))
+ID_BLOCK = int(os.getenv('MESSAGE_ID_BLOCK', '1000'))
+
+log = get_logger('db')
+
+# Tells the flusher to write what is left and exit
+_STOP = object()
+
+
+class QueueFull(Exception):
+    pass
+
+
+class IdAllocator:
+    """Hands out IDs from blocks reserved in a shared counter row.
+
+    counter_table has Name and NextID columns; id_column is the column the IDs
+    end up in, so a block never starts below rows written some other way.
+    """
+
+    def __init__(self, engine_getter, counter_table, name, id_column, block_size=ID_BLOCK):
+        self.engine_getter = engine_getter
+        self.counter_table = counter_table
+        self.name = name
+        self.id_column = id_column
+        self.block_size = block_size
+        self.after_fork()
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        # A child must not hand out the rest of its parent's block
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+    def next_id(self):
+        with self._lock:
+            if self._next >= self._end:
+                try:
+                    self._next, self._end = self._reserve()
+                except IntegrityError:
+                    # Another process created the counter row first
+                    self._next, self._end = self._reserve()
+            value = self._next
+            self._next += 1
+            return value
+
+    def reserve(self, count):
+        """A range of `count` consecutive IDs of its own, e.g. for a multi-row insert."""
+        if count <= 0:
+            return range(0)
+        try:
+            start, end = self._reserve(count)
+        except IntegrityError:
+            start, end = self._reserve(count)
+        return range(start, end)
+
+    def _reserve(self, size=None):
+        size = size or self.block_size
+        table = self.counter_table
+        row = table.c.Name == self.name
+        with self.engine_getter().begin() as connection:
+            # The UPDATE takes the row lock first, so concurrent reservations serialize
+            bumped = connection.execute(
+                update(table).where(row).values(NextID=table.c.NextID + size)
+            ).rowcount
+            if not bumped:
+                connection.execute(insert(table).values(Name=self.name, NextID=1 + size))
+            end = connection.execute(select(table.c.NextID).where(row)).scalar_one()
+            floor = (connection.execute(select(func.max(self.id_column))).scalar() or 0) + 1
+            if end - size < floor:
+                end = floor + size
+                connection.execute(update(table).where(row).values(NextID=end))
+        log.debug("Reserved %s IDs %d-%d", self.name, end - size, end - 1)
+        return end - size, end
+
+
+class PendingWrite:
+    """A queued row; done is set once its batch has committed or failed."""
+
+    def __init__(self, row, event):
+        self.row = row
+        self.event = event
+        self.done = threading.Event()
+        self.error = None
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError('Write was not flushed in time')
+        if self.error is not None:
+            raise self.error
+
+
+class MessageWriter:
+    """Bounded queue of rows flushed in batches by a background thread.
+
+    write_batch(rows) must write all rows in one transaction; on_committed(events)
+    runs after each successful batch with the events of its rows.
+    """
+
+    def __init__(self, write_batch, on_committed=None, flush_ms=FLUSH_MS, flush_rows=FLUSH_ROWS,
+                 queue_size=QUEUE_SIZE):
+        self.write_batch = write_batch
+        self.on_committed = on_committed
+        self.flush_seconds = flush_ms / 1000.0
+        self.flush_rows = flush_rows
+        self.queue_size = queue_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._closed = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+        self._thread.start()
+        restart_in_child(self._restart)
+        return self
+
+    def _restart(self):
+        # Rows queued in the parent are the parent's to flush
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._closed = False
+        self.start()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def submit(self, row, event=None, timeout=0.1):
+        """Queues a row; raises QueueFull if there is no room within timeout seconds."""
+        if self._closed:
+            raise QueueFull('Message writer is shut down')
+        pending = PendingWrite(row, event)
+        try:
+            self._queue.put(pending, timeout=timeout)
+        except queue.Full:
+            raise QueueFull(f'{self.queue_size} messages already queued')
+        return pending
+
+    def close(self, timeout=30):
+        """Flushes everything queued and stops the flusher."""
+        if self._closed or self._thread is None:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            log.error("Message writer did not finish flushing within %gs; %d rows left", timeout, self.pending())
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.flush_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+        # Nothing is queued after _STOP except by late submits; write those too
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.flush_rows):
+            self._flush(leftover[start:start + self.flush_rows])
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            self.write_batch([p.row for p in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                # Retry one by one so a single bad row does not fail its neighbours
+                log.warning("Batch of %d messages failed, retrying individually: %s", len(batch), e)
+                for pending in batch:
+                    self._flush([pending])
+                return
+            log.exception("Error writing queued message: %s", e)
+            batch[0].error = e
+            batch[0].done.set()
+            return
+        registry.observe('message_flush_seconds', (), time.perf_counter() - started)
+        registry.inc('message_writes_total', (), len(batch))
+        for pending in batch:
+            pending.done.set()
+        if self.on_committed is not None:
+            try:
+                self.on_committed([p.event for p in batch if p.event is not None])
+            except Exception as e:
+                log.exception("Error after message batch commit: %s", e)
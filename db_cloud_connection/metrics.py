@@ -0,0 +1,318 @@
+"""
+Prometheus-style metrics for api.py, served at /metrics.
+
+Exposed series:
+    http_requests_total{method,route,status}
+    http_request_duration_seconds{method,route}   histogram
+    db_pool_size / db_pool_checked_out / db_pool_overflow{role}   gauges
+    db_pool_wait_seconds{role}                     histogram
+    cache_requests_total{cache,result}
+    image_processing_seconds{step}                 histogram
+    sse_streams                                    gauge
+    message_write_queue                            gauge
+    message_writes_total
+    message_flush_seconds                          histogram
+
+Recording is lock-free: every thread writes to its own shard and shards are
+only merged when /metrics is scraped.
+
+With several worker processes set METRICS_MULTIPROC_DIR to a directory shared
+by the workers. Each worker dumps its totals there every METRICS_FLUSH_SECONDS
+and on scrape, and a scrape of any worker merges all the files. Counters of
+workers that exited are kept; their gauges are dropped.
+"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from sqlalchemy.pool import QueuePool
+
+from app_logging import get_logger
+from fork_hooks import restart_in_child
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'http_requests_total': ('counter', 'HTTP requests by route and status'),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency'),
+    'db_pool_size': ('gauge', 'Configured pool size per role engine'),
+    'db_pool_checked_out': ('gauge', 'Connections currently checked out'),
+    'db_pool_overflow': ('gauge', 'Connections open beyond pool_size'),
+    'db_pool_wait_seconds': ('histogram', 'Time spent waiting for a pooled connection'),
+    'cache_requests_total': ('counter', 'Cache lookups by result'),
+    'image_processing_seconds': ('histogram', 'Photo upload image processing time'),
+    'sse_streams': ('gauge', 'Open message streams'),
+    'message_write_queue': ('gauge', 'Messages queued for write-behind'),
+    'message_writes_total': ('counter', 'Messages written by the write-behind flusher'),
+    'message_flush_seconds': ('histogram', 'Write-behind batch commit time'),
+    'autocomplete_bytes': ('gauge', 'Approximate memory held by each autocomplete index'),
+}
+
+MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR')
+FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+
+try:
+    # Under gevent (serve.py) threading.local is per greenlet, i.e. per connection;
+    # shards must stay per OS thread or there would be one for every client ever seen
+    from gevent.monkey import get_original
+    _thread_local = get_original('threading', 'local')
+except ImportError:
+    _thread_local = threading.local
+
+
+class _Shard:
+    """Counters and histograms written by a single thread."""
+
+    def __init__(self):
+        self.counters = defaultdict(float)
+        # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.histograms = {}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._local = _thread_local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._collectors = []
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name, labels=(), value=1):
+        self._shard().counters[(name, labels)] += value
+
+    def observe(self, name, labels, seconds):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        values = histograms.get(key)
+        if values is None:
+            values = histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        values[bisect.bisect_left(BUCKETS, seconds)] += 1
+        values[-1] += seconds
+
+    @contextmanager
+    def timer(self, name, labels=()):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, labels, time.perf_counter() - started)
+
+    def after_fork(self):
+        # A forked worker starts from zero; the parent's totals are the parent's
+        self._local = _thread_local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def add_collector(self, collector):
+        """collector() returns [(name, labels, value)] gauges at scrape time."""
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        """Merges all thread shards into plain dicts."""
+        counters = defaultdict(float)
+        histograms = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for key, value in list(shard.counters.items()):
+                counters[key] += value
+            for key, values in list(shard.histograms.items()):
+                merged = histograms.setdefault(key, [0] * len(values))
+                for i, v in enumerate(values):
+                    merged[i] += v
+        gauges = {}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges[(name, labels)] = value
+        return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+
+registry = MetricsRegistry()
+
+
+def cache_hit(cache):
+    registry.inc('cache_requests_total', (('cache', cache), ('result', 'hit')))
+
+
+def cache_miss(cache):
+    registry.inc('cache_requests_total', (('cache', cache), ('result', 'miss')))
+
+
+def image_timer(step):
+    return registry.timer('image_processing_seconds', (('step', step),))
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection.
+
+    The role label comes from the engine's pool_logging_name.
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            role = getattr(self, '_orig_logging_name', None) or 'default'
+            registry.observe('db_pool_wait_seconds', (('role', role),), time.perf_counter() - started)
+
+
+def pool_collector(engines, router=None):
+    def collect():
+        engines_by_role = list(engines.created().items())
+        if router is not None:
+            engines_by_role.extend(router.replica_engines())
+        gauges = []
+        for role, engine in engines_by_role:
+            pool = engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            labels = (('role', role),)
+            gauges.append(('db_pool_size', labels, pool.size()))
+            gauges.append(('db_pool_checked_out', labels, pool.checkedout()))
+            gauges.append(('db_pool_overflow', labels, max(0, pool.overflow())))
+        return gauges
+    return collect
+
+
+# ---- multi-process aggregation ----
+
+def _encode(snapshot):
+    return {
+        section: [[name, list(labels), value] for (name, labels), value in snapshot[section].items()]
+        for section in ('counters', 'histograms', 'gauges')
+    }
+
+
+def write_worker_file(directory=MULTIPROC_DIR):
+    path = os.path.join(directory, f'metrics_{os.getpid()}.json')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(_encode(registry.snapshot()), f)
+    os.replace(tmp_path, path)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def merged_snapshot(directory=MULTIPROC_DIR):
+    write_worker_file(directory)
+    counters = defaultdict(float)
+    histograms = {}
+    gauges = defaultdict(float)
+    for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+        pid = int(os.path.basename(path)[len('metrics_'):-len('.json')])
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in data['counters']:
+            counters[(name, tuple(map(tuple, labels)))] += value
+        for name, labels, values in data['histograms']:
+            merged = histograms.setdefault((name, tuple(map(tuple, labels))), [0] * len(values))
+            for i, v in enumerate(values):
+                merged[i] += v
+        if _pid_alive(pid):
+            for name, labels, value in data['gauges']:
+                gauges[(name, tuple(map(tuple, labels)))] += value
+    return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+
+def start_flusher(directory=MULTIPROC_DIR, interval=FLUSH_SECONDS):
+    os.makedirs(directory, exist_ok=True)
+
+    def _loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_worker_file(directory)
+            except OSError as e:
+                get_logger('app').warning("Could not write worker metrics: %s", e)
+
+    threading.Thread(target=_loop, name='metrics-flush', daemon=True).start()
+
+
+# ---- exposition ----
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def render(snapshot):
+    lines = []
+    series = defaultdict(list)
+    for section in ('counters', 'gauges', 'histograms'):
+        for (name, labels), value in snapshot[section].items():
+            series[name].append((section, labels, value))
+
+    for name in sorted(series):
+        kind, help_text = HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for section, labels, value in sorted(series[name], key=lambda s: s[1]):
+            if section != 'histograms':
+                lines.append(f'{name}{_format_labels(labels)} {value:g}')
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {value[-1]:.6f}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app, engines, router=None):
+    registry.add_collector(pool_collector(engines, router))
+    if MULTIPROC_DIR:
+        start_flusher()
+        restart_in_child(start_flusher)
+    os.register_at_fork(after_in_child=registry.after_fork)
+
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            registry.inc('http_requests_total', (('method', request.method), ('route', route), ('status', str(response.status_code))))
+            registry.observe('http_request_duration_seconds', (('method', request.method), ('route', route)),
+                             time.perf_counter() - started)
+        return response
+
+    def metrics_endpoint():
+        snapshot = merged_snapshot() if MULTIPROC_DIR else registry.snapshot()
+        return Response(render(snapshot), mimetype='text/plain; version=0.0.4')
+
+    app.before_request_funcs.setdefault(None, []).insert(0, start_timer)
+    app.after_request_funcs.setdefault(None, []).insert(0, record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint, methods=['GET'])
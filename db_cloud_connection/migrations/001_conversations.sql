@@ -0,0 +1,54 @@
+-- Conversation index for /api/customers/conversations (Cloud SQL / MySQL).
+-- One row per customer pair, CustomerA < CustomerB, kept current by create_message.
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/001_conversations.sql
+
+CREATE TABLE Conversation (
+
+    CustomerA INT NOT NULL,
+
+    CustomerB INT NOT NULL,
+
+    LastMessageID INT NOT NULL,
+
+    LastMessageAt DATETIME NOT NULL,
+
+    Preview VARCHAR(140) NOT NULL,
+
+    UnreadA INT NOT NULL DEFAULT 0,
+
+    UnreadB INT NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (CustomerA, CustomerB),
+
+    INDEX idx_conversation_a (CustomerA, LastMessageID),
+
+    INDEX idx_conversation_b (CustomerB, LastMessageID)
+
+);
+
+
+
+-- Per-thread history in both directions
+
+CREATE INDEX idx_messages_pair ON Messages (SenderID, RecipientID, MessageID);
+
+
+
+-- Backfill from existing messages; existing history counts as read
+
+INSERT INTO Conversation (CustomerA, CustomerB, LastMessageID, LastMessageAt, Preview, UnreadA, UnreadB)
+SELECT latest.a, latest.b, m.MessageID, m.Datetime, SUBSTRING(m.Content, 1, 140), 0, 0
+FROM (
+    SELECT LEAST(SenderID, RecipientID) AS a, GREATEST(SenderID, RecipientID) AS b, MAX(MessageID) AS last_id
+    FROM Messages
+    GROUP BY LEAST(SenderID, RecipientID), GREATEST(SenderID, RecipientID)
+) AS latest
+JOIN Messages m ON m.MessageID = latest.last_id;
+
+
+
+-- Role access; use the CUSTOMER_USER name from .env
+
+GRANT SELECT, INSERT, UPDATE ON Conversation TO 'customer_user'@'%';
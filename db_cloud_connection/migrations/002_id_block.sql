@@ -0,0 +1,26 @@
+-- ID blocks for write-behind message ingestion (MESSAGE_WRITE_BEHIND=true).
+-- Each worker reserves MESSAGE_ID_BLOCK MessageIDs at a time from this row.
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/002_id_block.sql
+
+CREATE TABLE Id_Block (
+
+    Name VARCHAR(64) NOT NULL PRIMARY KEY,
+
+    NextID INT NOT NULL
+
+);
+
+
+
+-- Start above the existing messages
+
+INSERT INTO Id_Block (Name, NextID)
+SELECT 'Messages', COALESCE(MAX(MessageID), 0) + 1 FROM Messages;
+
+
+
+-- Role access; use the CUSTOMER_USER name from .env
+
+GRANT SELECT, INSERT, UPDATE ON Id_Block TO 'customer_user'@'%';
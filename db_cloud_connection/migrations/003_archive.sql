@@ -0,0 +1,33 @@
+-- Hot/cold archival for Messages and Orders (see archive.py).
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/003_archive.sql
+
+-- Orders placed before this migration keep a NULL OrderDate: archive.py moves
+-- them first (they hold the lowest OrderIDs) and the sales rollups do not
+-- count them
+
+ALTER TABLE Orders ADD COLUMN OrderDate DATETIME NULL;
+
+
+
+-- Archive tables keep the columns and indexes of the hot tables (LIKE copies
+-- no foreign keys, so archived rows do not pin customers or restaurants)
+
+CREATE TABLE Messages_Archive LIKE Messages;
+
+CREATE TABLE Orders_Archive LIKE Orders;
+
+CREATE TABLE FoodOrders_Archive LIKE FoodOrders;
+
+CREATE INDEX idx_orders_archive_customer ON Orders_Archive (CustomerID, OrderID);
+
+
+
+-- Role access; use the CUSTOMER_USER name from .env. archive.py runs as the admin user.
+
+GRANT SELECT ON Messages_Archive TO 'customer_user'@'%';
+
+GRANT SELECT ON Orders_Archive TO 'customer_user'@'%';
+
+GRANT SELECT ON FoodOrders_Archive TO 'customer_user'@'%';
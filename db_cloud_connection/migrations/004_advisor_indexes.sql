@@ -0,0 +1,48 @@
+-- Indexes proposed by index_advisor.py from EXPLAIN plans of the benchmark suite
+-- on the sqlite backend. Review before applying; each comment lists the
+-- endpoints the index serves.
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/004_advisor_indexes.sql
+
+
+
+-- DELETE /api/restaurants/<int:id>, GET /api/restaurants/<int:restaurant_id>/foods
+
+CREATE INDEX idx_food_restaurantid ON Food (RestaurantID);
+
+
+
+-- DELETE /api/restaurants/<int:restaurant_id>/foods/<int:food_id>
+
+CREATE INDEX idx_foodorders_foodid ON FoodOrders (FoodID);
+
+
+
+-- GET /api/customers/messages, GET /api/messages/user_messages/<int:userid>
+
+CREATE INDEX idx_messages_recipientid_datetime ON Messages (RecipientID, Datetime);
+
+
+
+-- GET /api/customers/messages, GET /api/messages/user_messages/<int:userid>
+
+CREATE INDEX idx_messages_senderid_datetime ON Messages (SenderID, Datetime);
+
+
+
+-- GET /api/orders/customer
+
+CREATE INDEX idx_orders_customerid_orderid ON Orders (CustomerID, OrderID);
+
+
+
+-- GET /api/customers/<int:id>/restaurants, GET /api/customers/reviews
+
+CREATE INDEX idx_review_customerid_date ON Review (CustomerID, Date);
+
+
+
+-- GET /api/restaurants/<int:restaurant_id>/reviews
+
+CREATE INDEX idx_review_restaurantid_date ON Review (RestaurantID, Date);
@@ -0,0 +1,14 @@
+-- Coordinates for restaurant and customer addresses (see geocoder.py and
+-- geo_index.py). Existing rows start out NULL; fill them afterwards with
+--   python geocoder.py
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/005_geolocation.sql
+
+ALTER TABLE Restaurant
+    ADD COLUMN Latitude DOUBLE NULL,
+    ADD COLUMN Longitude DOUBLE NULL;
+
+ALTER TABLE Customer_Address
+    ADD COLUMN Latitude DOUBLE NULL,
+    ADD COLUMN Longitude DOUBLE NULL;
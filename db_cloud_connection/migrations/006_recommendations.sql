@@ -0,0 +1,47 @@
+-- Top-N neighbour tables written by recommendations.py (run it from cron as
+-- the admin user) and read by the also-ordered and similar-restaurant endpoints.
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/006_recommendations.sql
+
+CREATE TABLE Food_Neighbors (
+
+    FoodID INT NOT NULL,
+
+    `Rank` SMALLINT NOT NULL,
+
+    NeighborID INT NOT NULL,
+
+    Score FLOAT NOT NULL,
+
+    PRIMARY KEY (FoodID, `Rank`)
+
+);
+
+
+
+CREATE TABLE Restaurant_Neighbors (
+
+    RestaurantID INT NOT NULL,
+
+    `Rank` SMALLINT NOT NULL,
+
+    NeighborID INT NOT NULL,
+
+    Score FLOAT NOT NULL,
+
+    PRIMARY KEY (RestaurantID, `Rank`)
+
+);
+
+
+
+-- Role access; use the CUSTOMER_USER and RESTAURANT_USER names from .env
+
+GRANT SELECT ON Food_Neighbors TO 'customer_user'@'%';
+
+GRANT SELECT ON Restaurant_Neighbors TO 'customer_user'@'%';
+
+GRANT SELECT ON Food_Neighbors TO 'restaurant_user'@'%';
+
+GRANT SELECT ON Restaurant_Neighbors TO 'restaurant_user'@'%';
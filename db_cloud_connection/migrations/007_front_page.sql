@@ -0,0 +1,42 @@
+-- Scheduled front page ranking (see front_page.py and scheduler.py).
+-- Front_Page gains the slot each restaurant was ranked into; the push points
+-- already in it are carried over as boosts bought now, so current
+-- placements fade out on the boost half-life instead of vanishing.
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/007_front_page.sql
+
+CREATE TABLE Front_Page_Boost (
+
+    BoostID INT NOT NULL AUTO_INCREMENT,
+
+    RestaurantID INT NOT NULL,
+
+    Points INT NOT NULL,
+
+    PurchasedAt DATETIME NOT NULL,
+
+    PRIMARY KEY (BoostID),
+
+    KEY idx_front_page_boost_purchased (PurchasedAt),
+
+    FOREIGN KEY (RestaurantID) REFERENCES Restaurant(RestaurantID)
+
+);
+
+
+
+INSERT INTO Front_Page_Boost (RestaurantID, Points, PurchasedAt)
+SELECT RestaurantID, PushPoints, UTC_TIMESTAMP()
+FROM Front_Page
+WHERE PushPoints > 0;
+
+ALTER TABLE Front_Page
+    ADD COLUMN SlotRank INT NULL;
+
+
+
+-- Role access; use the RESTAURANT_USER name from .env. Deleting a restaurant
+-- removes its boosts as well.
+
+GRANT SELECT, INSERT, DELETE ON Front_Page_Boost TO 'restaurant_user'@'%';
@@ -0,0 +1,56 @@
+-- Daily sales rollups for the analytics endpoints. create_order adds to them
+-- as orders arrive; fill them from the existing orders afterwards with
+--   python rollups.py
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/008_sales_rollups.sql
+
+CREATE TABLE Restaurant_Daily_Sales (
+
+    RestaurantID INT NOT NULL,
+
+    Day DATE NOT NULL,
+
+    OrderCount INT NOT NULL,
+
+    Revenue DOUBLE NOT NULL,
+
+    AdditionalCosts DOUBLE NOT NULL,
+
+    PRIMARY KEY (RestaurantID, Day)
+
+);
+
+
+
+CREATE TABLE Food_Daily_Sales (
+
+    RestaurantID INT NOT NULL,
+
+    Day DATE NOT NULL,
+
+    FoodID INT NOT NULL,
+
+    OrderCount INT NOT NULL,
+
+    Quantity INT NOT NULL,
+
+    PRIMARY KEY (RestaurantID, Day, FoodID),
+
+    KEY idx_food_daily_sales_food (FoodID)
+
+);
+
+
+
+-- Role access; use the CUSTOMER_USER and RESTAURANT_USER names from .env.
+-- Customers add to the rollups when ordering; restaurants read them and
+-- remove them with their dishes and restaurants.
+
+GRANT SELECT, INSERT, UPDATE ON Restaurant_Daily_Sales TO 'customer_user'@'%';
+
+GRANT SELECT, INSERT, UPDATE ON Food_Daily_Sales TO 'customer_user'@'%';
+
+GRANT SELECT, DELETE ON Restaurant_Daily_Sales TO 'restaurant_user'@'%';
+
+GRANT SELECT, DELETE ON Food_Daily_Sales TO 'restaurant_user'@'%';
@@ -0,0 +1,18 @@
+-- Indexes for the streaming order export (order_export.py): a restaurant's
+-- orders are read in OrderID order straight from the index, without a sort.
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/009_order_export.sql
+
+CREATE INDEX idx_orders_restaurantid_orderid ON Orders (RestaurantID, OrderID);
+
+CREATE INDEX idx_orders_archive_restaurant ON Orders_Archive (RestaurantID, OrderID);
+
+
+
+-- Role access; use the RESTAURANT_USER name from .env. Exports include
+-- archived orders.
+
+GRANT SELECT ON Orders_Archive TO 'restaurant_user'@'%';
+
+GRANT SELECT ON FoodOrders_Archive TO 'restaurant_user'@'%';
@@ -0,0 +1,17 @@
+-- FoodIDs from Id_Block (see IdAllocator in message_writer.py), shared by
+-- create_food and the bulk menu import (PUT /api/restaurants/<id>/menu).
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/010_food_ids.sql
+
+-- Start above the existing dishes
+
+INSERT INTO Id_Block (Name, NextID)
+SELECT 'Food', COALESCE(MAX(FoodID), 0) + 1 FROM Food;
+
+
+
+-- Role access; use the RESTAURANT_USER name from .env. Menu imports also
+-- remove the sales rollups of deleted dishes (008 grants that DELETE).
+
+GRANT SELECT, INSERT, UPDATE ON Id_Block TO 'restaurant_user'@'%';
@@ -0,0 +1,32 @@
+-- Responses to POST /api/orders and POST /api/messages kept by Idempotency-Key,
+-- shared between workers when IDEMPOTENCY_STORE=database (see idempotency.py).
+-- scheduler.py deletes expired rows.
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/011_idempotency_keys.sql
+
+CREATE TABLE Idempotency_Key (
+
+    KeyHash CHAR(64) NOT NULL,
+
+    Fingerprint CHAR(64) NOT NULL,
+
+    Status SMALLINT NULL,
+
+    ContentType VARCHAR(100) NULL,
+
+    Body MEDIUMTEXT NULL,
+
+    ExpiresAt DATETIME NOT NULL,
+
+    PRIMARY KEY (KeyHash),
+
+    INDEX idx_idempotency_key_expires (ExpiresAt)
+
+);
+
+
+
+-- Role access; use the CUSTOMER_USER name from .env
+
+GRANT SELECT, INSERT, UPDATE, DELETE ON Idempotency_Key TO 'customer_user'@'%';
@@ -0,0 +1,15 @@
+-- Orders the inbox by (LastMessageAt, LastMessageID) instead of LastMessageID:
+-- MessageIDs from write-behind blocks are not in time order across workers.
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/012_conversation_order.sql
+
+CREATE INDEX idx_conversation_a_latest ON Conversation (CustomerA, LastMessageAt, LastMessageID);
+
+CREATE INDEX idx_conversation_b_latest ON Conversation (CustomerB, LastMessageAt, LastMessageID);
+
+
+
+DROP INDEX idx_conversation_a ON Conversation;
+
+DROP INDEX idx_conversation_b ON Conversation;
@@ -0,0 +1,16 @@
+-- Orders paged thread history by (Datetime, MessageID) instead of MessageID:
+-- MessageIDs from write-behind blocks are not in time order across workers.
+--
+-- Apply with:
+--   mysql -h $DB_HOST -u $DB_ADMIN_USER -p $DB_NAME < migrations/013_message_thread_order.sql
+
+CREATE INDEX idx_messages_pair_time ON Messages (SenderID, RecipientID, Datetime, MessageID);
+
+CREATE INDEX idx_messages_archive_pair_time ON Messages_Archive (SenderID, RecipientID, Datetime, MessageID);
+
+
+
+DROP INDEX idx_messages_pair ON Messages;
+
+-- The archive copied the hot table's index name (CREATE TABLE ... LIKE, migration 003)
+DROP INDEX idx_messages_pair ON Messages_Archive;
@@ -0,0 +1,127 @@
+"""
+Streaming export of a restaurant's orders (GET /api/restaurants/<id>/orders/export).
+
+Rows come from a server-side cursor (stream_results, FETCH_ROWS at a time)
+over Orders_Archive and Orders, oldest first, with each order's FoodOrders
+lines. Archived IDs are all below hot ones, so the two tables read back to
+back stay in OrderID order. Each fetch is encoded as a whole and sent in
+chunks of at least CHUNK_BYTES, optionally gzipped on the fly, so memory
+use depends on FETCH_ROWS and not on the number of orders.
+
+    csv     one line per order line (an order without lines gets one line
+            with empty item columns), header first
+    ndjson  one JSON object per order with its items
+
+The database connection stays checked out until the response has been sent.
+
+Settings:
+    EXPORT_FETCH_ROWS   rows per cursor fetch (default 2000)
+    EXPORT_CHUNK_BYTES  bytes per response chunk before gzip (default 65536)
+"""
+import csv
+import io
+import json
+import os
+import zlib
+
+from sqlalchemy import select
+
+FETCH_ROWS = int(os.getenv('EXPORT_FETCH_ROWS', '2000'))
+CHUNK_BYTES = int(os.getenv('EXPORT_CHUNK_BYTES', '65536'))
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+ORDER_COLUMNS = ['OrderID', 'OrderDate', 'CustomerID', 'PriceTotal', 'Additional_Costs']
+ITEM_COLUMNS = ['FoodID', 'FoodName', 'Price', 'Quantity']
+
+
+def order_lines_query(orders, lines, food, restaurant_id, since=None, until=None):
+    """(order columns..., item columns...) for one orders table, by OrderID.
+
+    Sorting on OrderID alone lets (RestaurantID, OrderID) serve the order, so
+    nothing is sorted before the first row goes out.
+    """
+    query = (
+        select(orders.OrderID, orders.OrderDate, orders.CustomerID, orders.PriceTotal, orders.Additional_Costs,
+               lines.FoodID, food.FoodName, food.Price, lines.Quantity)
+        .outerjoin(lines, lines.OrderID == orders.OrderID)
+        .outerjoin(food, food.FoodID == lines.FoodID)
+        .where(orders.RestaurantID == restaurant_id)
+        .order_by(orders.OrderID)
+    )
+    if since is not None:
+        query = query.where(orders.OrderDate >= since)
+    if until is not None:
+        query = query.where(orders.OrderDate < until)
+    return query
+
+
+def stream_batches(engine, queries):
+    """Yields each query's rows, one cursor fetch (a list of rows) at a time."""
+    with engine.connect() as connection:
+        for query in queries:
+            result = connection.execution_options(stream_results=True, yield_per=FETCH_ROWS).execute(query)
+            for batch in result.partitions():
+                yield batch
+
+
+def csv_lines(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(ORDER_COLUMNS + ITEM_COLUMNS)
+    for batch in batches:
+        # OrderDate is the only column csv would not write as wanted
+        writer.writerows((row[0], row[1].isoformat() if row[1] else None, *row[2:]) for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_lines(batches):
+    order = None
+    for batch in batches:
+        lines = []
+        for row in batch:
+            if order is None or order['OrderID'] != row[0]:
+                if order is not None:
+                    lines.append(json.dumps(order, separators=(',', ':')))
+                order = dict(zip(ORDER_COLUMNS, row[:5]))
+                order['OrderDate'] = order['OrderDate'].isoformat() if order['OrderDate'] else None
+                order['items'] = []
+            if row[5] is not None:
+                order['items'].append(dict(zip(ITEM_COLUMNS, row[5:])))
+        if lines:
+            yield '\n'.join(lines) + '\n'
+    if order is not None:
+        yield json.dumps(order, separators=(',', ':')) + '\n'
+
+
+def chunked(lines, chunk_bytes=CHUNK_BYTES, compress=False):
+    """Joins text into encoded chunks of at least chunk_bytes, gzipped if asked."""
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending, size = [], 0
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            data = ''.join(pending).encode('utf-8')
+            pending, size = [], 0
+            data = gzip.compress(data) if gzip else data
+            if data:
+                yield data
+    data = ''.join(pending).encode('utf-8')
+    if gzip:
+        data = gzip.compress(data) + gzip.flush()
+    if data:
+        yield data
+
+
+def export(engine, queries, fmt, compress=False):
+    """The response body for an export: an iterator of byte chunks."""
+    batches = stream_batches(engine, queries)
+    lines = csv_lines(batches) if fmt == 'csv' else ndjson_lines(batches)
+    return chunked(lines, compress=compress)
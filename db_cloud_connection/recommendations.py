@@ -0,0 +1,302 @@
+"""
+"Also ordered" dishes and similar restaurants from order history.
+
+Two co-occurrence matrices are built with SciPy sparse products:
+
+    dishes       X is orders x FoodID, 1 where the order contains the dish;
+                 C = X'X counts the orders containing both dishes. An order
+                 comes from one restaurant, so pairs never cross menus.
+    restaurants  Y is customers x RestaurantID, 1 where the customer has
+                 ordered there; R = Y'Y counts the customers they share.
+
+Pairs seen fewer than RECOMMEND_MIN_COUNT times are dropped. The rest are
+scored by cosine similarity, count / sqrt(count_i * count_j), and the best
+RECOMMEND_TOP_N of each row go to Food_Neighbors and Restaurant_Neighbors,
+keyed by (ID, Rank), so an endpoint reads one short primary-key range.
+
+    cd db_cloud_connection
+    python recommendations.py --full    # every order, hot and archived
+    python recommendations.py           # orders since the last run (cron)
+
+An incremental run loads C, R and Y from RECOMMEND_STATE_DIR and adds the
+orders with a higher OrderID than the last run saw: C += Xn'Xn for the new
+orders, and R += D'Y + Y'D + D'D for the customer/restaurant pairs D that
+are new. Only the rows around the touched dishes and restaurants are
+re-ranked, and only rows whose neighbours changed are rewritten. Without
+saved state (or after changing the settings) the run is a full one.
+
+Needs numpy and scipy; the API itself does not.
+
+Settings:
+    RECOMMEND_TOP_N       neighbours kept per dish and restaurant (default 10)
+    RECOMMEND_MIN_COUNT   co-occurrences needed to recommend (default 2)
+    RECOMMEND_STATE_DIR   matrices saved between runs (default recommendations_state/ here)
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import delete, func, insert, select
+
+from api import (FoodNeighbor, FoodOrders, FoodOrdersArchive, Orders, OrdersArchive, RestaurantNeighbor,
+                 backend, db, engines)
+
+TOP_N = int(os.getenv('RECOMMEND_TOP_N', '10'))
+MIN_COUNT = int(os.getenv('RECOMMEND_MIN_COUNT', '2'))
+STATE_DIR = os.getenv('RECOMMEND_STATE_DIR',
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recommendations_state'))
+
+FETCH_ROWS = 100000
+WRITE_ROWS = 5000
+
+# Scores are stored and compared at this many decimals
+SCORE_DECIMALS = 4
+
+
+def fetch_pairs(connection, query):
+    """A two-column integer query as an (n, 2) int64 array, streamed in chunks."""
+    result = connection.execution_options(stream_results=True, yield_per=FETCH_ROWS).execute(query)
+    # fromiter over the flattened values: np.array() on Row objects probes each for array attributes
+    chunks = [np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows)).reshape(-1, 2)
+              for rows in result.partitions()]
+    return np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+
+
+def incidence(pairs, columns):
+    """Binary matrix with one row per distinct pairs[:, 0] and a 1 at each pair's column."""
+    _, rows = np.unique(pairs[:, 0], return_inverse=True)
+    matrix = sparse.csr_matrix((np.ones(len(pairs), dtype=np.int32), (rows.ravel(), pairs[:, 1])),
+                               shape=(rows.max() + 1 if len(rows) else 0, columns))
+    matrix.data[:] = 1      # repeated pairs were summed
+    return matrix
+
+
+def grow(matrix, rows, columns=None):
+    """matrix padded with empty rows/columns to at least the given shape."""
+    columns = rows if columns is None else columns
+    shape = (max(matrix.shape[0], rows), max(matrix.shape[1], columns))
+    if shape != matrix.shape:
+        matrix = matrix.tocsr(copy=True)
+        matrix.resize(shape)
+    return matrix
+
+
+def top_neighbours(counts, rows, top_n=TOP_N, min_count=MIN_COUNT):
+    """Best neighbours of the given rows of a symmetric co-occurrence matrix.
+
+    Returns four parallel arrays (ID, rank, neighbour ID, score), grouped by
+    ID with rank 0 first.
+    """
+    support = counts.diagonal().astype(np.float64)
+    block = counts[rows].tocoo()
+    ids, neighbours, together = rows[block.row], block.col.astype(np.int64), block.data
+    keep = (neighbours != ids) & (together >= min_count)
+    ids, neighbours, together = ids[keep], neighbours[keep], together[keep]
+    scores = np.round(together / np.sqrt(support[ids] * support[neighbours]), SCORE_DECIMALS)
+    # Group by ID, best score first, lower neighbour ID breaking ties
+    order = np.lexsort((neighbours, -scores, ids))
+    ids, neighbours, scores = ids[order], neighbours[order], scores[order]
+    ranks = np.arange(len(ids)) - np.searchsorted(ids, ids)
+    keep = ranks < top_n
+    return ids[keep], ranks[keep], neighbours[keep], scores[keep]
+
+
+def changed_ids(old, new):
+    """IDs whose neighbour lists differ between two top_neighbours() results."""
+    records = np.concatenate([np.column_stack(old), np.column_stack(new)])
+    if not len(records):
+        return np.empty(0, dtype=np.int64)
+    unique, seen = np.unique(records, axis=0, return_counts=True)
+    # A record found in only one of the two results
+    return np.unique(unique[seen == 1, 0]).astype(np.int64)
+
+
+def affected(counts, touched):
+    """Touched rows and every row that co-occurs with one, whose scores depend on them."""
+    return np.union1d(touched, counts[touched].indices).astype(np.int64)
+
+
+class Model:
+    """The co-occurrence matrices and how far into Orders they reach."""
+
+    FILES = ('foods', 'restaurants', 'customers')
+
+    def __init__(self, foods, restaurants, customers, last_order_id):
+        self.foods = foods                  # C: FoodID x FoodID
+        self.restaurants = restaurants      # R: RestaurantID x RestaurantID
+        self.customers = customers          # Y: CustomerID x RestaurantID, 0/1
+        self.last_order_id = last_order_id
+
+    @classmethod
+    def load(cls, directory=STATE_DIR):
+        try:
+            with open(os.path.join(directory, 'state.json')) as f:
+                meta = json.load(f)
+            if meta['top_n'] != TOP_N or meta['min_count'] != MIN_COUNT:
+                return None
+            matrices = [sparse.load_npz(os.path.join(directory, f'{name}.npz')).tocsr() for name in cls.FILES]
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(*matrices, meta['last_order_id'])
+
+    def save(self, directory=STATE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        # Without state.json a crash below leaves no state rather than a mismatched one
+        try:
+            os.remove(os.path.join(directory, 'state.json'))
+        except FileNotFoundError:
+            pass
+        for name in self.FILES:
+            path = os.path.join(directory, f'{name}.npz')
+            sparse.save_npz(path + '.tmp.npz', getattr(self, name))
+            os.replace(path + '.tmp.npz', path)
+        # Written last: it marks the matrices above as complete
+        path = os.path.join(directory, 'state.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'last_order_id': self.last_order_id, 'top_n': TOP_N, 'min_count': MIN_COUNT}, f)
+        os.replace(path + '.tmp', path)
+
+
+def build(connection):
+    """Model over every order, hot and archived."""
+    order_foods = np.concatenate([
+        fetch_pairs(connection, select(table.OrderID, table.FoodID)) for table in (FoodOrders, FoodOrdersArchive)
+    ])
+    visits = np.concatenate([
+        fetch_pairs(connection, select(table.CustomerID, table.RestaurantID)) for table in (Orders, OrdersArchive)
+    ])
+    last_order_id = connection.execute(select(func.max(Orders.OrderID))).scalar() or 0
+
+    food_count = int(order_foods[:, 1].max()) + 1 if len(order_foods) else 0
+    x = incidence(order_foods, food_count)
+    restaurant_count = int(visits[:, 1].max()) + 1 if len(visits) else 0
+    # Rows indexed by CustomerID itself, so later runs can add to them
+    customer_count = int(visits[:, 0].max()) + 1 if len(visits) else 0
+    y = sparse.csr_matrix((np.ones(len(visits), dtype=np.int32), (visits[:, 0], visits[:, 1])),
+                          shape=(customer_count, restaurant_count))
+    y.data[:] = 1
+    return Model((x.T @ x).tocsr(), (y.T @ y).tocsr(), y, last_order_id)
+
+
+def new_orders(connection, after):
+    """(OrderID, FoodID) and (CustomerID, RestaurantID) pairs of orders above `after`, and the newest OrderID."""
+    order_foods = fetch_pairs(connection, select(FoodOrders.OrderID, FoodOrders.FoodID).where(FoodOrders.OrderID > after))
+    visits = fetch_pairs(connection, select(Orders.CustomerID, Orders.RestaurantID).where(Orders.OrderID > after))
+    newest = connection.execute(select(func.max(Orders.OrderID)).where(Orders.OrderID > after)).scalar()
+    return order_foods, visits, newest or after
+
+
+def extend(model, order_foods, visits, newest):
+    """The model with new orders added, plus the dish and restaurant IDs they touch."""
+    food_count = max(model.foods.shape[0], int(order_foods[:, 1].max()) + 1 if len(order_foods) else 0)
+    foods = grow(model.foods, food_count)
+    x = incidence(order_foods, food_count)
+    foods = (foods + x.T @ x).tocsr()
+    touched_foods = np.unique(order_foods[:, 1])
+
+    restaurant_count = max(model.restaurants.shape[0], int(visits[:, 1].max()) + 1 if len(visits) else 0)
+    customer_count = max(model.customers.shape[0], int(visits[:, 0].max()) + 1 if len(visits) else 0)
+    customers = grow(model.customers, customer_count, restaurant_count)
+    seen = sparse.csr_matrix((np.ones(len(visits), dtype=np.int32), (visits[:, 0], visits[:, 1])),
+                             shape=(customer_count, restaurant_count))
+    seen.data[:] = 1
+    # Only customer/restaurant pairs not counted before add shared customers
+    fresh = (seen - seen.multiply(customers)).tocsr()
+    fresh.eliminate_zeros()
+    restaurants = grow(model.restaurants, restaurant_count)
+    restaurants = (restaurants + fresh.T @ customers + customers.T @ fresh + fresh.T @ fresh).tocsr()
+    touched_restaurants = np.unique(fresh.indices)
+    return (Model(foods, restaurants, (customers + fresh).tocsr(), newest),
+            touched_foods.astype(np.int64), touched_restaurants.astype(np.int64))
+
+
+def write_neighbours(connection, model, key, neighbours, ids=None):
+    """Replaces the neighbour rows of `ids` (every row when None)."""
+    table = model.__table__
+    if ids is None:
+        connection.execute(delete(table))
+    else:
+        for start in range(0, len(ids), WRITE_ROWS):
+            connection.execute(delete(table).where(table.c[key].in_(ids[start:start + WRITE_ROWS].tolist())))
+        wanted = np.isin(neighbours[0], ids)
+        neighbours = [column[wanted] for column in neighbours]
+    rows = [
+        {key: item_id, 'Rank': rank, 'NeighborID': neighbour, 'Score': score}
+        for item_id, rank, neighbour, score in zip(*(column.tolist() for column in neighbours))
+    ]
+    for start in range(0, len(rows), WRITE_ROWS):
+        connection.execute(insert(table), rows[start:start + WRITE_ROWS])
+    return len(rows)
+
+
+def refresh(engine, full=False, state_dir=STATE_DIR):
+    """Builds or extends the model and writes changed neighbours; returns a summary dict."""
+    started = time.perf_counter()
+    model = None if full else Model.load(state_dir)
+    with engine.connect() as connection:
+        if model is None:
+            new = build(connection)
+            food_ids = restaurant_ids = None
+            food_rows = np.arange(new.foods.shape[0])
+            restaurant_rows = np.arange(new.restaurants.shape[0])
+        else:
+            order_foods, visits, newest = new_orders(connection, model.last_order_id)
+            new, touched_foods, touched_restaurants = extend(model, order_foods, visits, newest)
+            food_rows = affected(new.foods, touched_foods)
+            restaurant_rows = affected(new.restaurants, touched_restaurants)
+    counted = time.perf_counter()
+
+    food_top = top_neighbours(new.foods, food_rows)
+    restaurant_top = top_neighbours(new.restaurants, restaurant_rows)
+    if model is not None:
+        food_ids = changed_ids(top_neighbours(grow(model.foods, new.foods.shape[0]), food_rows), food_top)
+        restaurant_ids = changed_ids(
+            top_neighbours(grow(model.restaurants, new.restaurants.shape[0]), restaurant_rows), restaurant_top)
+    ranked = time.perf_counter()
+
+    with engine.begin() as connection:
+        food_written = write_neighbours(connection, FoodNeighbor, 'FoodID', food_top, food_ids)
+        restaurant_written = write_neighbours(connection, RestaurantNeighbor, 'RestaurantID', restaurant_top,
+                                              restaurant_ids)
+    new.save(state_dir)
+    return {
+        'mode': 'full' if model is None else 'incremental',
+        'orders_from': 0 if model is None else model.last_order_id, 'orders_to': new.last_order_id,
+        'food_pairs': new.foods.nnz, 'restaurant_pairs': new.restaurants.nnz,
+        'foods_rewritten': 'all' if food_ids is None else len(food_ids), 'food_rows': food_written,
+        'restaurants_rewritten': 'all' if restaurant_ids is None else len(restaurant_ids),
+        'restaurant_rows': restaurant_written,
+        'count_seconds': counted - started, 'rank_seconds': ranked - counted,
+        'write_seconds': time.perf_counter() - ranked,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute also-ordered dishes and similar restaurants.')
+    parser.add_argument('--full', action='store_true', help='rebuild from every order instead of the new ones')
+    parser.add_argument('--state-dir', default=STATE_DIR)
+    args = parser.parse_args(argv)
+
+    engine = engines.get('admin')
+    backend.prepare_schema(db.metadata, engine)
+    summary = refresh(engine, args.full, args.state_dir)
+    if summary['orders_to'] > summary['orders_from']:
+        print(f"  {summary['mode']} run over orders {summary['orders_from'] + 1}..{summary['orders_to']}")
+    else:
+        print(f"  {summary['mode']} run, no orders after {summary['orders_from']}")
+    print(f"  dishes       {summary['food_pairs']:>10} co-occurring pairs  "
+          f"{summary['foods_rewritten']!s:>8} rewritten ({summary['food_rows']} rows)")
+    print(f"  restaurants  {summary['restaurant_pairs']:>10} co-occurring pairs  "
+          f"{summary['restaurants_rewritten']!s:>8} rewritten ({summary['restaurant_rows']} rows)")
+    print(f"  count {summary['count_seconds']:.2f}s  rank {summary['rank_seconds']:.2f}s  "
+          f"write {summary['write_seconds']:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Per-request SQL profiling and slow-query log.
+
+init_profiler(app) hooks the SQLAlchemy Engine class, so every role engine
+(including lazily created ones and replicas) is covered. For a sampled
+request it counts statements and splits the wall time into database,
+JSON serialization and remaining Python time, reported as:
+
+    Server-Timing: db;dur=3.1;desc="4 queries", ser;dur=0.4, app;dur=1.2, total;dur=4.7
+
+Independently of sampling, any statement slower than SLOW_QUERY_MS is written
+to the slow-query log (JSON lines in the SLOW_QUERY_LOG file, otherwise the
+axolotl.slow_query logger) with the endpoint that issued it, and optionally
+its EXPLAIN plan (SLOW_QUERY_EXPLAIN=true, run on a background thread).
+
+Settings:
+    PROFILE_SAMPLE_RATE  fraction of requests that get a breakdown (default 0.1)
+    SLOW_QUERY_MS        slow statement threshold in ms (default 200)
+    SLOW_QUERY_LOG       path of the JSON-lines log
+    SLOW_QUERY_EXPLAIN   run EXPLAIN for slow SELECTs (default false)
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import Engine, event
+
+from app_logging import get_logger
+from fork_hooks import restart_in_child
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0.1'))
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG')
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', 'false').lower() == 'true'
+
+# Profile of the request being served on this thread (None when not sampled)
+_current = threading.local()
+_log_lock = threading.Lock()
+_slow_log = get_logger('slow_query')
+_explain_queue = queue.Queue(maxsize=100)
+
+
+class RequestProfile:
+    __slots__ = ('started', 'db_seconds', 'statements', 'serialize_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+        self.statements = 0
+        self.serialize_seconds = 0.0
+
+    def server_timing(self):
+        total = time.perf_counter() - self.started
+        app_seconds = max(0.0, total - self.db_seconds - self.serialize_seconds)
+        return (f'db;dur={self.db_seconds * 1000:.1f};desc="{self.statements} queries", '
+                f'ser;dur={self.serialize_seconds * 1000:.1f}, '
+                f'app;dur={app_seconds * 1000:.1f}, '
+                f'total;dur={total * 1000:.1f}')
+
+
+def current_profile():
+    return getattr(_current, 'profile', None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_start'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop('query_start')
+    profile = current_profile()
+    if profile is not None:
+        profile.statements += 1
+        profile.db_seconds += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        _log_slow_query(conn, statement, parameters, elapsed)
+
+
+def _log_slow_query(conn, statement, parameters, elapsed):
+    record = {
+        'ts': datetime.now(timezone.utc).isoformat(),
+        'duration_ms': round(elapsed * 1000, 2),
+        'statement': statement,
+        'endpoint': getattr(_current, 'endpoint', None),
+        'engine': conn.engine.url.render_as_string(hide_password=True),
+    }
+    # Parameters are left out on purpose: they include password hashes and message text
+    if SLOW_QUERY_EXPLAIN and statement.lstrip().upper().startswith('SELECT'):
+        try:
+            _explain_queue.put_nowait((conn.engine, statement, parameters, record))
+            return
+        except queue.Full:
+            record['explain'] = 'skipped (queue full)'
+    write_slow_query(record)
+
+
+def write_slow_query(record):
+    if not SLOW_QUERY_LOG:
+        _slow_log.warning("Slow query (%.1f ms) in %s: %s", record['duration_ms'], record['endpoint'],
+                          record['statement'], extra={k: v for k, v in record.items() if k != 'ts'})
+        return
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        with open(SLOW_QUERY_LOG, 'a') as f:
+            f.write(line + '\n')
+
+
+def explain(engine, statement, parameters):
+    """Returns the plan rows for a statement as a list of lists."""
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+    return [list(row) for row in rows]
+
+
+def _explain_worker():
+    while True:
+        engine, statement, parameters, record = _explain_queue.get()
+        try:
+            record['explain'] = explain(engine, statement, parameters)
+        except Exception as e:
+            record['explain'] = f'failed: {e}'
+        write_slow_query(record)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Adds the time spent in json.dumps to the current request profile."""
+
+    def dumps(self, obj, **kwargs):
+        profile = current_profile()
+        if profile is None:
+            return super().dumps(obj, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            profile.serialize_seconds += time.perf_counter() - started
+
+
+def init_profiler(app, sample_rate=PROFILE_SAMPLE_RATE):
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.json = TimedJSONProvider(app)
+
+    if SLOW_QUERY_EXPLAIN:
+        def start_explain_worker():
+            threading.Thread(target=_explain_worker, name='slow-query-explain', daemon=True).start()
+        start_explain_worker()
+        restart_in_child(start_explain_worker)
+
+    def start_profile():
+        _current.endpoint = f'{request.method} {request.url_rule.rule if request.url_rule else request.path}'
+        _current.profile = RequestProfile() if random.random() < sample_rate else None
+
+    def finish_profile(response):
+        profile = current_profile()
+        if profile is not None:
+            response.headers['Server-Timing'] = profile.server_timing()
+        return response
+
+    def clear_profile(exception=None):
+        _current.profile = None
+        _current.endpoint = None
+
+    # Run first on the way in and last on the way out so the whole request is covered
+    app.before_request_funcs.setdefault(None, []).insert(0, start_profile)
+    app.after_request_funcs.setdefault(None, []).insert(0, finish_profile)
+    app.teardown_request(clear_profile)
@@ -0,0 +1,97 @@
+"""
+Rebuilds the daily sales rollups behind /api/restaurants/<id>/analytics.
+
+create_order keeps Restaurant_Daily_Sales and Food_Daily_Sales current as
+orders arrive; this script recomputes them from Orders and Orders_Archive
+(and their FoodOrders lines), for the first fill after the migration or to
+repair them:
+
+    cd db_cloud_connection
+    python rollups.py                     # every day
+    python rollups.py --since 2024-06-01  # that day onwards
+
+Each table is rebuilt in one transaction with a single INSERT ... SELECT,
+so the grouping runs in the database. Orders without an OrderDate are not
+counted. Orders placed while a rebuild covering today runs may be counted
+twice or not at all; rebuild past days, or run it when orders are quiet.
+"""
+import argparse
+import sys
+import time
+from datetime import date, datetime
+
+from sqlalchemy import delete, func, insert, literal, select, union_all
+
+from api import (FoodDailySales, FoodOrders, FoodOrdersArchive, Orders, OrdersArchive, RestaurantDailySales,
+                 backend, db, engines)
+
+# (orders, lines) pairs holding the whole history
+SOURCES = [(Orders, FoodOrders), (OrdersArchive, FoodOrdersArchive)]
+
+
+def _dated(orders, since):
+    conditions = [orders.OrderDate.is_not(None)]
+    if since is not None:
+        conditions.append(orders.OrderDate >= datetime.combine(since, datetime.min.time()))
+    return conditions
+
+
+def restaurant_rows(since=None):
+    placed = union_all(*(
+        select(orders.RestaurantID.label('restaurant_id'), func.date(orders.OrderDate).label('day'),
+               orders.PriceTotal.label('revenue'),
+               func.coalesce(orders.Additional_Costs, literal(0)).label('additional_costs'))
+        .where(*_dated(orders, since))
+        for orders, _ in SOURCES
+    )).subquery()
+    return select(placed.c.restaurant_id, placed.c.day, func.count(), func.sum(placed.c.revenue),
+                  func.sum(placed.c.additional_costs)).group_by(placed.c.restaurant_id, placed.c.day)
+
+
+def food_rows(since=None):
+    lines = union_all(*(
+        select(orders.RestaurantID.label('restaurant_id'), func.date(orders.OrderDate).label('day'),
+               food_orders.FoodID.label('food_id'), food_orders.Quantity.label('quantity'))
+        .join(food_orders, food_orders.OrderID == orders.OrderID)
+        .where(*_dated(orders, since))
+        for orders, food_orders in SOURCES
+    )).subquery()
+    return select(lines.c.restaurant_id, lines.c.day, lines.c.food_id, func.count(),
+                  func.sum(lines.c.quantity)).group_by(lines.c.restaurant_id, lines.c.day, lines.c.food_id)
+
+
+def rebuild(engine, since=None):
+    """Recomputes both rollups from `since` (a date, or None for all); returns {table: (rows written, seconds)}."""
+    targets = [
+        (RestaurantDailySales, restaurant_rows(since),
+         ['RestaurantID', 'Day', 'OrderCount', 'Revenue', 'AdditionalCosts']),
+        (FoodDailySales, food_rows(since), ['RestaurantID', 'Day', 'FoodID', 'OrderCount', 'Quantity']),
+    ]
+    summary = {}
+    for model, rows, columns in targets:
+        started = time.perf_counter()
+        table = model.__table__
+        with engine.begin() as connection:
+            stale = delete(table)
+            if since is not None:
+                stale = stale.where(table.c.Day >= since)
+            connection.execute(stale)
+            count = connection.execute(insert(table).from_select(columns, rows)).rowcount
+        summary[model.__tablename__] = (count, time.perf_counter() - started)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild the daily sales rollups from the orders.')
+    parser.add_argument('--since', type=date.fromisoformat, help='first day to rebuild (YYYY-MM-DD)')
+    args = parser.parse_args(argv)
+
+    engine = engines.get('admin')
+    backend.prepare_schema(db.metadata, engine)
+    for name, (count, seconds) in rebuild(engine, args.since).items():
+        print(f"  {name:<24} {count:>10} rows  {seconds:7.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
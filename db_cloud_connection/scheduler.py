@@ -0,0 +1,121 @@
+"""
+Runs the periodic batch jobs in one long-lived process.
+
+    cd db_cloud_connection
+    python scheduler.py             # forever
+    python scheduler.py --once      # every enabled job once, e.g. from cron
+
+Jobs run one at a time in interval order. A job that overruns its interval
+runs again as soon as it finishes, without queueing the runs it missed. An
+error is logged and the job is retried at its next interval. Run a single
+scheduler per database: front_page keeps its scores in this process.
+
+Jobs (an interval of 0 disables one):
+    front_page       front_page.py                 FRONT_PAGE_INTERVAL_SECONDS (default 300)
+    recommendations  recommendations.py, incremental  RECOMMEND_INTERVAL_SECONDS (default 0)
+    archive          archive.py, default horizons  ARCHIVE_INTERVAL_SECONDS (default 0)
+    idempotency      expired Idempotency_Key rows  IDEMPOTENCY_PURGE_INTERVAL_SECONDS (default 3600),
+                     only with IDEMPOTENCY_STORE=database
+"""
+import argparse
+import os
+import sys
+import time
+
+from api import backend, db, engines, idempotency, log
+
+FRONT_PAGE_INTERVAL = float(os.getenv('FRONT_PAGE_INTERVAL_SECONDS', '300'))
+RECOMMEND_INTERVAL = float(os.getenv('RECOMMEND_INTERVAL_SECONDS', '0'))
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL_SECONDS', '0'))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv('IDEMPOTENCY_PURGE_INTERVAL_SECONDS', '3600'))
+
+
+class Job:
+    def __init__(self, name, seconds, run):
+        self.name = name
+        self.seconds = seconds
+        self.run = run
+        self.next_at = 0.0
+
+
+class Scheduler:
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.jobs = []
+        self.clock = clock
+        self.sleep = sleep
+
+    def add(self, name, seconds, run):
+        """Registers run() every `seconds`; the first run is due immediately."""
+        if seconds > 0:
+            self.jobs.append(Job(name, seconds, run))
+
+    def run_job(self, job):
+        started = self.clock()
+        try:
+            result = job.run()
+            log.info("Job %s finished in %.2fs: %s", job.name, self.clock() - started, result)
+        except Exception as e:
+            log.exception("Error running job %s: %s", job.name, e)
+        job.next_at = max(started + job.seconds, self.clock())
+
+    def run_due(self):
+        """Runs every job that is due; returns seconds until the next one."""
+        for job in sorted(self.jobs, key=lambda j: j.next_at):
+            if job.next_at <= self.clock():
+                self.run_job(job)
+        return max(0.0, min(job.next_at for job in self.jobs) - self.clock())
+
+    def run_forever(self):
+        while True:
+            self.sleep(self.run_due())
+
+
+def build_scheduler(engine):
+    scheduler = Scheduler()
+
+    if FRONT_PAGE_INTERVAL > 0:
+        from front_page import FrontPageRanker
+        ranker = FrontPageRanker()
+        scheduler.add('front_page', FRONT_PAGE_INTERVAL, lambda: ranker.run(engine))
+
+    if RECOMMEND_INTERVAL > 0:
+        # numpy/scipy are only needed when this job is enabled
+        import recommendations
+        scheduler.add('recommendations', RECOMMEND_INTERVAL, lambda: recommendations.refresh(engine))
+
+    if ARCHIVE_INTERVAL > 0:
+        import archive
+
+        def archive_all():
+            horizons = {'Messages': archive.MESSAGES_DAYS, 'Orders': archive.ORDERS_DAYS}
+            return {name: archive.archive_table(engine, target, horizons[name])[0]
+                    for name, target in archive.TARGETS.items()}
+        scheduler.add('archive', ARCHIVE_INTERVAL, archive_all)
+
+    if IDEMPOTENCY_PURGE_INTERVAL > 0 and idempotency.shared is not None:
+        scheduler.add('idempotency', IDEMPOTENCY_PURGE_INTERVAL, lambda: idempotency.shared.purge(engine))
+
+    return scheduler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the periodic batch jobs.')
+    parser.add_argument('--once', action='store_true', help='run every enabled job once and exit')
+    args = parser.parse_args(argv)
+
+    engine = engines.get('admin')
+    backend.prepare_schema(db.metadata, engine)
+    scheduler = build_scheduler(engine)
+    if not scheduler.jobs:
+        parser.error('no jobs enabled')
+    log.info("Scheduler started: %s", ', '.join(f'{job.name} every {job.seconds:g}s' for job in scheduler.jobs))
+    if args.once:
+        for job in scheduler.jobs:
+            scheduler.run_job(job)
+        return 0
+    scheduler.run_forever()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
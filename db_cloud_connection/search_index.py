@@ -0,0 +1,331 @@
+"""
+In-process full-text search over restaurants and their menus (/api/search).
+
+Every restaurant is one document with weighted fields: RestaurantName (3),
+Category (2), Address (1) and the FoodName of every dish on its menu (1).
+Text is lower-cased, accent-folded and split into alphanumeric tokens. All
+query tokens must match; the last one also matches as a prefix, so results
+come back while the user is still typing.
+
+Ranking is BM25 (k1=1.2, b=0.75). Each term keeps a posting dict
+{RestaurantID: weighted term frequency}; the first query for a term sorts
+its postings by score once and caches that list until a document containing
+the term changes. A query walks those lists with Fagin's threshold algorithm
+and stops as soon as no unseen restaurant can beat the current top k, so a
+query usually touches a handful of postings even at 100k restaurants.
+
+The average document length is fixed when the index is built, so cached
+scores stay consistent while restaurants are updated incrementally; periodic
+rebuilds (SEARCH_REFRESH_SECONDS) pick up changes made by other workers.
+
+Settings:
+    SEARCH_REFRESH_SECONDS  rebuild interval in seconds (default 0 = never)
+"""
+import bisect
+import functools
+import heapq
+import math
+import os
+import re
+import sys
+import threading
+import unicodedata
+
+REFRESH_SECONDS = float(os.getenv('SEARCH_REFRESH_SECONDS', '0'))
+
+K1 = 1.2
+B = 0.75
+
+FIELD_WEIGHTS = {'name': 3, 'category': 2, 'address': 1, 'menu': 1}
+
+# Prefixes expand to at most this many vocabulary terms (the most common ones)
+MAX_EXPANSIONS = 32
+
+# Recent query results kept until the next write
+RESULT_CACHE_SIZE = 10000
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+# Dish names and categories repeat across thousands of restaurants
+@functools.lru_cache(maxsize=65536)
+def tokenize(text):
+    if not text:
+        return ()
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return tuple(_TOKEN.findall(text.lower()))
+
+
+class SearchIndex:
+    def __init__(self):
+        self.restaurants = {}       # RestaurantID -> stored fields
+        self.menus = {}             # RestaurantID -> {FoodID: (FoodName, Price)}
+        self.postings = {}          # term -> {RestaurantID: weighted tf}
+        self.lengths = {}           # RestaurantID -> weighted document length
+        self.vocabulary = []        # sorted terms, for prefix expansion
+        self.avg_length = 1.0
+        self._ranked = {}           # term -> [(-tf score, RestaurantID)] best first
+        self._results = {}          # (tokens, limit) -> search() result
+        self._generation = 0        # bumped on every write; guards _results against stale fills
+        self._lock = threading.RLock()
+        # build() sorts the vocabulary once at the end instead of inserting term by term
+        self._bulk = False
+
+    @classmethod
+    def build(cls, restaurants, foods):
+        """Bulk build from (RestaurantID, RestaurantName, Category, Address, Rating)
+        and (FoodID, FoodName, Price, RestaurantID) rows."""
+        index = cls()
+        index._bulk = True
+        for food_id, name, price, restaurant_id in foods:
+            index.menus.setdefault(restaurant_id, {})[food_id] = (sys.intern(name or ''), price)
+        for restaurant_id, name, category, address, rating in restaurants:
+            index.restaurants[restaurant_id] = {
+                'RestaurantID': restaurant_id, 'RestaurantName': name, 'Category': category,
+                'Address': address, 'Rating': rating,
+            }
+            index._add_postings(restaurant_id)
+        index.avg_length = sum(index.lengths.values()) / len(index.lengths) if index.lengths else 1.0
+        index.vocabulary = sorted(index.postings)
+        index._bulk = False
+        return index
+
+    # ---- documents ----
+
+    def _terms(self, restaurant_id):
+        stored = self.restaurants[restaurant_id]
+        fields = [
+            ('name', stored['RestaurantName']),
+            ('category', stored['Category']),
+            ('address', stored['Address']),
+        ]
+        fields += [('menu', name) for name, _ in self.menus.get(restaurant_id, {}).values()]
+        terms = {}
+        for field, text in fields:
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(text):
+                terms[token] = terms.get(token, 0) + weight
+        return terms
+
+    # A restaurant's postings are always replaced as a whole: removed with the
+    # fields they were built from, then re-added. Cached ranked lists are
+    # patched in place rather than re-sorted, so writes stay cheap.
+
+    def _add_postings(self, restaurant_id):
+        terms = self._terms(restaurant_id)
+        self.lengths[restaurant_id] = sum(terms.values())
+        for term, tf in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                if not self._bulk:
+                    bisect.insort(self.vocabulary, term)
+            postings[restaurant_id] = tf
+            ranked = self._ranked.get(term)
+            if ranked is not None:
+                bisect.insort(ranked, (-self._tf_score(tf, restaurant_id), restaurant_id))
+        self._invalidate()
+
+    def _remove_postings(self, restaurant_id):
+        if restaurant_id not in self.restaurants:
+            return
+        for term in self._terms(restaurant_id):
+            postings = self.postings.get(term)
+            if postings is None or restaurant_id not in postings:
+                continue
+            tf = postings.pop(restaurant_id)
+            ranked = self._ranked.get(term)
+            if ranked is not None:
+                entry = (-self._tf_score(tf, restaurant_id), restaurant_id)
+                position = bisect.bisect_left(ranked, entry)
+                if position < len(ranked) and ranked[position] == entry:
+                    del ranked[position]
+            if not postings:
+                del self.postings[term]
+                self._ranked.pop(term, None)
+                position = bisect.bisect_left(self.vocabulary, term)
+                if position < len(self.vocabulary) and self.vocabulary[position] == term:
+                    del self.vocabulary[position]
+        self.lengths.pop(restaurant_id, None)
+        self._invalidate()
+
+    def _invalidate(self):
+        # Callers hold the lock
+        self._generation += 1
+        self._results.clear()
+
+    def upsert_restaurant(self, restaurant_id, name, category, address, rating):
+        with self._lock:
+            self._remove_postings(restaurant_id)
+            self.restaurants[restaurant_id] = {
+                'RestaurantID': restaurant_id, 'RestaurantName': name, 'Category': category,
+                'Address': address, 'Rating': rating,
+            }
+            self._add_postings(restaurant_id)
+
+    def remove_restaurant(self, restaurant_id):
+        with self._lock:
+            self._remove_postings(restaurant_id)
+            self.restaurants.pop(restaurant_id, None)
+            self.menus.pop(restaurant_id, None)
+
+    def upsert_food(self, food_id, name, price, restaurant_id):
+        with self._lock:
+            self._remove_postings(restaurant_id)
+            self.menus.setdefault(restaurant_id, {})[food_id] = (sys.intern(name or ''), price)
+            if restaurant_id in self.restaurants:
+                self._add_postings(restaurant_id)
+
+    def replace_menu(self, restaurant_id, foods):
+        """Swaps in a restaurant's whole menu, {FoodID: (name, price)}, re-indexing it once."""
+        with self._lock:
+            self._remove_postings(restaurant_id)
+            self.menus[restaurant_id] = {food_id: (sys.intern(name or ''), price)
+                                         for food_id, (name, price) in foods.items()}
+            if restaurant_id in self.restaurants:
+                self._add_postings(restaurant_id)
+
+    def remove_food(self, food_id, restaurant_id):
+        with self._lock:
+            self._remove_postings(restaurant_id)
+            self.menus.get(restaurant_id, {}).pop(food_id, None)
+            if restaurant_id in self.restaurants:
+                self._add_postings(restaurant_id)
+
+    # ---- queries ----
+
+    def _idf(self, term):
+        df = len(self.postings.get(term, ()))
+        n = len(self.restaurants)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def _tf_score(self, tf, restaurant_id):
+        norm = 1 - B + B * self.lengths.get(restaurant_id, self.avg_length) / self.avg_length
+        return tf * (K1 + 1) / (tf + K1 * norm)
+
+    def _ranked_list(self, term):
+        ranked = self._ranked.get(term)
+        if ranked is None:
+            with self._lock:
+                postings = self.postings.get(term, {})
+                ranked = sorted((-self._tf_score(tf, r), r) for r, tf in postings.items())
+                self._ranked[term] = ranked
+        return ranked
+
+    def expand(self, prefix):
+        """The most common vocabulary terms starting with prefix."""
+        vocabulary = self.vocabulary
+        matches = []
+        for position in range(bisect.bisect_left(vocabulary, prefix), len(vocabulary)):
+            term = vocabulary[position]
+            if not term.startswith(prefix):
+                break
+            matches.append((len(self.postings.get(term, ())), term))
+        return [term for _, term in heapq.nlargest(MAX_EXPANSIONS, matches)]
+
+    def _group(self, terms):
+        """One query token: its (idf, term) alternatives; a document scores its best one."""
+        return [(self._idf(term), term) for term in terms if term in self.postings]
+
+    def _group_score(self, group, restaurant_id):
+        best = None
+        for idf, term in group:
+            tf = self.postings.get(term, {}).get(restaurant_id)
+            if tf is not None:
+                score = idf * self._tf_score(tf, restaurant_id)
+                best = score if best is None or score > best else best
+        return best
+
+    def _term_stream(self, idf, term):
+        for negated, restaurant_id in self._ranked_list(term):
+            yield -idf * negated, restaurant_id
+
+    def _group_stream(self, group):
+        """(score, RestaurantID) for a token group, best first, each restaurant once."""
+        streams = [self._term_stream(idf, term) for idf, term in group]
+        seen = set()
+        for score, restaurant_id in heapq.merge(*streams, reverse=True):
+            if restaurant_id not in seen:
+                seen.add(restaurant_id)
+                yield score, restaurant_id
+
+    def search(self, query, limit=10):
+        """Top `limit` restaurants as [(score, RestaurantID)], best first."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        key = (tokens, limit)
+        cached = self._results.get(key)
+        if cached is None:
+            # Readers take no lock, so a write may land while this runs; its
+            # result is then returned but not cached
+            generation = self._generation
+            cached = self._search(tokens, limit)
+            with self._lock:
+                if generation == self._generation:
+                    if len(self._results) >= RESULT_CACHE_SIZE:
+                        self._results.clear()
+                    self._results[key] = cached
+        return cached
+
+    def _search(self, tokens, limit):
+        groups = [self._group([token]) for token in tokens[:-1]]
+        groups.append(self._group(self.expand(tokens[-1])))
+        if not all(groups):
+            return []
+
+        # Threshold algorithm: read every group's best-first stream in lockstep;
+        # score each new restaurant fully by lookup and stop once the k-th best
+        # beats the sum of the scores at the current depth
+        streams = [self._group_stream(group) for group in groups]
+        top = []
+        seen = set()
+        while True:
+            threshold = 0.0
+            for stream in streams:
+                entry = next(stream, None)
+                if entry is None:
+                    # Every restaurant matching all tokens is in this stream, so all were seen
+                    return sorted(top, reverse=True)
+                score, restaurant_id = entry
+                threshold += score
+                if restaurant_id in seen:
+                    continue
+                seen.add(restaurant_id)
+                total = 0.0
+                for group in groups:
+                    part = self._group_score(group, restaurant_id)
+                    if part is None:
+                        break
+                    total += part
+                else:
+                    if len(top) < limit:
+                        heapq.heappush(top, (total, restaurant_id))
+                    elif total > top[0][0]:
+                        heapq.heapreplace(top, (total, restaurant_id))
+            if len(top) >= limit and top[0][0] >= threshold:
+                return sorted(top, reverse=True)
+
+    def matched_foods(self, restaurant_id, query):
+        """Dishes on a restaurant's menu that contain any query token (the last as a prefix)."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        exact, prefix = set(tokens[:-1]), tokens[-1]
+        foods = []
+        for food_id, (name, price) in self.menus.get(restaurant_id, {}).items():
+            words = tokenize(name)
+            if any(w in exact or w.startswith(prefix) for w in words):
+                foods.append({'FoodID': food_id, 'FoodName': name, 'Price': price})
+        return foods
+
+    def results(self, query, limit=10):
+        """search() with the stored restaurant fields and matching dishes."""
+        return [
+            {**self.restaurants[restaurant_id], 'score': round(score, 4),
+             'matchedFoods': self.matched_foods(restaurant_id, query)}
+            for score, restaurant_id in self.search(query, limit)
+            if restaurant_id in self.restaurants
+        ]
+
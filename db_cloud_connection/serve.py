@@ -0,0 +1,80 @@
+"""
+Production server for api.py on gevent.
+
+    python serve.py --port 5000
+
+gevent's monkey patching makes sockets, threads, locks and sleeps
+cooperative, and PyMySQL is pure Python, so a request waiting on MySQL (or a
+client polling /api/customers/messages) parks a greenlet instead of holding
+an OS thread. One process can keep thousands of client connections open;
+--max-connections (SERVE_MAX_CONNECTIONS) caps how many are served at once.
+
+Database concurrency is still bounded by the role engine pools (see
+db_engines.py): greenlets beyond pool_size + max_overflow wait up to
+pool_timeout for a connection, so size the pools to what Cloud SQL allows,
+not to the number of clients.
+
+The SQLite backend runs here too, but sqlite3 is a C module and blocks the
+whole process while a statement runs; use it for local testing only.
+
+Settings:
+    SERVE_HOST               bind address (default 0.0.0.0)
+    SERVE_PORT               port (default 5000)
+    SERVE_MAX_CONNECTIONS    concurrent connections per process (default 5000)
+    SERVE_GRACEFUL_SECONDS   time given to in-flight requests on SIGTERM (default 10)
+"""
+# Must run before anything imports socket, threading or pymysql
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import os
+import signal
+import socket
+
+import gevent
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+import api
+from app_logging import get_logger
+
+log = get_logger('app')
+
+
+def build_server(host, port, max_connections):
+    # log=None: per-request access lines are what /metrics is for
+    server = WSGIServer((host, port), api.app, spawn=Pool(max_connections), log=None, error_log=log)
+    server.init_socket()
+    # pywsgi writes headers and body separately; without TCP_NODELAY keep-alive
+    # clients wait ~40 ms on Nagle/delayed ACK for every response.
+    # Accepted sockets inherit the option from the listener.
+    server.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve api.py with gevent.')
+    parser.add_argument('--host', default=os.getenv('SERVE_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('SERVE_PORT', '5000')))
+    parser.add_argument('--max-connections', type=int, default=int(os.getenv('SERVE_MAX_CONNECTIONS', '5000')))
+    parser.add_argument('--graceful-seconds', type=float, default=float(os.getenv('SERVE_GRACEFUL_SECONDS', '10')))
+    args = parser.parse_args(argv)
+
+    api.init_indexes()
+    server = build_server(args.host, args.port, args.max_connections)
+    # Stop accepting on SIGTERM/SIGINT and let in-flight requests finish
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        gevent.signal_handler(signum, server.stop, args.graceful_seconds)
+
+    log.info("Serving on %s:%d with gevent (max %d connections, %s backend)",
+             args.host, args.port, args.max_connections, api.backend.name)
+    server.serve_forever()
+    # Write queued messages before the pools go away
+    api.stop_message_writer()
+    api.engines.dispose_all()
+    api.router.dispose_replicas()
+
+
+if __name__ == '__main__':
+    main()
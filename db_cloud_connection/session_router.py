@@ -0,0 +1,284 @@
+"""
+Replica-aware session routing.
+
+RoutingSession picks an engine for every statement based on the role and the
+read/write mode that bind_database_role stores on flask.g:
+
+- writes (and anything flushed) go to the role's primary engine
+- GET/HEAD handlers read from one of the role's replicas, round robin
+- a user who just wrote is pinned to the primary for STICKY_SECONDS so they
+  read their own writes; the pin must reach whichever worker serves their
+  next request, so under gunicorn (APP_PREFORK) pins are kept in files
+  under DB_REPLICA_PIN_DIR that every worker on the host reads (FilePins).
+  A single process keeps them in memory (MemoryPins). With several hosts
+  behind a load balancer, point DB_REPLICA_PIN_DIR at storage they share
+  or use session affinity, or a write may be followed by a stale read
+- replicas that fail a health check or raise a disconnect error are taken out
+  of rotation until a later check succeeds; with none healthy reads fall back
+  to the primary
+
+Replicas are configured with either DB_REPLICA_HOSTS (host[:port] list for
+MySQL, file paths for the sqlite backend; same credentials as the primary) or
+DB_REPLICA_URLS (full SQLAlchemy URLs shared by every role, e.g. a local MySQL
+or sqlite:///replica.db for testing).
+
+Settings:
+    DB_REPLICA_STICKY_SECONDS   read-your-writes window (default 5)
+    DB_REPLICA_CHECK_INTERVAL   seconds between replica health checks (default 10)
+    DB_REPLICA_PIN_STORE        memory or file (default file under APP_PREFORK, else memory)
+    DB_REPLICA_PIN_DIR          directory of the file store (default <tmp>/db_replica_pins)
+"""
+import hashlib
+import itertools
+import os
+import tempfile
+import threading
+import time
+
+from flask import g, has_app_context
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from app_logging import get_logger
+from fork_hooks import gevent_patched
+
+log = get_logger('db')
+
+STICKY_SECONDS = float(os.getenv('DB_REPLICA_STICKY_SECONDS', '5'))
+CHECK_INTERVAL_SECONDS = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', '10'))
+PIN_STORE = os.getenv('DB_REPLICA_PIN_STORE') or (
+    'file' if os.getenv('APP_PREFORK', 'false').lower() == 'true' else 'memory')
+PIN_DIR = os.getenv('DB_REPLICA_PIN_DIR', os.path.join(tempfile.gettempdir(), 'db_replica_pins'))
+
+
+def replica_targets_from_env():
+    """Returns ('hosts', [...]), ('urls', [...]) or (None, [])."""
+    urls = [u.strip() for u in os.getenv('DB_REPLICA_URLS', '').split(',') if u.strip()]
+    if urls:
+        return 'urls', urls
+    hosts = [h.strip() for h in os.getenv('DB_REPLICA_HOSTS', '').split(',') if h.strip()]
+    if hosts:
+        return 'hosts', hosts
+    return None, []
+
+
+class ReplicaSet:
+    """Round-robin over the healthy replica engines of one role."""
+
+    def __init__(self, engines):
+        self.engines = list(engines)
+        self._down = set()
+        self._counter = itertools.count()
+        for engine in self.engines:
+            self._watch_errors(engine)
+
+    def _watch_errors(self, engine):
+        @event.listens_for(engine, 'handle_error')
+        def _on_error(context):
+            if context.is_disconnect or context.connection is None:
+                self.mark_down(engine)
+
+    def mark_down(self, engine):
+        if engine not in self._down:
+            log.warning("Marking replica %s down", engine.url.host or engine.url.database)
+        self._down.add(engine)
+
+    def mark_up(self, engine):
+        self._down.discard(engine)
+
+    def healthy(self):
+        return [e for e in self.engines if e not in self._down]
+
+    def pick(self):
+        """Returns a healthy replica engine, or None if all are down."""
+        healthy = self.healthy()
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    def check(self):
+        for engine in self.engines:
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text('SELECT 1'))
+                self.mark_up(engine)
+            except Exception:
+                self.mark_down(engine)
+
+
+class MemoryPins:
+    """Read-your-writes pins of this process: {user key: wall-clock end}."""
+
+    def __init__(self):
+        self._until = {}
+
+    def pin(self, user_key, until):
+        self._until[user_key] = until
+        # Drop expired pins now and then so the dict stays small
+        if len(self._until) > 10000:
+            now = time.time()
+            self._until = {k: v for k, v in self._until.items() if v > now}
+
+    def pinned_until(self, user_key):
+        return self._until.get(user_key, 0.0)
+
+
+class FilePins:
+    """Pins shared by the processes of one host: an empty file per user whose mtime is the pin's end.
+
+    A read is one stat(); expired files are removed every PURGE_EVERY pins.
+    """
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, directory=PIN_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._pins = itertools.count(1)
+
+    def _path(self, user_key):
+        return os.path.join(self.directory, hashlib.sha1(repr(user_key).encode('utf-8')).hexdigest())
+
+    def pin(self, user_key, until):
+        path = self._path(user_key)
+        try:
+            with open(path, 'a'):
+                pass
+            os.utime(path, (until, until))
+        except OSError as e:
+            log.warning("Could not pin %s to the primary: %s", user_key, e)
+        if next(self._pins) % self.PURGE_EVERY == 0:
+            self.purge()
+
+    def pinned_until(self, user_key):
+        try:
+            return os.stat(self._path(user_key)).st_mtime
+        except OSError:
+            return 0.0
+
+    def purge(self):
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime <= now:
+                    os.unlink(entry.path)
+            except OSError:
+                pass    # removed by another worker
+
+
+def pins_from_env(name=PIN_STORE):
+    if name == 'memory':
+        return MemoryPins()
+    if name == 'file':
+        return FilePins()
+    raise ValueError(f"Unknown DB_REPLICA_PIN_STORE '{name}' (expected 'memory' or 'file')")
+
+
+class SessionRouter:
+    """Maps (role, read/write) to an engine and tracks read-your-writes pins."""
+
+    def __init__(self, registry, replica_uri_for_role=None, replica_targets=(),
+                 sticky_seconds=STICKY_SECONDS, default_role='guest', pins=None):
+        self.registry = registry
+        self.replica_uri_for_role = replica_uri_for_role
+        self.replica_targets = list(replica_targets)
+        self.sticky_seconds = sticky_seconds
+        self.default_role = default_role
+        self._replicas = {}
+        self.pins = pins if pins is not None else pins_from_env()
+        self._lock = threading.Lock()
+        self._checker = None
+
+    @property
+    def has_replicas(self):
+        return bool(self.replica_targets)
+
+    def primary(self, role):
+        return self.registry.get(role)
+
+    def replica_set(self, role):
+        replica_set = self._replicas.get(role)
+        if replica_set is not None:
+            return replica_set
+        with self._lock:
+            replica_set = self._replicas.get(role)
+            if replica_set is None:
+                replica_set = ReplicaSet(
+                    self.registry.build_engine(role, self.replica_uri_for_role(role, target))
+                    for target in self.replica_targets
+                )
+                self._replicas[role] = replica_set
+        return replica_set
+
+    def replica(self, role):
+        if not self.has_replicas:
+            return self.primary(role)
+        return self.replica_set(role).pick() or self.primary(role)
+
+    def note_write(self, user_key):
+        # Wall-clock time, so the other processes can compare against it
+        self.pins.pin(user_key, time.time() + self.sticky_seconds)
+
+    def reads_pinned(self, user_key):
+        return self.pins.pinned_until(user_key) > time.time()
+
+    def check_replicas(self):
+        for replica_set in list(self._replicas.values()):
+            replica_set.check()
+
+    def start_health_checks(self, interval=CHECK_INTERVAL_SECONDS):
+        if not self.has_replicas or self._checker is not None:
+            return
+
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check_replicas()
+                except Exception as e:
+                    log.error("Replica health check failed: %s", e)
+
+        self._checker = threading.Thread(target=_loop, name='db-replica-health', daemon=True)
+        self._checker.start()
+
+    def replica_engines(self):
+        """Returns [(label, engine)] for the replica engines built so far."""
+        return [
+            (f'{role}_replica{i}', engine)
+            for role, replica_set in list(self._replicas.items())
+            for i, engine in enumerate(replica_set.engines)
+        ]
+
+    def dispose_replicas(self, close=True):
+        for replica_set in list(self._replicas.values()):
+            for engine in replica_set.engines:
+                engine.dispose(close=close)
+
+    def after_fork(self):
+        """Call in a forked child: fresh lock, replica pools and health checker."""
+        self._lock = threading.Lock()
+        self.dispose_replicas(close=False)
+        # Threads do not survive fork (greenlets do)
+        if self._checker is not None and not gevent_patched():
+            self._checker = None
+            self.start_health_checks()
+
+
+class RoutingSession(Session):
+    """Session whose get_bind asks the SessionRouter for an engine."""
+
+    def __init__(self, router=None, **kwargs):
+        super().__init__(**kwargs)
+        self.router = router
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        # Explicitly bound sessions (scripts, background jobs) keep their bind
+        if self.router is None or self.bind is not None:
+            return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+        role = g.get('db_role') if has_app_context() else None
+        if role is None:
+            return self.router.primary(self.router.default_role)
+        if self._flushing or not g.get('db_read_only', False):
+            return self.router.primary(role)
+        return self.router.replica(role)
@@ -0,0 +1,61 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+# api.py connects on import: point it at a scratch SQLite file, never a real database
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'archive.db')
+
+from sqlalchemy import delete, insert, select  # noqa: E402
+
+from api import FoodOrders, FoodOrdersArchive, Orders, OrdersArchive, engines  # noqa: E402
+from archive import TARGETS, archive_table, oldest_run  # noqa: E402
+
+NOW = datetime(2026, 3, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def engine():
+    engine = engines.get('admin')
+    with engine.begin() as connection:
+        for model in (FoodOrders, FoodOrdersArchive, Orders, OrdersArchive):
+            connection.execute(delete(model))
+    return engine
+
+
+def add_orders(engine, dates):
+    with engine.begin() as connection:
+        connection.execute(insert(Orders), [
+            {'OrderID': order_id, 'CustomerID': 1, 'RestaurantID': 1, 'PriceTotal': 10, 'OrderDate': date}
+            for order_id, date in enumerate(dates, start=1)])
+        connection.execute(insert(FoodOrders), [
+            {'OrderID': order_id, 'FoodID': 1, 'Quantity': 1} for order_id in range(1, len(dates) + 1)])
+
+
+def ids(engine, model):
+    with engine.connect() as connection:
+        return connection.execute(select(model.OrderID).order_by(model.OrderID)).scalars().all()
+
+
+def test_undated_legacy_orders_do_not_block_archival(engine):
+    old, recent = NOW - timedelta(days=800), NOW - timedelta(days=10)
+    add_orders(engine, [None] * 3 + [old] * 5 + [recent, old, recent])
+    cutoff = NOW - timedelta(days=730)
+    with engine.connect() as connection:
+        assert oldest_run(connection, TARGETS['Orders'], cutoff, 100) == [1, 2, 3, 4, 5, 6, 7, 8]
+
+    moved, _ = archive_table(engine, TARGETS['Orders'], 730, chunk_rows=3, now=NOW)
+    assert moved == 8
+    assert ids(engine, OrdersArchive) == list(range(1, 9))
+    assert ids(engine, FoodOrdersArchive) == list(range(1, 9))
+    # Stops at the first recent order, even with an old one behind it
+    assert ids(engine, Orders) == [9, 10, 11]
+
+
+def test_newest_row_stays_hot(engine):
+    add_orders(engine, [None, None])
+    moved, _ = archive_table(engine, TARGETS['Orders'], 730, now=NOW)
+    assert moved == 1
+    assert ids(engine, Orders) == [2]
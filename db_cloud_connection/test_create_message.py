@@ -0,0 +1,75 @@
+import os
+import tempfile
+import threading
+
+import pytest
+
+# api.py connects on import: point it at a scratch SQLite file, never a real database
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'create_message.db')
+
+from sqlalchemy import delete, insert, select  # noqa: E402
+
+import api  # noqa: E402
+from api import Customer, Messages, engines, generate_token  # noqa: E402
+from message_writer import MessageWriter  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    engine = engines.get('admin')
+    with engine.begin() as connection:
+        for model in (Messages, Customer):
+            connection.execute(delete(model))
+        connection.execute(insert(Customer), [
+            {'CustomerID': i, 'Username': f'user{i}', 'Password': 'x', 'Email': f'user{i}@example.com'}
+            for i in (1, 2)])
+    client = api.app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer ' + generate_token(1, 'customer')
+    return client
+
+
+def stored_ids():
+    with engines.get('admin').connect() as connection:
+        return connection.execute(select(Messages.MessageID).order_by(Messages.MessageID)).scalars().all()
+
+
+def test_slow_flush_is_acknowledged_as_queued(client, monkeypatch):
+    release = threading.Event()
+
+    def slow_write(rows):
+        release.wait(5)
+        api.write_message_batch(rows)
+
+    writer = MessageWriter(slow_write).start()
+    monkeypatch.setattr(api, 'write_behind', writer)
+    monkeypatch.setattr(api, 'write_ack', 'commit')
+    monkeypatch.setattr(api, 'MESSAGE_ACK_TIMEOUT_SECONDS', 0.05)
+    try:
+        body = {'recipientID': 2, 'contents': 'hello'}
+        headers = {'Idempotency-Key': 'slow-flush'}
+        first = client.post('/api/messages', json=body, headers=headers)
+        assert first.status_code == 202
+        message_id = first.get_json()['messageID']
+
+        # The key is kept: a retry replays the 202 instead of queueing the message again
+        retry = client.post('/api/messages', json=body, headers=headers)
+        assert retry.status_code == 202
+        assert retry.headers['Idempotent-Replayed'] == 'true'
+    finally:
+        release.set()
+        writer.close()
+    assert stored_ids() == [message_id]
+
+
+def test_synchronous_ids_skip_blocks_reserved_by_write_behind_workers(client):
+    assert api.write_behind is None
+    # Another worker in write-behind mode holds a block it has not written yet
+    other_worker = api.IdAllocator(lambda: engines.get('customer'), api.IdBlock.__table__, 'Messages',
+                                   Messages.MessageID)
+    reserved = other_worker.next_id()
+
+    ids = [client.post('/api/messages', json={'recipientID': 2, 'contents': f'm{i}'}).get_json()['messageID']
+           for i in range(3)]
+    assert not set(ids) & set(range(reserved, reserved + other_worker.block_size))
+    assert stored_ids() == sorted(ids)
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Index, Integer, MetaData, Table, create_engine, inspect
+
+from db_backends import MySQLBackend, SQLiteBackend
+
+
+def test_mysql_never_builds_the_engine_for_prepare_schema():
+    def engine():
+        raise AssertionError('admin engine built')
+    MySQLBackend({}, 'localhost', 3306, 'db').prepare_schema(MetaData(), engine)
+
+
+def test_sqlite_prepare_schema_takes_an_engine_or_a_callable(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'schema.db'))
+    engine = create_engine(backend.role_uri('admin'))
+    metadata = MetaData()
+    Table('Thing', metadata, Column('ThingID', Integer, primary_key=True), Column('Size', Integer),
+          Index('idx_thing_size', 'Size'))
+    backend.prepare_schema(metadata, lambda: engine)
+    assert [index['name'] for index in inspect(engine).get_indexes('Thing')] == ['idx_thing_size']
+
+    # Columns declared later are added to the existing table
+    Table('Thing', metadata, Column('Colour', Integer), extend_existing=True)
+    backend.prepare_schema(metadata, engine)
+    assert [c['name'] for c in inspect(engine).get_columns('Thing')] == ['ThingID', 'Size', 'Colour']
@@ -0,0 +1,50 @@
+import copy
+import json
+
+import pytest
+
+from db_engines import DEFAULT_POOL_CONFIG, fit_pool_config, load_pool_config
+
+
+def connections(config):
+    return sum(s['pool_size'] + s['max_overflow'] for s in config.values())
+
+
+def test_fitting_config_is_unchanged():
+    config = copy.deepcopy(DEFAULT_POOL_CONFIG)
+    assert fit_pool_config(config, connections(config)) == DEFAULT_POOL_CONFIG
+
+
+@pytest.mark.parametrize('max_connections, processes', [(60, 1), (100, 4), (500, 9), (37, 2)])
+def test_scaled_pools_fit_the_budget(max_connections, processes):
+    config = fit_pool_config(copy.deepcopy(DEFAULT_POOL_CONFIG), max_connections, processes)
+    assert connections(config) * processes <= max_connections
+    for role, settings in config.items():
+        assert 1 <= settings['pool_size'] <= DEFAULT_POOL_CONFIG[role]['pool_size']
+        assert settings['warmup'] <= settings['pool_size']
+        assert settings['pool_timeout'] == DEFAULT_POOL_CONFIG[role]['pool_timeout']
+
+
+def test_tiny_budget_keeps_one_connection_per_role():
+    config = fit_pool_config(copy.deepcopy(DEFAULT_POOL_CONFIG), 10, processes=8)
+    assert {s['pool_size'] for s in config.values()} == {1}
+    assert {s['max_overflow'] for s in config.values()} == {0}
+
+
+def test_load_pool_config_layers_file_env_and_budget(tmp_path, monkeypatch):
+    path = tmp_path / 'pools.json'
+    path.write_text(json.dumps({'guest': {'pool_size': 40, 'max_overflow': 0}, 'reports': {'pool_size': 2}}))
+    monkeypatch.setenv('DB_POOL_CONFIG', str(path))
+    monkeypatch.setenv('DB_POOL_GUEST_MAX_OVERFLOW', '8')
+    monkeypatch.setenv('DB_POOL_ADMIN_LAZY', 'no')
+    monkeypatch.delenv('DB_MAX_CONNECTIONS', raising=False)
+    config = load_pool_config()
+    assert (config['guest']['pool_size'], config['guest']['max_overflow']) == (40, 8)
+    assert config['admin']['lazy'] is False
+    assert config['reports'] == {'pool_size': 2}
+    assert DEFAULT_POOL_CONFIG['guest']['pool_size'] == 10
+
+    monkeypatch.setenv('DB_MAX_CONNECTIONS', '90')
+    monkeypatch.setenv('DB_WORKER_COUNT', '3')
+    monkeypatch.delenv('DB_POOL_CONFIG')
+    assert connections(load_pool_config()) <= 30
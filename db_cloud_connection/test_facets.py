@@ -0,0 +1,107 @@
+import random
+
+from facets import FACETS, FacetIndex, bits_of, iter_bits, page
+
+RESTAURANTS = [(1, 'Cafe', '$'), (2, 'Cafe', '$$'), (3, 'Diner', '$'), (4, 'Bar', '$$$'), (5, 'Diner', None)]
+CUISINES = [(1, 'Thai'), (2, 'Thai'), (2, 'Vegan'), (3, 'Vegan'), (4, 'Thai'), (5, 'Mexican'), (99, 'Thai')]
+FEATURES = [(1, 'Patio'), (3, 'Patio'), (4, 'Delivery')]
+
+
+def index():
+    return FacetIndex.build(RESTAURANTS, CUISINES, FEATURES, known={'feature': ['Parking']})
+
+
+def ids(bits):
+    return list(iter_bits(bits))
+
+
+def test_build_skips_unknown_restaurants_and_keeps_known_values():
+    facets = index()
+    assert ids(facets.all) == [1, 2, 3, 4, 5]
+    assert ids(facets.bitsets['cuisine']['Thai']) == [1, 2, 4]
+    assert facets.bitsets['feature']['Parking'] == 0
+    assert facets.values[5]['price'] == set()
+
+
+def test_any_and_all_within_a_facet():
+    facets = index()
+    result, _ = facets.query({'cuisine': ['Thai', 'Vegan']})
+    assert ids(result) == [1, 2, 3, 4]
+    result, _ = facets.query({'cuisine': ['Thai', 'Vegan']}, {'cuisine': 'all'})
+    assert ids(result) == [2]
+
+
+def test_counts_are_disjunctive_for_any_facets():
+    facets = index()
+    result, counts = facets.query({'cuisine': ['Thai'], 'category': ['Cafe']})
+    assert ids(result) == [1, 2]
+    # Cuisine counts ignore the cuisine filter but apply the category one
+    assert counts['cuisine'] == {'Mexican': 0, 'Thai': 2, 'Vegan': 1}
+    # and category counts the other way round
+    assert counts['category'] == {'Bar': 1, 'Cafe': 2, 'Diner': 0}
+    # Unfiltered facets count within the result
+    assert counts['feature'] == {'Delivery': 0, 'Parking': 0, 'Patio': 1}
+    assert counts['price'] == {'$': 1, '$$': 1, '$$$': 0}
+
+
+def test_all_mode_counts_within_the_result():
+    facets = index()
+    result, counts = facets.query({'cuisine': ['Thai']}, {'cuisine': 'all'})
+    assert counts['cuisine'] == {'Mexican': 0, 'Thai': 3, 'Vegan': 1}
+
+
+def test_counts_match_brute_force():
+    rng = random.Random(3)
+    values = {'cuisine': ['A', 'B', 'C', 'D'], 'feature': ['x', 'y', 'z'], 'category': ['p', 'q'], 'price': ['1', '2']}
+    restaurants = [(i, rng.choice(values['category']), rng.choice(values['price'])) for i in range(1, 300)]
+    cuisines = [(i, c) for i, _, _ in restaurants for c in values['cuisine'] if rng.random() < 0.3]
+    features = [(i, f) for i, _, _ in restaurants for f in values['feature'] if rng.random() < 0.4]
+    facets = FacetIndex.build(restaurants, cuisines, features)
+    has = {i: {f: set() for f in FACETS} for i, _, _ in restaurants}
+    for i, category, price in restaurants:
+        has[i]['category'].add(category)
+        has[i]['price'].add(price)
+    for facet, rows in (('cuisine', cuisines), ('feature', features)):
+        for i, name in rows:
+            has[i][facet].add(name)
+
+    filters = {'cuisine': ['A', 'C'], 'feature': ['x', 'y'], 'price': ['1']}
+    matches = {'feature': 'all'}
+
+    def matching(skip=None):
+        def keep(i, facet):
+            if facet == skip or facet not in filters:
+                return True
+            if matches.get(facet) == 'all':
+                return set(filters[facet]) <= has[i][facet]
+            return bool(set(filters[facet]) & has[i][facet])
+        return {i for i in has if all(keep(i, facet) for facet in FACETS)}
+
+    result, counts = facets.query(filters, matches)
+    assert set(ids(result)) == matching()
+    for facet in FACETS:
+        base = matching(skip=facet if facet in filters and matches.get(facet) != 'all' else None)
+        assert counts[facet] == {v: sum(v in has[i][facet] for i in base) for v in sorted(facets.bitsets[facet])}
+
+
+def test_set_values_and_remove_restaurant():
+    facets = index()
+    facets.set_values(3, 'category', ['Cafe'])
+    facets.set_values(7, 'price', ['$'])
+    assert ids(facets.bitsets['category']['Cafe']) == [1, 2, 3]
+    assert ids(facets.bitsets['category']['Diner']) == [5]
+    assert ids(facets.all) == [1, 2, 3, 4, 5, 7]
+    facets.remove_restaurant(1)
+    facets.remove_restaurant(42)
+    assert ids(facets.bitsets['cuisine']['Thai']) == [2, 4]
+    assert ids(facets.bitsets['price']['$']) == [3, 7]
+    assert 1 not in facets.values
+
+
+def test_bits_of_and_page():
+    bits = bits_of([3, 9, 64, 1000])
+    assert ids(bits) == [3, 9, 64, 1000]
+    assert bits_of([]) == 0
+    assert page(bits, limit=2) == ([3, 9], True)
+    assert page(bits, after=9, limit=2) == ([64, 1000], False)
+    assert page(bits, after=1000) == ([], False)
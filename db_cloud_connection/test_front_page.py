@@ -0,0 +1,120 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+# api.py connects on import: point it at a scratch SQLite file, never a real database
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'front_page.db')
+
+from sqlalchemy import delete, insert, select  # noqa: E402
+
+import front_page  # noqa: E402
+from api import FrontPage, FrontPageBoost, Orders, Restaurant, Review, engines  # noqa: E402
+from front_page import FrontPageRanker  # noqa: E402
+
+NOW = datetime(2026, 3, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def engine():
+    engine = engines.get('admin')
+    with engine.begin() as connection:
+        for model in (FrontPage, FrontPageBoost, Review, Orders, Restaurant):
+            connection.execute(delete(model))
+        connection.execute(insert(Restaurant), [{'RestaurantID': i, 'RestaurantName': f'R{i}'} for i in range(1, 6)])
+    return engine
+
+
+class Events:
+    def __init__(self, engine):
+        self.engine = engine
+        self.next_id = 1
+
+    def _add(self, model, **values):
+        with self.engine.begin() as connection:
+            connection.execute(insert(model).values(**values))
+        self.next_id += 1
+
+    def order(self, restaurant_id, hours_ago):
+        self._add(Orders, OrderID=self.next_id, CustomerID=1, RestaurantID=restaurant_id, PriceTotal=10,
+                  OrderDate=NOW - timedelta(hours=hours_ago))
+
+    def review(self, restaurant_id, rating, hours_ago):
+        self._add(Review, ReviewID=self.next_id, CustomerID=1, RestaurantID=restaurant_id, Rating=rating,
+                  Date=NOW - timedelta(hours=hours_ago))
+
+    def boost(self, restaurant_id, points, hours_ago):
+        self._add(FrontPageBoost, BoostID=self.next_id, RestaurantID=restaurant_id, Points=points,
+                  PurchasedAt=NOW - timedelta(hours=hours_ago))
+
+
+def scores(engine, now=NOW):
+    ranker = FrontPageRanker()
+    with engine.connect() as connection:
+        ranker.recompute(connection, now)
+    return ranker.totals()
+
+
+def test_points_halve_every_half_life(engine):
+    events = Events(engine)
+    events.order(1, 0)
+    events.order(1, front_page.HALF_LIFE_HOURS)
+    events.review(2, 5, 0)
+    events.review(3, 1, 2 * front_page.HALF_LIFE_HOURS)
+    events.boost(4, 100, front_page.BOOST_HALF_LIFE_HOURS)
+    # Outside the window
+    events.order(5, front_page.WINDOW_DAYS * 24 + 1)
+    totals = scores(engine)
+    assert totals[1] == pytest.approx(1.5 * front_page.ORDER_POINTS)
+    assert totals[2] == pytest.approx(2 * front_page.REVIEW_POINTS)
+    assert totals[3] == pytest.approx(-2 * front_page.REVIEW_POINTS / 4)
+    assert totals[4] == pytest.approx(50)
+    assert 5 not in totals
+
+
+def test_future_events_count_as_now(engine):
+    Events(engine).order(1, -5)
+    assert scores(engine)[1] == pytest.approx(front_page.ORDER_POINTS)
+
+
+def test_advance_matches_a_full_recompute(engine):
+    events = Events(engine)
+    for hours_ago, restaurant_id in ((50, 1), (30, 2), (10, 1), (5, 3)):
+        events.order(restaurant_id, hours_ago)
+    events.boost(2, 20, 40)
+    ranker = FrontPageRanker()
+    with engine.connect() as connection:
+        ranker.recompute(connection, NOW - timedelta(hours=4))
+    events.order(3, 2)
+    events.review(1, 4, 1)
+    with engine.connect() as connection:
+        assert ranker.advance(connection, NOW) == 2
+    expected = scores(engine)
+    assert ranker.totals() == pytest.approx(expected)
+
+
+def test_run_ranks_existing_restaurants_and_drops_the_rest(engine):
+    events = Events(engine)
+    for restaurant_id, orders in ((1, 3), (2, 1), (3, 2), (4, 5)):
+        for _ in range(orders):
+            events.order(restaurant_id, 1)
+    events.review(5, 1, 1)      # negative: never ranked
+    with engine.begin() as connection:
+        connection.execute(delete(Restaurant).where(Restaurant.RestaurantID == 4))
+
+    ranker = FrontPageRanker(slots=2)
+    summary = ranker.run(engine, now=NOW)
+    assert summary['mode'] == 'full'
+    with engine.connect() as connection:
+        rows = connection.execute(select(FrontPage.RestaurantID, FrontPage.SlotRank).order_by(FrontPage.SlotRank)).all()
+    assert [tuple(row) for row in rows] == [(1, 1), (3, 2)]
+
+    for _ in range(4):
+        events.order(2, 0)
+    summary = ranker.run(engine, now=NOW + timedelta(minutes=1))
+    assert (summary['mode'], summary['events'], summary['removed']) == ('incremental', 4, 1)
+    with engine.connect() as connection:
+        rows = connection.execute(select(FrontPage.RestaurantID, FrontPage.SlotRank).order_by(FrontPage.SlotRank)).all()
+    assert [tuple(row) for row in rows] == [(2, 1), (1, 2)]
@@ -0,0 +1,31 @@
+import os
+import tempfile
+
+# api.py connects on import: point it at a scratch SQLite file, never a real database
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'generate_data.db')
+
+from sqlalchemy import text  # noqa: E402
+
+from api import engines  # noqa: E402
+from generate_data import generate  # noqa: E402
+
+
+def totals():
+    with engines.get('admin').connect() as connection:
+        return connection.execute(text(
+            'SELECT (SELECT COUNT(*) FROM Orders), (SELECT SUM(OrderCount) FROM Restaurant_Daily_Sales), '
+            '(SELECT SUM(Quantity) FROM FoodOrders), (SELECT SUM(Quantity) FROM Food_Daily_Sales)'
+        )).one()
+
+
+def test_rollups_follow_the_generated_orders():
+    stats = generate(0.02, seed=1, truncate=True)
+    orders, rolled_up_orders, quantity, rolled_up_quantity = totals()
+    assert orders == stats['Orders'][0] > 0
+    assert (rolled_up_orders, rolled_up_quantity) == (orders, quantity)
+
+    # Regenerating only the orders at another scale replaces the rollups too
+    generate(0.01, seed=2, truncate=True, tables=['Orders'])
+    orders, rolled_up_orders, quantity, rolled_up_quantity = totals()
+    assert (rolled_up_orders, rolled_up_quantity) == (orders, quantity)
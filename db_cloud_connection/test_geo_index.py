@@ -0,0 +1,65 @@
+import random
+import time
+
+from geo_index import GridIndex, distance_km
+
+
+def random_points(n, seed=1, box=(40.55, -74.10, 40.90, -73.70)):
+    rng = random.Random(seed)
+    south, west, north, east = box
+    return [(i, rng.uniform(south, north), rng.uniform(west, east)) for i in range(1, n + 1)]
+
+
+def brute_force(points, lat, lon):
+    return sorted((distance_km(lat, lon, p_lat, p_lon), i) for i, p_lat, p_lon in points)
+
+
+def test_distance_km():
+    # Times Square to Prospect Park, about 9.5 km
+    assert abs(distance_km(40.7580, -73.9855, 40.6782, -73.9442) - 9.53) < 0.01
+    assert distance_km(10, 20, 10, 20) == 0
+
+
+def test_within_matches_brute_force():
+    points = random_points(3000)
+    index = GridIndex.build(points)
+    for lat, lon, radius in ((40.73, -73.99, 1.0), (40.60, -74.05, 3.5), (40.89, -73.71, 0.2)):
+        expected = [(round(d, 9), i) for d, i in brute_force(points, lat, lon) if d <= radius]
+        assert [(round(d, 9), i) for d, i in index.within(lat, lon, radius)] == expected
+        assert [i for _, i in index.within(lat, lon, radius, limit=5)] == [i for _, i in expected[:5]]
+
+
+def test_nearest_matches_brute_force():
+    points = random_points(3000, seed=2)
+    index = GridIndex.build(points)
+    for lat, lon in ((40.73, -73.99), (40.56, -74.09), (41.50, -73.00)):
+        assert [i for _, i in index.nearest(lat, lon, 10)] == [i for _, i in brute_force(points, lat, lon)[:10]]
+
+
+def test_nearest_with_more_wanted_than_indexed_returns_all_quickly():
+    points = [(1, 40.73, -73.99), (2, 40.74, -73.98), (3, 48.85, 2.35)]
+    index = GridIndex.build(points)
+    started = time.perf_counter()
+    found = index.nearest(40.73, -73.99, 10)
+    assert time.perf_counter() - started < 0.5
+    assert [i for _, i in found] == [1, 2, 3]
+    # From the other side of the world the circle takes in every longitude
+    assert sorted(i for _, i in index.nearest(-40.0, 170.0, 10)) == [1, 2, 3]
+
+
+def test_huge_radius_walks_populated_cells_only():
+    index = GridIndex.build([(1, 40.73, -73.99)])
+    started = time.perf_counter()
+    assert [i for _, i in index.within(40.73, -73.99, 20000)] == [1]
+    assert time.perf_counter() - started < 0.5
+
+
+def test_remove_and_move():
+    index = GridIndex.build([(1, 40.73, -73.99), (2, 40.74, -73.98)])
+    index.remove(1, 40.73, -73.99)
+    assert [i for _, i in index.nearest(40.73, -73.99, 5)] == [2]
+    index.move(2, (40.74, -73.98), (51.5, -0.12))
+    assert [i for _, i in index.within(51.5, -0.12, 1)] == [2]
+    # Added points widen the bounds nearest() stops at
+    assert [i for _, i in index.nearest(40.73, -73.99, 5)] == [2]
+    assert index.count == 1
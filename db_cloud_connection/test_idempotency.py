@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+from sqlalchemy import Column, DateTime, MetaData, SmallInteger, String, Table, Text, create_engine
+
+from idempotency import DatabaseStore, Idempotency, KeyConflict, KeyInFlight, MemoryStore
+
+OK = (201, b'{"OrderID": 1}', 'application/json')
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def key_table():
+    return Table('Idempotency_Key', MetaData(),
+                 Column('KeyHash', String(64), primary_key=True),
+                 Column('Fingerprint', String(64), nullable=False),
+                 Column('Status', SmallInteger),
+                 Column('ContentType', String(100)),
+                 Column('Body', Text),
+                 Column('ExpiresAt', DateTime, nullable=False))
+
+
+def test_memory_store_replays_and_rejects_other_requests():
+    store = MemoryStore()
+    assert store.claim('k', 'fp') is None
+    store.complete('k', OK)
+    assert store.claim('k', 'fp') == OK
+    with pytest.raises(KeyConflict):
+        store.claim('k', 'other')
+
+
+def test_memory_store_duplicate_waits_for_the_first_request():
+    store = MemoryStore()
+    assert store.claim('k', 'fp') is None
+    with pytest.raises(KeyInFlight):
+        store.claim('k', 'fp', wait=0.01)
+
+    replies = []
+    waiter = threading.Thread(target=lambda: replies.append(store.claim('k', 'fp', wait=5)))
+    waiter.start()
+    store.complete('k', OK)
+    waiter.join(5)
+    assert replies == [OK]
+
+
+def test_memory_store_release_lets_a_retry_run():
+    store = MemoryStore()
+    assert store.claim('k', 'fp') is None
+    store.release('k')
+    assert store.claim('k', 'fp') is None
+
+
+def test_memory_store_expires_and_evicts_oldest_first():
+    clock = Clock()
+    store = MemoryStore(ttl=10, max_keys=2, clock=clock)
+    for key in ('a', 'b', 'c'):
+        store.claim(key, 'fp')
+        store.complete(key, OK)
+    # Requests in flight are never evicted
+    store.claim('running', 'fp')
+    store.claim('d', 'fp')
+    assert list(store.entries) == ['b', 'c']
+    assert 'running' in store.running
+
+    clock.now = 11
+    assert store.claim('b', 'fp') is None
+    assert list(store.entries) == []
+
+
+class FailingStore:
+    def __init__(self):
+        self.calls = []
+
+    def claim(self, engine, key, fingerprint):
+        return None
+
+    def complete(self, engine, key, response):
+        self.calls.append('complete')
+        raise RuntimeError('database went away')
+
+    def release(self, engine, key):
+        self.calls.append('release')
+        raise RuntimeError('database went away')
+
+
+def test_finish_survives_a_shared_store_error():
+    shared = FailingStore()
+    idempotency = Idempotency(MemoryStore(), shared, engine_getter=lambda: None)
+    assert idempotency.begin('k', 'fp') is None
+    idempotency.finish('k', OK)
+    assert shared.calls == ['complete']
+    # The order was placed: this process still replays it
+    assert idempotency.begin('k', 'fp') == OK
+
+    assert idempotency.begin('failed', 'fp') is None
+    idempotency.finish('failed', (500, b'{}', 'application/json'))
+    assert shared.calls == ['complete', 'release']
+    assert idempotency.begin('failed', 'fp') is None
+
+
+def test_database_store_shares_responses_between_processes():
+    engine = create_engine('sqlite://')
+    table = key_table()
+    table.metadata.create_all(engine)
+    first = Idempotency(MemoryStore(), DatabaseStore(table, poll=0.01), lambda: engine)
+    second = Idempotency(MemoryStore(), DatabaseStore(table, poll=0.01), lambda: engine)
+
+    assert first.begin('k', 'fp') is None
+    with pytest.raises(KeyInFlight):
+        second.shared.claim(engine, 'k', 'fp', wait=0.02)
+    first.finish('k', OK)
+    assert second.begin('k', 'fp') == OK
+    with pytest.raises(KeyConflict):
+        second.begin('k', 'other')
+
+
+def test_database_store_lease_lets_another_process_take_over():
+    engine = create_engine('sqlite://')
+    table = key_table()
+    table.metadata.create_all(engine)
+    crashed = DatabaseStore(table, lease=0)
+    assert crashed.claim(engine, 'k', 'fp') is None
+    assert crashed.purge(engine) == 1
+    assert crashed.claim(engine, 'k', 'fp') is None
+    # The expired claim is taken over, with a fresh lease
+    taken = DatabaseStore(table)
+    assert taken.claim(engine, 'k', 'fp', wait=0) is None
+    with pytest.raises(KeyInFlight):
+        taken.claim(engine, 'k', 'fp', wait=0)
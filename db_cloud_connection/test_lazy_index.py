@@ -0,0 +1,26 @@
+from lazy_index import INDEXES, LazyIndex
+
+
+def test_built_once_on_first_use():
+    loads = []
+    index = LazyIndex('test index', lambda: loads.append(1) or {'n': len(loads)})
+    try:
+        assert index.value is None
+        assert index.get() == {'n': 1}
+        assert index.get() == {'n': 1}
+        assert index.rebuild() == {'n': 2}
+        assert index.get() == {'n': 2}
+    finally:
+        INDEXES.remove(index)
+
+
+def test_update_skips_unbuilt_and_swallows_errors():
+    index = LazyIndex('test index', lambda: [])
+    try:
+        index.update(lambda value: value.append('lost'))
+        assert index.get() == []
+        index.update(lambda value: value.append('kept'))
+        index.update(lambda value: 1 / 0)
+        assert index.get() == ['kept']
+    finally:
+        INDEXES.remove(index)
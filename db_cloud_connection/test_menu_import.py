@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from menu_import import MAX_ITEMS, MenuError, diff_menu, parse_menu
+
+
+def items(*entries):
+    return [{'FoodID': food_id, 'FoodName': name, 'Price': price} for food_id, name, price in entries]
+
+
+def test_parse_json_and_csv():
+    body = json.dumps({'items': [{'FoodID': 3, 'FoodName': ' Pad Thai ', 'Price': '11.5'},
+                                 {'FoodName': 'Soup', 'Price': 4}]}).encode()
+    assert parse_menu('application/json', body) == items((3, 'Pad Thai', 11.5), (None, 'Soup', 4.0))
+    csv_body = '﻿FoodID,FoodName,Price\n3,Pad Thai,11.5\n,Soup,4\n'.encode('utf-8')
+    assert parse_menu('text/csv; charset=utf-8', csv_body) == items((3, 'Pad Thai', 11.5), (None, 'Soup', 4.0))
+
+
+@pytest.mark.parametrize('body', [
+    b'not json',
+    b'{"items": {}}',
+    b'{"items": [1]}',
+    b'{"items": [{"FoodName": "", "Price": 1}]}',
+    b'{"items": [{"FoodName": "Soup", "Price": 0}]}',
+    b'{"items": [{"FoodName": "Soup", "Price": "Infinity"}]}',
+    b'{"items": [{"FoodName": "Soup", "Price": 1, "FoodID": "x"}]}',
+])
+def test_parse_rejects(body):
+    with pytest.raises(MenuError):
+        parse_menu('application/json', body)
+
+
+def test_parse_rejects_oversized_menu():
+    body = json.dumps({'items': [{'FoodName': 'Soup', 'Price': 1}] * (MAX_ITEMS + 1)}).encode()
+    with pytest.raises(MenuError, match='at most'):
+        parse_menu('application/json', body)
+
+
+def test_diff_by_id_and_by_name():
+    current = {1: ('Soup', 4.0), 2: ('Salad', 6.0), 3: ('Bread', 2.0), 4: ('Tea', 1.5)}
+    inserts, updates, deletes, unchanged = diff_menu(current, items(
+        (1, 'Soup', 4.001),       # same to the cent
+        (2, 'Green Salad', 6.0),  # renamed by ID
+        (None, 'Bread', 2.5),     # repriced, matched by name
+        (None, 'Cake', 5.0),      # new
+    ))
+    assert inserts == items((None, 'Cake', 5.0))
+    assert updates == items((2, 'Green Salad', 6.0), (3, 'Bread', 2.5))
+    assert deletes == [4]
+    assert unchanged == 1
+
+
+def test_diff_matches_duplicate_names_lowest_id_first():
+    current = {7: ('Soup', 4.0), 5: ('Soup', 4.0), 9: ('Soup', 4.0)}
+    inserts, updates, deletes, unchanged = diff_menu(current, items((9, 'Soup', 4.0), (None, 'Soup', 4.0)))
+    assert (inserts, updates, deletes, unchanged) == ([], [], [7], 2)
+
+
+def test_diff_rejects_unknown_and_repeated_ids():
+    current = {1: ('Soup', 4.0)}
+    with pytest.raises(MenuError, match='not on this menu'):
+        diff_menu(current, items((2, 'Soup', 4.0)))
+    with pytest.raises(MenuError, match='appears twice'):
+        diff_menu(current, items((1, 'Soup', 4.0), (1, 'Soup', 5.0)))
+
+
+def test_diff_empty_menu_deletes_everything():
+    assert diff_menu({3: ('Tea', 1.5), 1: ('Soup', 4.0)}, []) == ([], [], [1, 3], 0)
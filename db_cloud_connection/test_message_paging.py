@@ -0,0 +1,70 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+# api.py connects on import: point it at a scratch SQLite file, never a real database
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ['DB_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'message_paging.db')
+
+from sqlalchemy import delete, insert  # noqa: E402
+
+from api import Customer, Messages, MessagesArchive, app, engines, generate_token  # noqa: E402
+
+START = datetime(2026, 3, 1, 12, 0, 0)
+
+# (MessageID, minutes after START): write-behind blocks make IDs disagree with time
+HOT = [(101, 3), (102, 9), (103, 1), (201, 4), (202, 8), (203, 2), (301, 7)]
+# Archived by ID, yet some are newer than hot rows
+ARCHIVED = [(11, 0), (12, 5), (13, 6)]
+
+
+@pytest.fixture
+def client():
+    engine = engines.get('admin')
+    with engine.begin() as connection:
+        for model in (Messages, MessagesArchive, Customer):
+            connection.execute(delete(model))
+        connection.execute(insert(Customer), [
+            {'CustomerID': i, 'Username': f'user{i}', 'Password': 'x', 'Email': f'user{i}@example.com'}
+            for i in (1, 2)])
+        for model, rows in ((Messages, HOT), (MessagesArchive, ARCHIVED)):
+            connection.execute(insert(model), [
+                {'MessageID': message_id, 'SenderID': 1 + message_id % 2, 'RecipientID': 2 - message_id % 2,
+                 'Datetime': START + timedelta(minutes=minutes), 'Content': f'm{message_id}'}
+                for message_id, minutes in rows])
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer ' + generate_token(1, 'customer')
+    return client
+
+
+def newest_first():
+    return [message_id for message_id, _ in sorted(HOT + ARCHIVED, key=lambda row: (row[1], row[0]), reverse=True)]
+
+
+def page_through(client, path, limit):
+    ids, before = [], None
+    while True:
+        query = f'?limit={limit}' + (f'&before={before}' if before else '')
+        body = client.get(path + query).get_json()
+        ids += [m['MessageID'] for m in body['messages']]
+        before = body['nextBefore']
+        if before is None:
+            return ids
+
+
+@pytest.mark.parametrize('path', ['/api/customers/messages', '/api/customers/conversations/2/messages'])
+@pytest.mark.parametrize('limit', [1, 3, 4, 20])
+def test_pages_follow_time_across_the_archive(client, path, limit):
+    assert page_through(client, path, limit) == newest_first()
+
+
+def test_unpaged_matches_paged(client):
+    body = client.get('/api/customers/messages').get_json()
+    assert [m['MessageID'] for m in body['messages']] == newest_first()
+
+
+def test_malformed_cursor_is_rejected(client):
+    assert client.get('/api/customers/conversations/2/messages?before=102').status_code == 400
+    assert client.get('/api/customers/messages?before=soon,1').status_code == 400
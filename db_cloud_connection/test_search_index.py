@@ -0,0 +1,90 @@
+import math
+
+from search_index import B, K1, SearchIndex, tokenize
+
+
+def build():
+    restaurants = [
+        (1, 'Thai Garden', 'Thai', '1 Main St', 4.5),
+        (2, 'Pizza Palace', 'Italian', '2 Main St', 4.0),
+        (3, 'Bangkok Kitchen', 'Thai', '3 Side St', 3.5),
+        (4, 'Noodle Bar', 'Asian', '4 Side St', 4.2),
+    ]
+    foods = [
+        (10, 'Pad Thai', 11.5, 4),
+        (11, 'Margherita Pizza', 9.0, 2),
+        (12, 'Green Curry', 12.0, 3),
+    ]
+    return SearchIndex.build(restaurants, foods)
+
+
+def test_tokenize_folds_case_and_accents():
+    assert tokenize('Crème Brûlée, 2x!') == ('creme', 'brulee', '2x')
+    assert tokenize(None) == ()
+
+
+def test_bm25_matches_formula():
+    index = build()
+    # 'thai' is in the name (weight 3) and category (2) of restaurant 1
+    tf = 3 + 2
+    n, df = len(index.restaurants), len(index.postings['thai'])
+    idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+    norm = 1 - B + B * index.lengths[1] / index.avg_length
+    expected = idf * tf * (K1 + 1) / (tf + K1 * norm)
+
+    scores = dict((r, s) for s, r in index.search('thai', limit=10))
+    assert math.isclose(scores[1], expected)
+
+
+def test_field_weights_rank_name_over_menu():
+    index = build()
+    # Thai Garden has 'thai' in name and category; Noodle Bar only on its menu
+    ranked = [r for _, r in index.search('thai', limit=10)]
+    assert ranked[0] == 1
+    assert set(ranked) == {1, 3, 4}
+    assert ranked.index(1) < ranked.index(4)
+
+
+def test_all_tokens_must_match_and_last_is_a_prefix():
+    index = build()
+    assert [r for _, r in index.search('green cur')] == [3]
+    assert index.search('green pizza') == []
+    assert [r for _, r in index.search('pal')] == [2]
+
+
+def test_threshold_search_equals_exhaustive_scoring():
+    restaurants = [(i, f'Place {i}', 'Thai' if i % 3 else 'Pizza', f'{i} Road', 4.0) for i in range(1, 200)]
+    foods = [(1000 + i, 'Thai curry' if i % 5 == 0 else 'Pizza slice', 9.0, i) for i in range(1, 200)]
+    index = SearchIndex.build(restaurants, foods)
+    group = index._group(['thai'])
+    exhaustive = sorted(((index._group_score(group, r), r) for r in index.restaurants
+                         if index._group_score(group, r) is not None), reverse=True)[:5]
+    # Ties may come back in either order; the scores may not differ
+    assert [s for s, _ in index.search('thai', limit=5)] == [s for s, _ in exhaustive]
+
+
+def test_updates_invalidate_cached_results():
+    index = build()
+    assert [r for _, r in index.search('sushi')] == []
+    index.upsert_restaurant(5, 'Sushi Go', 'Japanese', '5 Main St', 4.8)
+    assert [r for _, r in index.search('sushi')] == [5]
+    index.remove_restaurant(5)
+    assert index.search('sushi') == []
+
+
+def test_result_computed_during_a_write_is_not_cached():
+    index = build()
+    search = index._search
+
+    def racing_search(tokens, limit):
+        # Computed from the old postings, then a write lands before it is cached
+        result = search(tokens, limit)
+        index.upsert_food(13, 'Thai iced tea', 3.0, 2)
+        return result
+
+    index._search = racing_search
+    stale = index.search('thai', limit=10)
+    index._search = search
+
+    assert 2 not in [r for _, r in stale]
+    assert 2 in [r for _, r in index.search('thai', limit=10)]
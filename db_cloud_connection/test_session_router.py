@@ -0,0 +1,36 @@
+import time
+
+from session_router import FilePins, MemoryPins, SessionRouter
+
+
+def test_file_pins_reach_another_router(tmp_path):
+    # Two routers with their own FilePins over one directory stand in for two gunicorn workers
+    writer = SessionRouter(None, sticky_seconds=5, pins=FilePins(str(tmp_path)))
+    reader = SessionRouter(None, sticky_seconds=5, pins=FilePins(str(tmp_path)))
+    user = ('customer', '7')
+
+    assert not reader.reads_pinned(user)
+    writer.note_write(user)
+    assert reader.reads_pinned(user)
+    assert not reader.reads_pinned(('customer', '8'))
+
+
+def test_file_pins_expire_and_purge(tmp_path):
+    pins = FilePins(str(tmp_path))
+    pins.pin(('restaurant', '3'), time.time() - 1)
+    pins.pin(('restaurant', '4'), time.time() + 60)
+    router = SessionRouter(None, pins=FilePins(str(tmp_path)))
+
+    assert not router.reads_pinned(('restaurant', '3'))
+    assert router.reads_pinned(('restaurant', '4'))
+    pins.purge()
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_memory_pins_stay_in_their_router():
+    writer = SessionRouter(None, sticky_seconds=5, pins=MemoryPins())
+    other = SessionRouter(None, sticky_seconds=5, pins=MemoryPins())
+    writer.note_write(('customer', '7'))
+
+    assert writer.reads_pinned(('customer', '7'))
+    assert not other.reads_pinned(('customer', '7'))